@@ -1,5 +1,11 @@
-from fastapi import APIRouter
-from state.optimisation import optimisation_service
+import json
+from typing import List, Optional
+
+from fastapi import APIRouter, Header, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from app.state.optimisation import optimisation_service
+from app.utils.admin import require_admin
 
 optimisation_router = APIRouter(prefix="/optimisation", tags=["Optimisation"])
 
@@ -8,7 +14,29 @@ optimisation_router = APIRouter(prefix="/optimisation", tags=["Optimisation"])
 def get_status(user_id: str = "demo-user"):
     return optimisation_service.get_status(user_id)
 
+class BulkStatusRequest(BaseModel):
+    user_ids: Optional[List[str]] = None
+    min_pending: Optional[float] = None
+    deadline_within_seconds: Optional[float] = None
+    risk_level: Optional[str] = None
+
+@optimisation_router.post("/status/bulk")
+def get_statuses(payload: BulkStatusRequest):
+    statuses = optimisation_service.get_statuses(
+        payload.user_ids, payload.min_pending, payload.deadline_within_seconds, payload.risk_level
+    )
+    lines = (json.dumps(status) + "\n" for status in statuses)
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
 @optimisation_router.post("/convert/now")
 def convert_now(user_id: str = "demo-user"):
     return optimisation_service.convert_now(user_id)
 
+@optimisation_router.post("/convert/due")
+def convert_due(request: Request, risk_level: Optional[str] = None, x_admin_token: Optional[str] = Header(None)):
+    """
+    Converts for every user past their max wait, optionally only one
+    risk_level (admin: it touches every user).
+    """
+    require_admin(request, x_admin_token)
+    return optimisation_service.convert_due(risk_level=risk_level)
@@ -1,6 +1,14 @@
-from fastapi import APIRouter
+import io
+import tempfile
+
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from state.salary import salary_service
+from app.state.payroll import (
+    DEFAULT_CHUNK_SIZE, FORMATS, ImportResumeRefused, ImportRunning, PayrollImport, load_progress,
+)
+from app.state.salary import salary_service
+from app.utils.admin import require_admin
 
 salary_router = APIRouter(prefix="/salary", tags=["Salary"])
 
@@ -9,5 +17,57 @@ class SalaryDepositRequest(BaseModel):
 
 @salary_router.post("/deposit")
 def deposit_salary(payload: SalaryDepositRequest,user_id: str = "demo-user"):
-    return salary_service.deposit_salary(user_id, payload.amount)
+    try:
+        return salary_service.deposit_salary(user_id, payload.amount)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+
+
+# bodies up to this size stay in memory, bigger ones are spooled to disk
+SPOOL_BYTES = 8 * 1024 * 1024
+
+@salary_router.post("/import")
+async def import_payroll(
+    request: Request,
+    job_id: str,
+    format: str | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    x_admin_token: str | None = Header(None),
+):
+    """
+    Payroll file as the raw request body (text/csv or application/x-ndjson).
+    Re-send the same file with the same job_id to resume a failed import.
+    """
+    require_admin(request, x_admin_token)
+    fmt = format or ("ndjson" if "ndjson" in request.headers.get("content-type", "") else "csv")
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=422, detail=f"format must be one of {FORMATS}")
+    if chunk_size <= 0:
+        raise HTTPException(status_code=422, detail="chunk_size must be positive")
+    try:
+        job = PayrollImport(job_id, chunk_size=chunk_size)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    except ImportResumeRefused as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as body:
+        async for chunk in request.stream():
+            body.write(chunk)
+        body.seek(0)
+        stream = io.TextIOWrapper(body, encoding="utf-8", newline="")
+        try:
+            return await run_in_threadpool(job.run, stream, fmt)
+        except (ImportRunning, ImportResumeRefused) as exc:
+            raise HTTPException(status_code=409, detail=str(exc))
 
+@salary_router.get("/import/{job_id}")
+def import_progress(job_id: str, request: Request, x_admin_token: str | None = Header(None)):
+    require_admin(request, x_admin_token)
+    try:
+        progress = load_progress(job_id)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    if progress is None:
+        raise HTTPException(status_code=404, detail=f"No import {job_id!r}")
+    return progress
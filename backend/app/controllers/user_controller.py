@@ -1,5 +1,8 @@
-from fastapi import APIRouter
-from state.user_state import default_user_state
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from app.utils.admin import require_admin
+from app.state.export import DEFAULT_CHUNK_SIZE, MEDIA_TYPES, export, parse_fields
+from app.state.user_state import default_user_state
 
 user_router =  APIRouter(prefix = "/user", tags=["User"])
 
@@ -7,6 +10,32 @@ user_router =  APIRouter(prefix = "/user", tags=["User"])
 
 def get_user_state(user_id: str = "demo-user"):
 
-    return default_user_state.get_state(user_id)
+    return default_user_state.to_dict(user_id)
 
 
+@user_router.get("/export")
+def export_user_states(
+    request: Request,
+    format: str = "ndjson",
+    fields: str | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    x_admin_token: str | None = Header(None),
+):
+    """
+    Every user's balances (int micro-USDC) as ndjson, csv or columnar,
+    streamed from a snapshot of the store. `fields` is comma-separated.
+    """
+    require_admin(request, x_admin_token)
+    if format not in MEDIA_TYPES:
+        raise HTTPException(status_code=422, detail=f"format must be one of {sorted(MEDIA_TYPES)}")
+    if chunk_size <= 0:
+        raise HTTPException(status_code=422, detail="chunk_size must be positive")
+    try:
+        names = parse_fields(fields)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    return StreamingResponse(
+        export(default_user_state, format, names, chunk_size),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="users.{"bin" if format == "columnar" else format}"'},
+    )
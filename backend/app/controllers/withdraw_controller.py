@@ -1,6 +1,9 @@
-from fastapi import APIRouter
+from typing import List
+
+from fastapi import APIRouter, Header, HTTPException, Request
 from pydantic import BaseModel
-from state.withdraw import withdraw_service
+from app.state.withdraw import InsufficientFunds, withdraw_service
+from app.utils.admin import require_admin
 
 withdraw_router = APIRouter(prefix="/withdraw", tags=["Withdraw"])
 
@@ -10,5 +13,30 @@ class WithdrawRequest(BaseModel):
 @withdraw_router.post("")
 
 def withdraw(payload: WithdrawRequest, user_id: str = "demo-user"):
-    return withdraw_service.withdraw(user_id, payload.amount)
+    try:
+        return withdraw_service.withdraw(user_id, payload.amount)
+    except InsufficientFunds as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+
+
+class Payout(BaseModel):
+    user_id: str
+    amount: float
+
+class BatchWithdrawRequest(BaseModel):
+    payouts: List[Payout]
+
+MAX_BATCH_PAYOUTS = 100_000
 
+@withdraw_router.post("/batch")
+def withdraw_batch(payload: BatchWithdrawRequest, request: Request, x_admin_token: str | None = Header(None)):
+    """
+    Payouts for many users in one pass (admin: it moves other users' money).
+    Returns per-payout success or failure.
+    """
+    require_admin(request, x_admin_token)
+    if len(payload.payouts) > MAX_BATCH_PAYOUTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_PAYOUTS} payouts per batch")
+    return withdraw_service.withdraw_batch((p.user_id, p.amount) for p in payload.payouts)
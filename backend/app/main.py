@@ -1,8 +1,16 @@
-from fastapi import FastAPI
+import json
+
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 
 
+from app.controllers.optimisation_controller import optimisation_router
+from app.controllers.salary_controller import salary_router
+from app.controllers.user_controller import user_router
+from app.controllers.withdraw_controller import withdraw_router
+from app.state.settings import settings_service
 from app.services.routing_service import (
     UserSettings,
     UserState,
@@ -10,11 +18,29 @@ from app.services.routing_service import (
     optimisation_tick,
     override_convert_now,
     MarketCondition,
+    settings_to_dict,
     state_to_dict,
 )
 from app.services.circle_wallets_service import get_crosspay_wallet_metadata
+from app.services.fx_feed import DEFAULT_FX_PAIR, fx_feed
+from app.services.market_classifier import market_classifier
+from app.services.fx_store import ROLLUPS, FxStore, to_columns
+from app.services.pair_routing import pair_router
+from app.services.gain_ledger import UserLedger, report, series_edges
+from app.services.policy_tables import PolicyCache, estimate_model
+from app.middleware.rate_limit import RateLimitMiddleware
+from app.middleware.metrics import MetricsMiddleware
+from app.utils.metrics import render_prometheus
+from app.utils.admin import require_admin
+from app.utils.data_dir import data_path
+from app.utils.profiler import ProfilerBusy, profiler, to_collapsed
+from app.utils.idempotency import IdempotencyCache, IdempotencyConflict, fingerprint
+from app.utils.versioned import Versioned, describe
 
 app = FastAPI()
+# Added before CORS so CORS stays outermost and 429s still carry CORS headers.
+app.add_middleware(RateLimitMiddleware, paths=("/api/optimise", "/api/circle"))
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -27,18 +53,99 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Routes over the per-user store (app/state), next to the demo ones below
+app.include_router(optimisation_router)
+app.include_router(salary_router)
+app.include_router(user_router)
+app.include_router(withdraw_router)
+
 
 
 # -------------------------------------------------
 # Simple in-memory state (fine for a hackathon)
 # -------------------------------------------------
-settings = UserSettings(
+# Immutable snapshots swapped on update: handlers read settings.current() once
+# and use that snapshot throughout, without locking
+settings = Versioned(UserSettings(
     instant_percent=0.4,        # default 40% instant
     max_wait_seconds=24 * 3600, # default 1 day wait
-)
+))
+risk_level = "safe"
 
 state = UserState()
 
+# Responses of mutating POSTs keyed by Idempotency-Key, so client retries
+# don't double-count money. In memory like `state` and pair_router: a cache
+# that outlived a restart would replay balances for state that is gone.
+idempotency_cache = IdempotencyCache()
+
+
+def _idempotent(route: str, key: str | None, payload: dict, fn):
+    """
+    Run `fn` once per Idempotency-Key; without a key, just run it.
+    """
+    if key is None:
+        return fn()
+    try:
+        return idempotency_cache.run(f"{route}:{key}", fingerprint(payload), fn)
+    except IdempotencyConflict as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+
+
+def _current_fx_rate(
+    client_rate: float | None = None,
+    fallback: float | None = None,
+    pair: str = DEFAULT_FX_PAIR,
+) -> float:
+    """
+    The server-side feed is authoritative; the client's rate (or `fallback`)
+    is only used until the first tick for the pair arrives.
+    """
+    rate = fx_feed.latest_rate(pair)
+    if rate is None:
+        rate = client_rate if client_rate is not None else fallback
+    if rate is None:
+        raise HTTPException(status_code=422, detail=f"No FX rate available for {pair}")
+    return rate
+
+
+def _current_market_condition(
+    client_condition: MarketCondition | None,
+    pair: str = DEFAULT_FX_PAIR,
+) -> MarketCondition:
+    """
+    Derived from the FX feed once the classifier has warmed up;
+    until then the client's condition (or OK) is used.
+    """
+    condition = market_classifier.condition(pair)
+    if condition is None:
+        condition = client_condition or MarketCondition.OK
+    return condition
+
+
+# Every tick is also persisted for backtests and dashboards (see /api/fx/history)
+fx_store = FxStore(data_path("fx"))
+
+fx_feed.subscribe(market_classifier.on_tick)
+fx_feed.subscribe(fx_store.on_tick)
+
+# Optimal convert fractions per (max wait, risk level), solved offline against
+# the regime model the classifier estimates from the feed
+policy_cache = PolicyCache(data_path("policy"))
+
+
+@app.on_event("startup")
+def start_fx_feed():
+    fx_feed.start_from_env()
+    policy_cache.start_refresh(lambda: estimate_model(market_classifier.regime_history(DEFAULT_FX_PAIR)))
+
+
+@app.on_event("shutdown")
+def stop_fx_feed():
+    fx_feed.stop()
+    fx_store.close()
+    policy_cache.stop()
+
 
 # -------------------------------------------------
 # Request models
@@ -56,14 +163,162 @@ class DepositRequest(BaseModel):
 
 
 class OptimiseRequest(BaseModel):
-    market_condition: MarketCondition
-    current_fx_rate: float
+    # Both only used while the server has no (warmed-up) FX feed for the pair
+    market_condition: MarketCondition | None = None
+    current_fx_rate: float | None = None
+
+
+class PairDepositRequest(BaseModel):
+    amount: float
+    # falls back to the feed's latest rate for the pair
+    fx_rate_at_deposit: float | None = None
+
+    instant_percent: float | None = None
+    max_wait_seconds: int | None = None
+    # aggressive / balanced / safe: picks the user's policy table
+    risk_level: str | None = None
+    rent_weight: float | None = None
+    savings_weight: float | None = None
+    investing_weight: float | None = None
+
+
+class BulkStatusRequest(BaseModel):
+    # every filter is optional; they combine with AND
+    user_ids: list[str] | None = None
+    min_pending: float | None = None
+    deadline_within_seconds: float | None = None
+    currency: str | None = None
+
+
+class ReallocateRequest(BaseModel):
+    # bucket name -> weight, e.g. {"rent": 0.4, "savings": 0.2, "investing": 0.3, "emergency": 0.1}
+    weights: dict[str, float]
+    # None = every user
+    user_ids: list[str] | None = None
+
+
+class ShardUsersRequest(BaseModel):
+    user_ids: list[str]
+
+
+class ShardImportRequest(BaseModel):
+    # PairRouter.export_users() records
+    users: list[dict]
+
+
+class FxTickRequest(BaseModel):
+    rate: float
+    pair: str = DEFAULT_FX_PAIR
+    ts: float | None = None
 
 
 # -------------------------------------------------
 # Routes
 # -------------------------------------------------
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Prometheus scrape endpoint: per-route and per-stage latency histograms,
+    deposit/conversion counters.
+    """
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/api/admin/profile", response_class=PlainTextResponse)
+def run_profiler(
+    request: Request,
+    seconds: float = 10.0,
+    interval_ms: float = 5.0,
+    only_app: bool = False,
+    x_admin_token: str | None = Header(None),
+):
+    """
+    Samples all thread stacks every `interval_ms` (at least 1 ms) for
+    `seconds` and returns collapsed stacks for a flamegraph. only_app=true
+    keeps stacks touching app/* frames.
+    """
+    require_admin(request, x_admin_token)
+    try:
+        stacks = profiler.profile(seconds, interval=interval_ms / 1000, only_app=only_app)
+    except ProfilerBusy as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    return PlainTextResponse(to_collapsed(stacks))
+
+
+# Shard handoff, used by app/shard_router.py to move users to a new shard
+@app.get("/api/admin/shard/users")
+def list_shard_users(request: Request, x_admin_token: str | None = Header(None)):
+    require_admin(request, x_admin_token)
+    return {"userIds": pair_router.user_ids()}
+
+
+@app.post("/api/admin/shard/export")
+def export_shard_users(req: ShardUsersRequest, request: Request, x_admin_token: str | None = Header(None)):
+    require_admin(request, x_admin_token)
+    return {"users": pair_router.export_users(req.user_ids)}
+
+
+@app.post("/api/admin/shard/import")
+def import_shard_users(req: ShardImportRequest, request: Request, x_admin_token: str | None = Header(None)):
+    require_admin(request, x_admin_token)
+    return {"imported": pair_router.import_users(req.users)}
+
+
+@app.post("/api/admin/shard/drop")
+def drop_shard_users(req: ShardUsersRequest, request: Request, x_admin_token: str | None = Header(None)):
+    require_admin(request, x_admin_token)
+    return {"dropped": pair_router.drop_users(req.user_ids)}
+
+
+@app.get("/api/fx")
+def get_fx_rate(pair: str = DEFAULT_FX_PAIR, window_seconds: float = 0):
+    """
+    Latest server-side FX rate and market statistics for `pair`,
+    plus the ticks of the last `window_seconds` when asked for.
+    """
+    latest = fx_feed.latest(pair)
+    if latest is None:
+        raise HTTPException(status_code=404, detail=f"No FX ticks for {pair}")
+    resp = {"pair": pair, "ts": latest[0], "rate": latest[1]}
+    stats = market_classifier.stats(pair)
+    if stats is not None:
+        resp["market"] = {**stats.__dict__, "warmedUp": market_classifier.condition(pair) is not None}
+    if window_seconds > 0:
+        timestamps, rates = fx_feed.window(pair, window_seconds)
+        resp["window"] = {"ts": timestamps, "rate": rates}
+    return resp
+
+
+@app.get("/api/fx/history")
+def get_fx_history(start: float, end: float, pair: str = DEFAULT_FX_PAIR, rollup: str | None = "1m"):
+    """
+    Stored FX history between `start` and `end` (unix seconds).
+    rollup is one of 1m/1h/1d (OHLC bars) or "raw" for every tick.
+    """
+    if rollup == "raw":
+        rollup = None
+    elif rollup not in ROLLUPS:
+        raise HTTPException(status_code=422, detail=f"rollup must be raw or one of {sorted(ROLLUPS)}")
+    try:
+        records = fx_store.range(pair, start, end, rollup)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    return {"pair": pair, "rollup": rollup or "raw", **to_columns(records)}
+
+
+@app.post("/api/fx/tick")
+def publish_fx_tick(req: FxTickRequest, request: Request, x_admin_token: str | None = Header(None)):
+    """
+    Push a tick into the FX feed (for demos and internal publishers).
+    """
+    require_admin(request, x_admin_token)
+    if req.rate <= 0:
+        raise HTTPException(status_code=422, detail="FX rate must be positive")
+    fx_feed.publish(req.pair, req.rate, req.ts)
+    return {"pair": req.pair, "rate": fx_feed.latest_rate(req.pair)}
+
+
 @app.get("/api/circle/wallet")
 def get_circle_wallet():
     """
@@ -81,61 +336,261 @@ def get_current_state():
     return state_to_dict(state)
 
 
+@app.get("/api/settings")
+def get_settings(history: bool = False, user_id: str | None = None):
+    """
+    Active settings and their version; `history=true` adds the recently
+    replaced versions (oldest first) for audit. With `user_id`, the same for
+    that user of the per-user store (app/state).
+    """
+    if user_id is not None:
+        resp = settings_service.current(user_id)
+        if resp is None:
+            raise HTTPException(status_code=404, detail=f"Unknown user {user_id!r}")
+        if history:
+            resp["history"] = settings_service.history(user_id)
+        return resp
+    resp = describe(settings.current(), settings_to_dict)
+    if history:
+        resp["history"] = [describe(snapshot, settings_to_dict) for snapshot in settings.history()[:-1]]
+    return resp
+
+
+@app.get("/api/gains")
+def get_gains(start: float, end: float, step: float | None = None, tranches: bool = False):
+    """
+    Converted amount and FX gain vs. converting instantly between `start`
+    and `end` (unix seconds). step=86400 adds a per-day series;
+    tranches=true lists the individual conversions (last 100).
+    """
+    try:
+        edges = series_edges(start, end, step)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    ledger = state.tranches or UserLedger()
+    resp = {"start": start, "end": end, **report(ledger.totals(edges), edges)}
+    if tranches:
+        resp["tranchesList"] = ledger.tranches(start, end)
+    return resp
+
+
 @app.post("/api/salary/deposit")
-def deposit_salary(req: DepositRequest):
+def deposit_salary(req: DepositRequest, idempotency_key: str | None = Header(None)):
     """
     Called when a new salary arrives.
     - Optionally updates user settings from the request
     - Splits amount into instant vs optimised
     - Updates buckets and FX baseline
+    Retries with the same Idempotency-Key return the first response.
     """
+    return _idempotent("deposit", idempotency_key, req.dict(), lambda: _deposit_salary(req))
+
 
-    # Update settings if overrides are provided
-    if req.instant_percent is not None:
-        settings.instant_percent = req.instant_percent
-    if req.max_wait_seconds is not None:
-        settings.max_wait_seconds = req.max_wait_seconds
-    if req.rent_weight is not None:
-        settings.rent_weight = req.rent_weight
-    if req.savings_weight is not None:
-        settings.savings_weight = req.savings_weight
-    if req.investing_weight is not None:
-        settings.investing_weight = req.investing_weight
+def _deposit_salary(req: DepositRequest):
 
-    return allocate_salary(
+    # Update settings if overrides are provided (a new version; invalid weights are rejected)
+    try:
+        snapshot = settings.update(lambda current: current.with_changes(
+            instant_percent=req.instant_percent,
+            max_wait_seconds=req.max_wait_seconds,
+            rent_weight=req.rent_weight,
+            savings_weight=req.savings_weight,
+            investing_weight=req.investing_weight,
+        ))
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+
+    resp = allocate_salary(
         amount=req.amount,
-        settings=settings,
+        settings=snapshot.value,
         state=state,
         fx_rate_at_deposit=req.fx_rate_at_deposit,
     )
+    return {**resp, "settingsVersion": snapshot.version}
 
 
 @app.post("/api/optimise")
-def run_optimisation(req: OptimiseRequest):
+def run_optimisation(req: OptimiseRequest, idempotency_key: str | None = Header(None)):
     """
     Called when:
     - your backend "tick" runs, or
     - the user clicks an 'optimise now' button (market-aware)
     """
-    return optimisation_tick(
-        settings=settings,
+    return _idempotent("optimise", idempotency_key, req.dict(), lambda: _run_optimisation(req))
+
+
+def _run_optimisation(req: OptimiseRequest):
+    snapshot = settings.current()
+    resp = optimisation_tick(
+        settings=snapshot.value,
         state=state,
-        market_condition=req.market_condition,
-        current_fx_rate=req.current_fx_rate,
+        market_condition=_current_market_condition(req.market_condition),
+        current_fx_rate=_current_fx_rate(req.current_fx_rate),
+        policy=policy_cache.get(snapshot.value.max_wait_seconds, risk_level),
     )
+    return {**resp, "settingsVersion": snapshot.version}
 
 
 @app.post("/api/override")
-def override_convert_all():
+def override_convert_all(idempotency_key: str | None = Header(None)):
     """
     Called when the user hits 'convert everything now'.
     Ignores market condition and wait time.
     """
-    # for demo, you can treat FX as 1.0 or let frontend send it later
-    current_fx_rate = 1.0
+    return _idempotent("override", idempotency_key, {}, _override_convert_all)
+
 
-    return override_convert_now(
-        settings=settings,
+def _override_convert_all():
+    # 1.0 only until the FX feed has a rate for the pair
+    current_fx_rate = _current_fx_rate(fallback=1.0)
+    snapshot = settings.current()
+
+    resp = override_convert_now(
+        settings=snapshot.value,
         state=state,
         current_fx_rate=current_fx_rate,
     )
+    return {**resp, "settingsVersion": snapshot.version}
+
+
+# -------------------------------------------------
+# Multi-currency routes (per user, per local currency)
+# -------------------------------------------------
+def _pair(currency: str) -> str:
+    """Salaries are paid in USDC, so "BRL" -> "USDC/BRL"."""
+    return f"USDC/{currency.upper()}"
+
+
+@app.get("/api/pairs/state")
+def get_pair_state(user_id: str = "demo-user"):
+    """
+    Balances and buckets for one user, with pending/baseline/gain per currency.
+    """
+    return pair_router.user_to_dict(user_id)
+
+
+@app.post("/api/pairs/{currency}/deposit")
+def deposit_salary_for_pair(
+    currency: str,
+    req: PairDepositRequest,
+    user_id: str = "demo-user",
+    idempotency_key: str | None = Header(None),
+):
+    """
+    Salary deposit whose optimised part will be converted into `currency`.
+    """
+    def run():
+        pair = _pair(currency)
+        try:
+            pair_router.update_settings(
+                user_id,
+                instant_percent=req.instant_percent,
+                max_wait_seconds=req.max_wait_seconds,
+                rent_weight=req.rent_weight,
+                savings_weight=req.savings_weight,
+                investing_weight=req.investing_weight,
+                risk_level=req.risk_level,
+            )
+        except ValueError as exc:
+            raise HTTPException(status_code=422, detail=str(exc))
+        return pair_router.allocate_salary(
+            user_id=user_id,
+            pair=pair,
+            amount=req.amount,
+            fx_rate_at_deposit=_current_fx_rate(req.fx_rate_at_deposit, pair=pair),
+        )
+
+    return _idempotent(f"pair-deposit:{user_id}:{currency}", idempotency_key, req.dict(), run)
+
+
+@app.post("/api/pairs/{currency}/optimise")
+def run_pair_optimisation(currency: str, req: OptimiseRequest, idempotency_key: str | None = Header(None)):
+    """
+    One batch optimisation step for every user holding `currency`.
+    """
+    pair = _pair(currency)
+    return _idempotent(
+        f"pair-optimise:{currency}",
+        idempotency_key,
+        req.dict(),
+        lambda: pair_router.optimisation_tick(
+            pair=pair,
+            market_condition=_current_market_condition(req.market_condition, pair=pair),
+            current_fx_rate=_current_fx_rate(req.current_fx_rate, pair=pair),
+            # one table per (max wait, risk level) group of the pair's users
+            policy=policy_cache.get,
+        ),
+    )
+
+
+@app.post("/api/pairs/status")
+def bulk_pair_status(req: BulkStatusRequest):
+    """
+    Optimisation status (pending, progress, timeLeft, deadline) for many
+    users at once, streamed as NDJSON: one line per (user, currency).
+    """
+    statuses = pair_router.bulk_status(
+        user_ids=req.user_ids,
+        min_pending=req.min_pending,
+        deadline_within=req.deadline_within_seconds,
+        pair=_pair(req.currency) if req.currency else None,
+    )
+
+    def lines():
+        batch = []
+        for status in statuses:
+            batch.append(json.dumps(status))
+            if len(batch) == 1000:
+                yield "\n".join(batch) + "\n"
+                batch = []
+        if batch:
+            yield "\n".join(batch) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.post("/api/pairs/reallocate")
+def reallocate_pairs(req: ReallocateRequest, idempotency_key: str | None = Header(None)):
+    """
+    New bucket weights for many users; their existing bucket balances are
+    rebalanced to the new weights (totals unchanged).
+    """
+    def run():
+        try:
+            return pair_router.reallocate(req.user_ids, req.weights)
+        except ValueError as exc:
+            raise HTTPException(status_code=422, detail=str(exc))
+
+    return _idempotent("pair-reallocate", idempotency_key, req.dict(), run)
+
+
+@app.get("/api/pairs/gains")
+def get_pair_gains(
+    start: float,
+    end: float,
+    user_id: str = "demo-user",
+    currency: str | None = None,
+    step: float | None = None,
+):
+    """
+    Per-currency gain report for one user, same range/step rules as /api/gains.
+    """
+    try:
+        edges = series_edges(start, end, step)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    pair = _pair(currency) if currency else None
+    return {"start": start, "end": end, **pair_router.gain_report(user_id, edges, pair=pair)}
+
+
+@app.post("/api/pairs/override")
+def override_pairs(user_id: str = "demo-user", currency: str | None = None, idempotency_key: str | None = Header(None)):
+    """
+    Convert everything a user has pending (in one currency, or all of them).
+    """
+    def run():
+        pairs = [_pair(currency)] if currency else pair_router.pairs()
+        rates = {pair: fx_feed.latest_rate(pair) for pair in pairs}
+        return pair_router.override_convert_now(user_id, rates, pair=_pair(currency) if currency else None)
+
+    return _idempotent(f"pair-override:{user_id}:{currency}", idempotency_key, {}, run)
@@ -0,0 +1,45 @@
+"""
+MetricsMiddleware
+-----------------
+Records per-route request latency into
+crosspay_http_request_duration_seconds{method, route}.
+
+The route label is the path template ("/api/state"), not the raw path,
+so query strings and ids don't blow up the number of series.
+"""
+
+import time
+
+from app.utils.metrics import histogram
+
+REQUEST_HISTOGRAM = "crosspay_http_request_duration_seconds"
+
+
+class MetricsMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+        self._cache = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter_ns()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            # FastAPI puts the matched APIRoute in the (shared) scope
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            self._histogram(scope["method"], path).observe_ns(elapsed)
+
+    def _histogram(self, method: str, path: str):
+        key = (method, path)
+        hist = self._cache.get(key)
+        if hist is None:
+            hist = self._cache[key] = histogram(
+                REQUEST_HISTOGRAM, "HTTP request latency by route", method=method, route=path
+            )
+        return hist
@@ -0,0 +1,133 @@
+"""
+RateLimitMiddleware
+-------------------
+Token-bucket admission control for expensive routes
+(/api/optimise and the Circle-backed /api/circle/*).
+
+- one bucket per user (X-User-Id header, ?user_id=, or client IP); the
+  key is chosen by the client, so this limit is advisory (fairness between
+  well-behaved clients), and a client rotating ids still hits the global one
+- one global bucket shared by everyone: the hard cap
+- requests over the limit get 429 + Retry-After before the body is read
+- at most max_tracked_users buckets, least recently used dropped first
+
+Plain ASGI (no BaseHTTPMiddleware) so shedding costs a dict lookup and a
+bit of arithmetic. Buckets are updated without a lock: under the GIL the
+worst case is a couple of extra requests slipping through during a race,
+which is fine for admission control and keeps the limiter off the hot path.
+"""
+
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+from urllib.parse import parse_qs
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """
+        Takes one token. Returns 0.0 on success, otherwise the number of
+        seconds until a token will be available.
+        """
+        tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if tokens >= 1.0:
+            self.tokens = tokens - 1.0
+            return 0.0
+        self.tokens = tokens
+        return (1.0 - tokens) / self.rate
+
+    def refund(self):
+        self.tokens = min(self.burst, self.tokens + 1.0)
+
+
+class RateLimitMiddleware:
+
+    def __init__(
+        self,
+        app,
+        paths: Sequence[str] = ("/api/optimise", "/api/circle"),
+        per_user_rate: float = float(os.getenv("CROSSPAY_RATE_LIMIT_PER_USER", "10")),
+        per_user_burst: float = float(os.getenv("CROSSPAY_RATE_LIMIT_BURST", "20")),
+        global_rate: float = float(os.getenv("CROSSPAY_RATE_LIMIT_GLOBAL", "200")),
+        global_burst: Optional[float] = None,
+        max_tracked_users: int = 100_000,
+        enabled: bool = os.getenv("CROSSPAY_RATE_LIMIT_DISABLED", "") == "",
+    ):
+        self.app = app
+        self.paths = tuple(paths)
+        self.per_user_rate = per_user_rate
+        self.per_user_burst = per_user_burst
+        self.max_tracked_users = max_tracked_users
+        self.enabled = enabled
+
+        self.global_bucket = TokenBucket(global_rate, global_burst or global_rate)
+        # LRU order: oldest first
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    async def __call__(self, scope, receive, send):
+        if (
+            not self.enabled
+            or scope["type"] != "http"
+            or not scope["path"].startswith(self.paths)
+        ):
+            return await self.app(scope, receive, send)
+
+        now = time.monotonic()
+        user_bucket = self._bucket_for(self._user_key(scope))
+
+        wait = user_bucket.take(now)
+        if wait == 0.0:
+            wait = self.global_bucket.take(now)
+            if wait > 0.0:
+                # don't charge the user for a request we never served
+                user_bucket.refund()
+
+        if wait > 0.0:
+            return await _reject(send, wait)
+        return await self.app(scope, receive, send)
+
+    def _user_key(self, scope) -> str:
+        for name, value in scope["headers"]:
+            if name == b"x-user-id":
+                return value.decode("latin-1")
+        query = scope.get("query_string")
+        if query and b"user_id=" in query:
+            user_ids = parse_qs(query.decode("latin-1")).get("user_id")
+            if user_ids:
+                return user_ids[0]
+        client = scope.get("client")
+        return client[0] if client else "anonymous"
+
+    def _bucket_for(self, key: str) -> TokenBucket:
+        buckets = self._buckets
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= self.max_tracked_users:
+                buckets.popitem(last=False)
+            bucket = buckets[key] = TokenBucket(self.per_user_rate, self.per_user_burst)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+
+async def _reject(send, wait: float):
+    body = json.dumps({"detail": "Too many requests, slow down"}).encode()
+    headers: List[tuple] = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        (b"retry-after", str(max(1, math.ceil(wait))).encode()),
+    ]
+    await send({"type": "http.response.start", "status": 429, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
@@ -1,11 +1,13 @@
 import os
 from .circle_client import get_wallets_api
+from app.utils.metrics import timed
 
 CROSSPAY_WALLET_SET_ID = os.getenv("CROSSPAY_WALLET_SET_ID")
 CROSSPAY_WALLET_ID = os.getenv("CROSSPAY_WALLET_ID")
 CROSSPAY_WALLET_ADDRESS = os.getenv("CROSSPAY_WALLET_ADDRESS")
 
 
+@timed("circle.get_wallet_metadata")
 def get_crosspay_wallet_metadata():
     """
     Return the wallet info that frontend can display:
@@ -21,6 +23,7 @@ def get_crosspay_wallet_metadata():
     }
 
 
+@timed("circle.fetch_wallet")
 def fetch_crosspay_wallet_from_circle():
     """
     Optional: actually call Circle to confirm the wallet exists.
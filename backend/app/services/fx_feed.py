@@ -0,0 +1,236 @@
+"""
+FxFeed
+------
+Server-side FX rates, so ticks and overrides use the market rate instead of
+whatever the client sends.
+
+- one fixed-size ring buffer of (timestamp, rate) per currency pair
+- latest_rate() is O(1) and lock-free (a single attribute read)
+- window reads copy out the last N ticks / last T seconds
+- ticks come from publish() (in-process), a tailed file or a UDP socket
+- a listener that raises is logged and counted
+  (crosspay_fx_listener_errors_total), so it can't stop ingestion or the
+  other listeners
+
+Tick format for files and datagrams, one per line:
+    USDC/EUR,1.0712[,1731600000.25]         (pair, rate, optional unix ts)
+    {"pair": "USDC/EUR", "rate": 1.0712, "ts": 1731600000.25}
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FX_PAIR = os.getenv("CROSSPAY_FX_PAIR", "USDC/EUR")
+DEFAULT_CAPACITY = 4096
+
+TickListener = Callable[[str, float, float], None]  # (pair, ts, rate)
+
+
+class RateRing:
+    """Fixed-capacity ring of (timestamp, rate); timestamps must not go backwards."""
+
+    __slots__ = ("capacity", "timestamps", "rates", "count", "head", "latest", "_lock")
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.rates = array("d", bytes(8 * capacity))
+        self.count = 0
+        self.head = 0  # next write position
+        self.latest: Optional[Tuple[float, float]] = None
+        self._lock = threading.Lock()
+
+    def push(self, ts: float, rate: float) -> Tuple[float, float]:
+        with self._lock:
+            if self.latest is not None and ts < self.latest[0]:
+                ts = self.latest[0]  # clamp late ticks so the ring stays sorted
+            self.timestamps[self.head] = ts
+            self.rates[self.head] = rate
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+            self.latest = (ts, rate)
+            return self.latest
+
+    def last(self, n: int) -> Tuple[List[float], List[float]]:
+        """Oldest-first copies of the last n timestamps and rates."""
+        with self._lock:
+            n = min(n, self.count)
+            start = (self.head - n) % self.capacity
+            if start + n <= self.capacity:
+                return list(self.timestamps[start:start + n]), list(self.rates[start:start + n])
+            split = self.capacity - start
+            return (
+                list(self.timestamps[start:]) + list(self.timestamps[:n - split]),
+                list(self.rates[start:]) + list(self.rates[:n - split]),
+            )
+
+    def since(self, ts: float) -> Tuple[List[float], List[float]]:
+        """Ticks with timestamp >= ts."""
+        timestamps, rates = self.last(self.count)
+        idx = bisect_left(timestamps, ts)
+        return timestamps[idx:], rates[idx:]
+
+
+class FxFeed:
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._rings: Dict[str, RateRing] = {}
+        self._listeners: List[TickListener] = []
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+
+    # -------------------------------------------------
+    # Writes
+    # -------------------------------------------------
+    def publish(self, pair: str, rate: float, ts: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("FX rate must be positive")
+        ts, rate = self._ring(pair).push(time.time() if ts is None else ts, rate)
+        for listener in self._listeners:
+            try:
+                listener(pair, ts, rate)
+            except Exception:
+                name = getattr(listener, "__qualname__", repr(listener))
+                logger.exception("FX tick listener %s failed on %s", name, pair)
+                metrics.counter(
+                    "crosspay_fx_listener_errors_total", "FX tick listeners that raised", listener=name
+                ).inc()
+
+    def subscribe(self, listener: TickListener):
+        """`listener(pair, ts, rate)` runs on the publishing thread for every tick; exceptions are logged."""
+        self._listeners.append(listener)
+
+    # -------------------------------------------------
+    # Reads
+    # -------------------------------------------------
+    def latest(self, pair: str = DEFAULT_FX_PAIR) -> Optional[Tuple[float, float]]:
+        ring = self._rings.get(pair)
+        return ring.latest if ring is not None else None
+
+    def latest_rate(self, pair: str = DEFAULT_FX_PAIR, default: Optional[float] = None) -> Optional[float]:
+        ring = self._rings.get(pair)
+        if ring is None or ring.latest is None:
+            return default
+        return ring.latest[1]
+
+    def last(self, pair: str, n: int) -> Tuple[List[float], List[float]]:
+        ring = self._rings.get(pair)
+        return ring.last(n) if ring is not None else ([], [])
+
+    def window(self, pair: str, seconds: float) -> Tuple[List[float], List[float]]:
+        ring = self._rings.get(pair)
+        return ring.since(time.time() - seconds) if ring is not None else ([], [])
+
+    def pairs(self) -> List[str]:
+        return list(self._rings)
+
+    # -------------------------------------------------
+    # Sources
+    # -------------------------------------------------
+    def follow_file(self, path: str, poll_interval: float = 0.2):
+        """Replays `path` from the start, then keeps tailing it for new ticks."""
+        def run():
+            while not self._stop.is_set() and not os.path.exists(path):
+                self._stop.wait(poll_interval)
+            with open(path, "rb") as f:
+                while not self._stop.is_set():
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        if line:
+                            f.seek(f.tell() - len(line))  # partial line, wait for the rest
+                        self._stop.wait(poll_interval)
+                        continue
+                    self._ingest(line.decode(errors="replace"))
+
+        self._start(run, f"fx-file:{path}")
+
+    def listen_udp(self, host: str, port: int):
+        """Reads ticks from UDP datagrams (one or more lines each)."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((host, port))
+        sock.settimeout(0.5)
+
+        def run():
+            with sock:
+                while not self._stop.is_set():
+                    try:
+                        data = sock.recv(65536)
+                    except socket.timeout:
+                        continue
+                    for line in data.decode(errors="replace").splitlines():
+                        self._ingest(line)
+
+        self._start(run, f"fx-udp:{host}:{port}")
+
+    def start_from_env(self):
+        """CROSSPAY_FX_FILE=/path/ticks.csv and/or CROSSPAY_FX_UDP=127.0.0.1:9999"""
+        path = os.getenv("CROSSPAY_FX_FILE")
+        if path:
+            self.follow_file(path)
+        udp = os.getenv("CROSSPAY_FX_UDP")
+        if udp:
+            host, _, port = udp.rpartition(":")
+            self.listen_udp(host or "127.0.0.1", int(port))
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        self._threads.clear()
+        self._stop = threading.Event()
+
+    # -------------------------------------------------
+    # Internal helpers
+    # -------------------------------------------------
+    def _ring(self, pair: str) -> RateRing:
+        ring = self._rings.get(pair)
+        if ring is None:
+            with self._lock:
+                ring = self._rings.setdefault(pair, RateRing(self.capacity))
+        return ring
+
+    def _ingest(self, line: str):
+        tick = parse_tick(line)
+        if tick is not None:
+            pair, rate, ts = tick
+            self.publish(pair, rate, ts)
+
+    def _start(self, target, name: str):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+
+def parse_tick(line: str) -> Optional[Tuple[str, float, Optional[float]]]:
+    """Parses one tick line; returns None for blanks, comments and garbage."""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    try:
+        if line.startswith("{"):
+            row = json.loads(line)
+            pair, rate, ts = row["pair"], float(row["rate"]), row.get("ts")
+        else:
+            parts = [p.strip() for p in line.split(",")]
+            pair, rate = parts[0], float(parts[1])
+            ts = parts[2] if len(parts) > 2 and parts[2] else None
+        ts = float(ts) if ts is not None else None
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+    return (pair, rate, ts) if rate > 0 and pair else None
+
+
+fx_feed = FxFeed()
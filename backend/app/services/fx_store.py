@@ -0,0 +1,240 @@
+"""
+FxStore
+-------
+Compact on-disk FX history for backtests and dashboards.
+
+Layout (one directory per pair, "USDC/EUR" -> "USDC_EUR"):
+    ticks.bin   append-only records of (int64 ts_ns, float64 rate)
+    1m.bin      OHLC rollups  (int64 bucket_start_ns, open, high, low, close, int64 count)
+    1h.bin
+    1d.bin
+
+Rollups are maintained incrementally on write: the current (last) bar is
+rewritten in place until a tick lands in the next bucket, then a new bar
+is appended. Range queries memory-map the file and return NumPy views,
+so nothing is parsed or copied.
+"""
+
+import os
+import re
+import struct
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+TICK_DTYPE = np.dtype([("ts", "<i8"), ("rate", "<f8")])
+OHLC_DTYPE = np.dtype([
+    ("ts", "<i8"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("count", "<i8"),
+])
+
+# struct layouts matching the dtypes, for cheap single-record writes
+_TICK = struct.Struct("<qd")
+_OHLC = struct.Struct("<qddddq")
+
+NS = 1_000_000_000
+ROLLUPS: Dict[str, int] = {"1m": 60 * NS, "1h": 3600 * NS, "1d": 86400 * NS}
+
+
+def _to_ns(ts: float) -> int:
+    return int(round(ts * NS))
+
+
+class _Series:
+    """Append-only fixed-size records in one file, read through np.memmap."""
+
+    def __init__(self, path: str, dtype: np.dtype):
+        self.path = path
+        self.dtype = dtype
+        open(path, "ab").close()
+        self._file = open(path, "r+b")
+        size = os.path.getsize(path)
+        # drop a half-written trailing record from a crash
+        if size % dtype.itemsize:
+            self._file.truncate(size - size % dtype.itemsize)
+        self.count = os.path.getsize(path) // dtype.itemsize
+        self._map: Optional[np.memmap] = None
+        self._mapped = 0
+        self._pending_last: Optional[bytes] = None
+        self._at_end = False
+
+    def append(self, record: bytes):
+        self._write_pending()
+        if not self._at_end:
+            self._file.seek(0, os.SEEK_END)
+            self._at_end = True
+        self._file.write(record)
+        self.count += 1
+
+    def rewrite_last(self, record: bytes):
+        # kept in memory until the next append/flush, so an open OHLC bar
+        # doesn't cost a seek (and a buffer flush) on every tick
+        self._pending_last = record
+
+    def last(self) -> Optional[bytes]:
+        if self.count == 0:
+            return None
+        if self._pending_last is not None:
+            return self._pending_last
+        self._file.flush()
+        self._file.seek((self.count - 1) * self.dtype.itemsize)
+        self._at_end = False
+        return self._file.read(self.dtype.itemsize)
+
+    def flush(self):
+        self._write_pending()
+        self._file.flush()
+
+    def _write_pending(self):
+        if self._pending_last is not None:
+            self._file.seek((self.count - 1) * self.dtype.itemsize)
+            self._file.write(self._pending_last)
+            self._pending_last = None
+            self._at_end = True  # the last record ends at EOF
+
+    def view(self) -> np.ndarray:
+        """Memory-mapped view of every record written so far."""
+        if self.count == 0:
+            return np.empty(0, dtype=self.dtype)
+        self.flush()
+        if self._map is None or self._mapped != self.count:
+            self._map = np.memmap(self.path, dtype=self.dtype, mode="r", shape=(self.count,))
+            self._mapped = self.count
+        return self._map
+
+    def close(self):
+        self.flush()
+        self._map = None
+        self._file.close()
+
+
+class PairStore:
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.ticks = _Series(os.path.join(directory, "ticks.bin"), TICK_DTYPE)
+        self.rollups = {
+            name: _Series(os.path.join(directory, f"{name}.bin"), OHLC_DTYPE) for name in ROLLUPS
+        }
+        self._last_bar: Dict[str, Optional[Tuple]] = {}
+        for name, series in self.rollups.items():
+            raw = series.last()
+            self._last_bar[name] = _OHLC.unpack(raw) if raw is not None else None
+        last_tick = self.ticks.last()
+        self._last_ts = _TICK.unpack(last_tick)[0] if last_tick is not None else None
+        # newest tick from earlier sessions: a feed replaying its file after
+        # a restart must not store those ticks a second time
+        self._stored_ts = self._last_ts
+        self._lock = threading.Lock()
+
+    def append(self, ts: float, rate: float) -> bool:
+        """Store a tick; False if it is not newer than what was on disk at open."""
+        ts_ns = _to_ns(ts)
+        with self._lock:
+            if self._stored_ts is not None and ts_ns <= self._stored_ts:
+                return False
+            if self._last_ts is not None and ts_ns < self._last_ts:
+                ts_ns = self._last_ts  # clock skew within this session: keep the file sorted
+            self._last_ts = ts_ns
+            self.ticks.append(_TICK.pack(ts_ns, rate))
+
+            for name, width in ROLLUPS.items():
+                bucket = ts_ns - ts_ns % width
+                bar = self._last_bar[name]
+                series = self.rollups[name]
+                if bar is not None and bar[0] == bucket:
+                    _, open_, high, low, _, count = bar
+                    bar = (bucket, open_, max(high, rate), min(low, rate), rate, count + 1)
+                    series.rewrite_last(_OHLC.pack(*bar))
+                else:
+                    bar = (bucket, rate, rate, rate, rate, 1)
+                    series.append(_OHLC.pack(*bar))
+                self._last_bar[name] = bar
+            return True
+
+    def range(self, start: float, end: float, rollup: Optional[str] = None) -> np.ndarray:
+        """
+        Records with start <= ts < end (unix seconds) as a zero-copy view
+        of the memory-mapped file. rollup=None gives raw ticks.
+        """
+        with self._lock:
+            series = self.ticks if rollup is None else self.rollups[rollup]
+            data = series.view()
+        ts = data["ts"]
+        lo = np.searchsorted(ts, _to_ns(start), side="left")
+        hi = np.searchsorted(ts, _to_ns(end), side="left")
+        return data[lo:hi]
+
+    def flush(self):
+        with self._lock:
+            self.ticks.flush()
+            for series in self.rollups.values():
+                series.flush()
+
+    def close(self):
+        with self._lock:
+            self.ticks.close()
+            for series in self.rollups.values():
+                series.close()
+
+
+_PAIR_DIR = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class FxStore:
+
+    def __init__(self, root: str):
+        self.root = root
+        self._pairs: Dict[str, PairStore] = {}
+        self._lock = threading.Lock()
+
+    def pair(self, pair: str) -> PairStore:
+        store = self._pairs.get(pair)
+        if store is None:
+            with self._lock:
+                store = self._pairs.get(pair)
+                if store is None:
+                    store = self._pairs[pair] = PairStore(self._directory(pair))
+        return store
+
+    def has_pair(self, pair: str) -> bool:
+        return pair in self._pairs or os.path.isdir(self._directory(pair))
+
+    def _directory(self, pair: str) -> str:
+        name = pair.replace("/", "_")
+        if not _PAIR_DIR.match(name):
+            raise ValueError(f"Invalid currency pair {pair!r}")
+        return os.path.join(self.root, name)
+
+    def append(self, pair: str, ts: float, rate: float) -> bool:
+        return self.pair(pair).append(ts, rate)
+
+    def on_tick(self, pair: str, ts: float, rate: float):
+        """FxFeed listener: persist every tick not already stored (a replayed file)."""
+        self.append(pair, ts, rate)
+
+    def range(self, pair: str, start: float, end: float, rollup: Optional[str] = None) -> np.ndarray:
+        if not self.has_pair(pair):
+            return np.empty(0, dtype=TICK_DTYPE if rollup is None else OHLC_DTYPE)
+        return self.pair(pair).range(start, end, rollup)
+
+    def flush(self):
+        for store in list(self._pairs.values()):
+            store.flush()
+
+    def close(self):
+        for store in list(self._pairs.values()):
+            store.close()
+        self._pairs.clear()
+
+
+def to_columns(records: np.ndarray) -> Dict[str, list]:
+    """JSON-friendly columns, timestamps back in unix seconds."""
+    columns = {name: records[name].tolist() for name in records.dtype.names}
+    columns["ts"] = (records["ts"] / NS).tolist()
+    return columns
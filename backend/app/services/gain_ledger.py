@@ -0,0 +1,349 @@
+"""
+GainLedger
+----------
+Per-tranche FX gain attribution.
+
+Every conversion (a "tranche" of a user's pending amount) is recorded with
+its time, FX rate, converted amount and gain vs. the user's baseline rate.
+extra_gained_vs_instant only has the running total; the ledger answers
+"how much did the optimiser earn this user last month".
+
+Layout:
+- TrancheLedger (one per PairBook): 2D arrays [row, tranche] aligned with
+  the book's rows, so a batch tick appends to thousands of users in one
+  vectorised step
+- UserLedger (the single-user demo state): 1D arrays; a tick only queues
+  its tranche (a tuple append, no NumPy call), and queued tranches are
+  summed into the arrays a chunk at a time, or before a query
+
+Both keep per-user prefix sums of converted / gained micros next to the
+(non-decreasing) timestamps, so the gain over any time range is two binary
+searches and a subtraction: O(log n).
+
+Memory is bounded: a user keeps at most MAX_TRANCHES tranches. When a row
+is full, the older half is merged pairwise (with prefix sums that is just
+dropping every other entry), so recent tranches stay exact, older ones get
+coarser, and totals over the whole history never change. A merged tranche
+has no single FX rate (None), counts once in tranche counts and is stamped
+with its newer half's time, so a range edge falling between the first and
+the last merged conversion can't split it exactly: each row remembers that
+span and totals() flags such queries ("exact": False). Edges before or
+after it stay exact. A PairBook's ledger is at most
+rows x (MAX_TRANCHES x 32 + 16) bytes, whatever the tick count.
+"""
+
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.utils.money import MICROS
+
+_INITIAL_TRANCHES = 16
+MAX_TRANCHES = 128  # per user
+_QUEUED_TRANCHES = 128  # UserLedger appends summed in one go
+MAX_SERIES_BUCKETS = 1000
+
+
+@lru_cache(maxsize=None)
+def _fold_keep(n: int) -> Tuple[np.ndarray, int]:
+    """
+    Indexes kept when `n` tranches are folded (the odd ones of the older
+    half, all of the newer half) and how many of them are merged tranches.
+    """
+    half = n // 2 & ~1
+    keep = np.concatenate([np.arange(1, half, 2), np.arange(half, n)])
+    keep.flags.writeable = False  # shared by every caller
+    return keep, half // 2
+
+
+def _fold_columns(ts, rate, cum_converted, cum_gain, max_tranches: int, coarse: Tuple[float, float]):
+    """Fold 1D columns down to max_tranches; returns them and the new coarse span."""
+    while len(ts) > max_tranches:
+        keep, merged = _fold_keep(len(ts))
+        coarse = (min(coarse[0], ts[0]), ts[keep[merged - 1]])
+        ts, rate, cum_converted, cum_gain = ts[keep], rate[keep], cum_converted[keep], cum_gain[keep]
+        rate[:merged] = np.nan
+    return ts, rate, cum_converted, cum_gain, coarse
+
+
+def _exact(edges: np.ndarray, coarse_from: float, coarse_until: float) -> bool:
+    # a merged tranche holds conversions in [coarse_from, coarse_until]; an
+    # edge inside that span may cut one of them
+    return not bool(np.any((edges > coarse_from) & (edges <= coarse_until)))
+
+
+class TrancheLedger:
+
+    def __init__(self, rows: int = 1, capacity: int = _INITIAL_TRANCHES, max_tranches: int = MAX_TRANCHES):
+        self.max_tranches = max_tranches
+        capacity = min(capacity, max_tranches)
+        self.count = np.zeros(rows, dtype=np.int64)
+        self.ts = np.zeros((rows, capacity))
+        self.rate = np.full((rows, capacity), np.nan)
+        # prefix sums: cum_*[row, i] = total of tranches 0..i
+        self.cum_converted = np.zeros((rows, capacity), dtype=np.int64)
+        self.cum_gain = np.zeros((rows, capacity), dtype=np.int64)
+        # per row, the time span folded tranches cover (empty: inf, -inf)
+        self.coarse_from = np.full(rows, np.inf)
+        self.coarse_until = np.full(rows, -np.inf)
+
+    # -------------------------------------------------
+    # Writes
+    # -------------------------------------------------
+    def _reserve(self, rows: int, tranches: int):
+        have_rows, have_tranches = self.ts.shape
+        if rows <= have_rows and tranches <= have_tranches:
+            return
+        shape = (
+            have_rows if rows <= have_rows else max(rows, 2 * have_rows),
+            have_tranches if tranches <= have_tranches else min(max(tranches, 2 * have_tranches), self.max_tranches),
+        )
+
+        def grown(array, fill):
+            out = np.full(shape, fill, dtype=array.dtype)
+            out[:have_rows, :have_tranches] = array
+            return out
+
+        self.ts = grown(self.ts, 0.0)
+        self.rate = grown(self.rate, np.nan)
+        self.cum_converted = grown(self.cum_converted, 0)
+        self.cum_gain = grown(self.cum_gain, 0)
+        self.count = np.concatenate([self.count, np.zeros(shape[0] - have_rows, dtype=np.int64)])
+        self.coarse_from = np.concatenate([self.coarse_from, np.full(shape[0] - have_rows, np.inf)])
+        self.coarse_until = np.concatenate([self.coarse_until, np.full(shape[0] - have_rows, -np.inf)])
+
+    def append(self, rows: np.ndarray, ts: float, converted: np.ndarray, rate: Optional[float], gain: np.ndarray):
+        """Record one tranche for each of `rows` (distinct), all converted at `ts`."""
+        if len(rows) == 0:
+            return
+        self._reserve(int(rows.max()) + 1, 0)
+        index = self.count[rows]
+        full = index >= self.max_tranches
+        if full.any():
+            self._fold(rows[full])
+            index = self.count[rows]
+        self._reserve(0, int(index.max()) + 1)
+
+        has_previous = index > 0
+        previous = np.where(has_previous, index - 1, 0)
+        # keep each row's timestamps sorted for searchsorted
+        self.ts[rows, index] = np.where(has_previous, np.maximum(ts, self.ts[rows, previous]), ts)
+        self.rate[rows, index] = np.nan if rate is None else rate
+        self.cum_converted[rows, index] = np.where(has_previous, self.cum_converted[rows, previous], 0) + converted
+        self.cum_gain[rows, index] = np.where(has_previous, self.cum_gain[rows, previous], 0) + gain
+        self.count[rows] = index + 1
+
+    def _fold(self, rows: np.ndarray):
+        """Merge the older half of these (full) rows pairwise, see the module docstring."""
+        keep, merged = _fold_keep(self.max_tranches)
+        self.coarse_from[rows] = np.minimum(self.coarse_from[rows], self.ts[rows, 0])
+        for array in (self.ts, self.rate, self.cum_converted, self.cum_gain):
+            array[rows, :len(keep)] = array[rows][:, keep]
+        self.rate[rows, :merged] = np.nan
+        self.coarse_until[rows] = self.ts[rows, merged - 1]
+        self.count[rows] = len(keep)
+
+    def export_row(self, row: int) -> Dict[str, list]:
+        """One row's tranches as plain lists (prefix sums, micros), for load_row()."""
+        if row >= len(self.count):
+            return {"ts": [], "rate": [], "cum_converted": [], "cum_gain": [], "coarse": None}
+        n = int(self.count[row])
+        folded = self.coarse_until[row] >= self.coarse_from[row]
+        return {
+            "ts": self.ts[row, :n].tolist(),
+            "rate": [None if r != r else r for r in self.rate[row, :n].tolist()],  # NaN -> None
+            "cum_converted": self.cum_converted[row, :n].tolist(),
+            "cum_gain": self.cum_gain[row, :n].tolist(),
+            "coarse": [float(self.coarse_from[row]), float(self.coarse_until[row])] if folded else None,
+        }
+
+    def load_row(self, row: int, data: Dict[str, list]):
+        """Replace a row's tranches with an export_row() result (folded down to max_tranches)."""
+        ts = np.asarray(data["ts"], dtype=float)
+        rate = np.array(data["rate"], dtype=float)  # None -> NaN
+        cum_converted = np.asarray(data["cum_converted"], dtype=np.int64)
+        cum_gain = np.asarray(data["cum_gain"], dtype=np.int64)
+        coarse = tuple(data.get("coarse") or (np.inf, -np.inf))
+        ts, rate, cum_converted, cum_gain, coarse = _fold_columns(
+            ts, rate, cum_converted, cum_gain, self.max_tranches, coarse
+        )
+        n = len(ts)
+        self._reserve(row + 1, n)
+        self.ts[row, :n] = ts
+        self.rate[row, :n] = rate
+        self.cum_converted[row, :n] = cum_converted
+        self.cum_gain[row, :n] = cum_gain
+        self.coarse_from[row], self.coarse_until[row] = coarse
+        self.count[row] = n
+
+    def clear_row(self, row: int):
+        if row < len(self.count):
+            self.count[row] = 0
+            self.coarse_from[row] = np.inf
+            self.coarse_until[row] = -np.inf
+
+    # -------------------------------------------------
+    # Range queries
+    # -------------------------------------------------
+    def totals(self, row: int, edges: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Per-bucket totals between consecutive `edges` (unix seconds,
+        ascending; a tranche at t counts in [edge_i, edge_i+1)).
+        Returns int64 micros and tranche counts, one entry per bucket, and
+        "exact": False when an edge cuts through folded tranches.
+        """
+        buckets = len(edges) - 1
+        if row >= len(self.count) or self.count[row] == 0:
+            zeros = np.zeros(buckets, dtype=np.int64)
+            return {"converted": zeros, "gain": zeros.copy(), "tranches": zeros.copy(), "exact": True}
+
+        n = int(self.count[row])
+        positions = np.searchsorted(self.ts[row, :n], edges, side="left")
+        # prefix value before position p is cum[p - 1], or 0 when p == 0
+        before = positions - 1
+        cum_converted = np.where(positions > 0, self.cum_converted[row, before], 0)
+        cum_gain = np.where(positions > 0, self.cum_gain[row, before], 0)
+        return {
+            "converted": np.diff(cum_converted),
+            "gain": np.diff(cum_gain),
+            "tranches": np.diff(positions),
+            "exact": _exact(edges, self.coarse_from[row], self.coarse_until[row]),
+        }
+
+    def tranches(self, row: int, start: float, end: float, limit: int = 100) -> List[Dict]:
+        """The individual tranches in [start, end), newest last."""
+        if row >= len(self.count):
+            return []
+        n = int(self.count[row])
+        lo, hi = np.searchsorted(self.ts[row, :n], [start, end], side="left")
+        lo = max(lo, hi - limit)
+        records = []
+        for i in range(lo, hi):
+            before_converted = self.cum_converted[row, i - 1] if i else 0
+            before_gain = self.cum_gain[row, i - 1] if i else 0
+            rate = self.rate[row, i]
+            records.append({
+                "ts": float(self.ts[row, i]),
+                "fxRate": None if np.isnan(rate) else float(rate),
+                "converted": int(self.cum_converted[row, i] - before_converted) / MICROS,
+                "gain": int(self.cum_gain[row, i] - before_gain) / MICROS,
+            })
+        return records
+
+
+class UserLedger:
+    """
+    One user's tranches; same queries as a TrancheLedger row. Ticks and
+    queries may run on different threads, so everything goes through _lock.
+    """
+
+    __slots__ = ("ts", "rate", "cum_converted", "cum_gain", "coarse", "max_tranches", "_queued", "_lock")
+
+    def __init__(self, max_tranches: int = MAX_TRANCHES):
+        self.ts = np.zeros(0)
+        self.rate = np.zeros(0)
+        self.cum_converted = np.zeros(0, dtype=np.int64)
+        self.cum_gain = np.zeros(0, dtype=np.int64)
+        self.coarse = (np.inf, -np.inf)  # time span of folded tranches
+        self.max_tranches = max_tranches
+        self._queued: List[Tuple[float, int, Optional[float], int]] = []
+        self._lock = threading.Lock()
+
+    def append(self, ts: float, converted: int, rate: Optional[float], gain: int):
+        with self._lock:
+            queued = self._queued
+            queued.append((ts, converted, rate, gain))
+            if len(queued) >= _QUEUED_TRANCHES:
+                self._sum_queued()
+
+    def _sum_queued(self):
+        """Move the queued tranches into the prefix-sum columns, folding if the ledger is full (under _lock)."""
+        queued, self._queued = self._queued, []
+        if not queued:
+            return
+        ts, converted, rate, gain = zip(*queued)
+        ts = np.maximum.accumulate(np.array(ts, dtype=float))
+        cum_converted = np.cumsum(np.array(converted, dtype=np.int64))
+        cum_gain = np.cumsum(np.array(gain, dtype=np.int64))
+        if len(self.ts):
+            # keep the timestamps sorted and the sums running
+            np.maximum(ts, self.ts[-1], out=ts)
+            cum_converted += self.cum_converted[-1]
+            cum_gain += self.cum_gain[-1]
+        ts = np.concatenate([self.ts, ts])
+        rate = np.concatenate([self.rate, np.array(rate, dtype=float)])  # None -> nan
+        cum_converted = np.concatenate([self.cum_converted, cum_converted])
+        cum_gain = np.concatenate([self.cum_gain, cum_gain])
+        ts, rate, cum_converted, cum_gain, self.coarse = _fold_columns(
+            ts, rate, cum_converted, cum_gain, self.max_tranches, self.coarse
+        )
+        self.ts, self.rate, self.cum_converted, self.cum_gain = ts, rate, cum_converted, cum_gain
+
+    def totals(self, edges: np.ndarray) -> Dict[str, np.ndarray]:
+        with self._lock:
+            self._sum_queued()
+            ts, cum_converted, cum_gain, coarse = self.ts, self.cum_converted, self.cum_gain, self.coarse
+        if not len(ts):
+            zeros = np.zeros(len(edges) - 1, dtype=np.int64)
+            return {"converted": zeros, "gain": zeros.copy(), "tranches": zeros.copy(), "exact": True}
+        positions = np.searchsorted(ts, edges, side="left")
+        before = positions - 1
+        return {
+            "converted": np.diff(np.where(positions > 0, cum_converted[before], 0)),
+            "gain": np.diff(np.where(positions > 0, cum_gain[before], 0)),
+            "tranches": np.diff(positions),
+            "exact": _exact(edges, *coarse),
+        }
+
+    def tranches(self, start: float, end: float, limit: int = 100) -> List[Dict]:
+        with self._lock:
+            self._sum_queued()
+            ts, rate, cum_converted, cum_gain = self.ts, self.rate, self.cum_converted, self.cum_gain
+        lo, hi = np.searchsorted(ts, [start, end], side="left").tolist()
+        lo = max(lo, hi - limit)
+        ts, rate = ts.tolist(), rate.tolist()
+        cum_converted, cum_gain = cum_converted.tolist(), cum_gain.tolist()
+        return [
+            {
+                "ts": ts[i],
+                "fxRate": None if rate[i] != rate[i] else rate[i],
+                "converted": (cum_converted[i] - (cum_converted[i - 1] if i else 0)) / MICROS,
+                "gain": (cum_gain[i] - (cum_gain[i - 1] if i else 0)) / MICROS,
+            }
+            for i in range(lo, hi)
+        ]
+
+
+def series_edges(start: float, end: float, step: Optional[float] = None) -> np.ndarray:
+    """[start, end] or start, start+step, ... end; raises ValueError for bad ranges."""
+    if end <= start:
+        raise ValueError("end must be after start")
+    if step is None:
+        return np.array([start, end], dtype=float)
+    if step <= 0 or (end - start) / step > MAX_SERIES_BUCKETS:
+        raise ValueError(f"step must be positive and give at most {MAX_SERIES_BUCKETS} buckets")
+    buckets = int(np.ceil((end - start) / step))
+    return np.append(start + step * np.arange(buckets), end)
+
+
+def report(totals: Dict[str, np.ndarray], edges: np.ndarray) -> Dict:
+    """
+    JSON-friendly totals(): the whole range plus the per-bucket series.
+    "exact" is False when an edge cuts through folded (merged) tranches.
+    """
+    resp = {
+        "converted": int(totals["converted"].sum()) / MICROS,
+        "gain": int(totals["gain"].sum()) / MICROS,
+        "tranches": int(totals["tranches"].sum()),
+        "exact": totals["exact"],
+    }
+    if len(edges) > 2:
+        resp["series"] = {
+            "start": edges[:-1].tolist(),
+            "converted": (totals["converted"] / MICROS).tolist(),
+            "gain": (totals["gain"] / MICROS).tolist(),
+            "tranches": totals["tranches"].tolist(),
+        }
+    return resp
@@ -0,0 +1,226 @@
+"""
+MarketClassifier
+----------------
+Derives MarketCondition (GOOD/OK/BAD) per currency pair from the FX feed,
+instead of trusting whatever the caller sends to /api/optimise.
+
+Per pair, updated in O(1) on every tick:
+- rolling mean / stdev of the rate over the last `window` ticks (windowed Welford)
+- rolling volatility = stdev of log returns over the same window
+- EMA of the rate
+- drawdown = how far the rate sits below its rolling max (monotonic deque)
+
+The classification is computed once per tick and cached, so any number of
+optimisation ticks can read condition() as a plain dict lookup.
+
+Each pair also counts regime transitions and the rate levels / log returns
+seen in each regime; policy_tables turns those into the regime model it solves against.
+
+Rates are "local currency per USDC": a high rate is a good time to convert.
+"""
+
+import math
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional, Tuple
+
+from app.services.routing_service import MarketCondition
+
+
+class RollingWelford:
+    """Mean/variance over a sliding window: add() and remove() are O(1)."""
+
+    __slots__ = ("n", "mean", "m2")
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x: float):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def remove(self, x: float):
+        if self.n <= 1:
+            self.n, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        self.n -= 1
+        delta = x - self.mean
+        self.mean -= delta / self.n
+        self.m2 = max(0.0, self.m2 - delta * (x - self.mean))
+
+    @property
+    def stdev(self) -> float:
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else 0.0
+
+
+@dataclass
+class MarketStats:
+    ticks: int
+    rate: float
+    mean: float
+    stdev: float
+    ema: float
+    volatility: float
+    drawdown: float
+    z_score: float
+    condition: MarketCondition
+
+
+class PairStatistics:
+    """Streaming statistics for one currency pair."""
+
+    def __init__(self, window: int, ema_alpha: float):
+        self.window = window
+        self.ema_alpha = ema_alpha
+
+        self.rates: Deque[float] = deque()
+        self.returns: Deque[float] = deque()
+        self.rate_stats = RollingWelford()
+        self.return_stats = RollingWelford()
+        self.max_deque: Deque[Tuple[int, float]] = deque()  # (tick index, rate), decreasing rates
+        self.ema: Optional[float] = None
+        self.ticks = 0
+        self.last_return = 0.0
+
+        # regime model: transitions[a][b] = times regime b followed regime a,
+        # regime_levels[a] = rate / rolling mean while in regime a,
+        # regime_returns[a] = log returns of the ticks that followed regime a
+        self.regime: Optional[MarketCondition] = None
+        self.transitions = {a: {b: 0 for b in MarketCondition} for a in MarketCondition}
+        self.regime_levels = {a: RollingWelford() for a in MarketCondition}
+        self.regime_returns = {a: RollingWelford() for a in MarketCondition}
+        self.tick_seconds = RollingWelford()
+        self.last_ts: Optional[float] = None
+
+    def update(self, rate: float):
+        self.last_return = 0.0
+        if self.rates:
+            log_return = self.last_return = math.log(rate / self.rates[-1])
+            self.returns.append(log_return)
+            self.return_stats.add(log_return)
+            if len(self.returns) > self.window:
+                self.return_stats.remove(self.returns.popleft())
+
+        self.rates.append(rate)
+        self.rate_stats.add(rate)
+        if len(self.rates) > self.window:
+            self.rate_stats.remove(self.rates.popleft())
+
+        # rolling max: drop smaller rates from the back, expired ones from the front
+        while self.max_deque and self.max_deque[-1][1] <= rate:
+            self.max_deque.pop()
+        self.max_deque.append((self.ticks, rate))
+        if self.max_deque[0][0] <= self.ticks - self.window:
+            self.max_deque.popleft()
+
+        self.ema = rate if self.ema is None else self.ema + self.ema_alpha * (rate - self.ema)
+        self.ticks += 1
+
+    def record_regime(self, condition: MarketCondition, ts: float, level: float):
+        self.regime_levels[condition].add(level)
+        if self.regime is not None:
+            self.transitions[self.regime][condition] += 1
+            self.regime_returns[self.regime].add(self.last_return)
+        if self.last_ts is not None and ts > self.last_ts:
+            self.tick_seconds.add(ts - self.last_ts)
+        self.regime = condition
+        self.last_ts = ts
+
+    @property
+    def rolling_max(self) -> float:
+        return self.max_deque[0][1]
+
+
+class MarketClassifier:
+
+    def __init__(
+        self,
+        window: int = 120,
+        ema_alpha: float = 0.1,
+        min_ticks: int = 20,
+        z_threshold: float = 0.5,
+        max_drawdown: float = 0.01,
+        max_volatility: float = 0.005,
+    ):
+        self.window = window
+        self.ema_alpha = ema_alpha
+        self.min_ticks = min_ticks
+        self.z_threshold = z_threshold
+        self.max_drawdown = max_drawdown
+        self.max_volatility = max_volatility
+
+        self._pairs: Dict[str, PairStatistics] = {}
+        # pair -> (lock, its statistics), created together under _lock
+        self._locks: Dict[str, Tuple[threading.Lock, PairStatistics]] = {}
+        self._stats: Dict[str, MarketStats] = {}
+        self._lock = threading.Lock()
+
+    def on_tick(self, pair: str, ts: float, rate: float):
+        """FxFeed listener: update the pair's statistics and re-classify."""
+        entry = self._locks.get(pair)
+        if entry is None:
+            with self._lock:
+                entry = self._locks.get(pair)
+                if entry is None:
+                    # statistics first: a lock that is visible always has them
+                    stats = self._pairs[pair] = PairStatistics(self.window, self.ema_alpha)
+                    entry = self._locks[pair] = (threading.Lock(), stats)
+        lock, stats = entry
+
+        with lock:
+            stats.update(rate)
+            classified = self._stats[pair] = self._classify(stats, rate)
+            if stats.ticks >= self.min_ticks:
+                stats.record_regime(classified.condition, ts, rate / classified.mean)
+
+    def condition(self, pair: str) -> Optional[MarketCondition]:
+        """Cached condition, or None until the pair has `min_ticks` ticks."""
+        stats = self._stats.get(pair)
+        return stats.condition if stats is not None and stats.ticks >= self.min_ticks else None
+
+    def stats(self, pair: str) -> Optional[MarketStats]:
+        return self._stats.get(pair)
+
+    def regime_history(self, pair: str) -> Optional[PairStatistics]:
+        """Raw per-pair statistics (transition counts, per-regime returns)."""
+        return self._pairs.get(pair)
+
+    def _classify(self, stats: PairStatistics, rate: float) -> MarketStats:
+        mean = stats.rate_stats.mean
+        stdev = stats.rate_stats.stdev
+        volatility = stats.return_stats.stdev
+        drawdown = 1.0 - rate / stats.rolling_max
+        z_score = (rate - mean) / stdev if stdev > 0 else 0.0
+
+        if stats.ticks < self.min_ticks:
+            condition = MarketCondition.OK
+        elif drawdown > self.max_drawdown or volatility > self.max_volatility or (
+            z_score <= -self.z_threshold and rate < stats.ema
+        ):
+            # falling or choppy market: hold on to the optimised lane
+            condition = MarketCondition.BAD
+        elif z_score >= self.z_threshold and rate >= stats.ema:
+            # rate is high vs. its recent range and still holding up
+            condition = MarketCondition.GOOD
+        else:
+            condition = MarketCondition.OK
+
+        return MarketStats(
+            ticks=stats.ticks,
+            rate=rate,
+            mean=mean,
+            stdev=stdev,
+            ema=stats.ema,
+            volatility=volatility,
+            drawdown=drawdown,
+            z_score=z_score,
+            condition=condition,
+        )
+
+
+market_classifier = MarketClassifier()
@@ -0,0 +1,602 @@
+"""
+PairRouter
+----------
+Multi-user, multi-currency version of routing_service.
+
+Users are paid in USDC but spend in several local currencies, so pending
+amounts, the FX baseline and the gain vs. converting instantly are tracked
+per (user, currency pair). Everything is columnar (NumPy arrays):
+
+- user columns: instant balance, buckets, totals and settings per user slot
+  (bucket balances / weights are [users, buckets] matrices, one column per
+  named bucket: rent, savings, investing, plus any added later e.g. emergency)
+- one PairBook per pair: the slots of users holding that pair plus their
+  pending / baseline / gain columns
+- slots and book rows of users handed off to another shard are reset and
+  reused by the next new user, so handoffs don't grow the columns
+
+optimisation_tick(pair, ...) runs one vectorised pass over the users of that
+pair only, so a BRL tick never touches MXN users. With policy tables, rows
+are grouped by each user's (max-wait bucket, risk level) and every group
+reads its own table.
+
+Amount columns are int64 micro-USDC (gains: micros of the local currency),
+rounded with the rules in app/utils/money.py.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from app.services.gain_ledger import TrancheLedger, report
+from app.services.policy_tables import RISK_AVERSION, PolicyTable, max_wait_buckets
+from app.services.routing_service import CONVERT_FRACTION_BY_CODE, MarketCondition
+from app.utils import metrics
+from app.utils.money import MICROS, from_micros, mul_fraction, mul_fraction_array, split_array, to_micros
+from app.utils.weights import DEFAULT_BUCKETS, DEFAULT_WEIGHTS, BucketWeights
+
+_INITIAL_CAPACITY = 64
+# risk_level column codes
+RISK_LEVELS = tuple(RISK_AVERSION)
+_DEFAULT_RISK = RISK_LEVELS.index("safe")
+
+# (max_wait_seconds, risk_level) -> table, e.g. PolicyCache.get
+PolicyLookup = Callable[[float, str], Optional[PolicyTable]]
+
+
+def _grow(array: np.ndarray, capacity: int, fill=0) -> np.ndarray:
+    grown = np.full(capacity, fill, dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
+
+
+class PairBook:
+    """Column store of every user holding one currency pair."""
+
+    COLUMNS = ("pending", "baseline_rate", "total_received", "last_deposit", "extra_gained")
+
+    def __init__(self, pair: str):
+        self.pair = pair
+        self.size = 0
+        self.row_of: Dict[int, int] = {}  # user slot -> row
+        self.slots = np.zeros(_INITIAL_CAPACITY, dtype=np.int64)
+        self.pending = np.zeros(_INITIAL_CAPACITY, dtype=np.int64)
+        self.baseline_rate = np.full(_INITIAL_CAPACITY, np.nan)
+        self.total_received = np.zeros(_INITIAL_CAPACITY, dtype=np.int64)
+        self.last_deposit = np.full(_INITIAL_CAPACITY, np.nan)
+        self.extra_gained = np.zeros(_INITIAL_CAPACITY, dtype=np.int64)
+        # per-conversion gain records, same rows as the columns above
+        self.tranches = TrancheLedger(_INITIAL_CAPACITY)
+        # released rows, reset and unlinked: ticks and views skip them
+        self._free_rows: List[int] = []
+
+    def row(self, slot: int) -> int:
+        row = self.row_of.get(slot)
+        if row is None and self._free_rows:
+            row = self.row_of[slot] = self._free_rows.pop()
+            self.slots[row] = slot
+        elif row is None:
+            if self.size == len(self.slots):
+                capacity = 2 * len(self.slots)
+                self.slots = _grow(self.slots, capacity)
+                self.pending = _grow(self.pending, capacity)
+                self.baseline_rate = _grow(self.baseline_rate, capacity, np.nan)
+                self.total_received = _grow(self.total_received, capacity)
+                self.last_deposit = _grow(self.last_deposit, capacity, np.nan)
+                self.extra_gained = _grow(self.extra_gained, capacity)
+            row = self.row_of[slot] = self.size
+            self.slots[row] = slot
+            self.size += 1
+        return row
+
+    def release(self, slot: int):
+        """Unlink `slot`'s row and reset it for reuse by row()."""
+        row = self.row_of.pop(slot, None)
+        if row is None:
+            return
+        self.pending[row] = 0
+        self.total_received[row] = 0
+        self.extra_gained[row] = 0
+        self.baseline_rate[row] = np.nan
+        self.last_deposit[row] = np.nan
+        self.tranches.clear_row(row)
+        self._free_rows.append(row)
+
+
+class PairRouter:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._slot_of: Dict[str, int] = {}
+        self._user_ids: List[Optional[str]] = []  # by slot, None once dropped
+        self._free_slots: List[int] = []
+        self._books: Dict[str, PairBook] = {}
+
+        n = _INITIAL_CAPACITY
+        self.bucket_names: List[str] = list(DEFAULT_BUCKETS)
+        self.instant_available = np.zeros(n, dtype=np.int64)
+        self.buckets = np.zeros((n, len(DEFAULT_BUCKETS)), dtype=np.int64)
+        self.total_salary_received = np.zeros(n, dtype=np.int64)
+
+        # settings, same defaults as main.py's single-user demo;
+        # bucket_weights rows are always normalised
+        self.instant_percent = np.full(n, 0.4)
+        self.max_wait_seconds = np.full(n, 24 * 3600.0)
+        self.risk_level = np.full(n, _DEFAULT_RISK, dtype=np.int8)
+        self.bucket_weights = np.tile(DEFAULT_WEIGHTS, (n, 1))
+
+    # -------------------------------------------------
+    # Users and settings
+    # -------------------------------------------------
+    def _slot(self, user_id: str) -> int:
+        slot = self._slot_of.get(user_id)
+        if slot is None and self._free_slots:
+            slot = self._slot_of[user_id] = self._free_slots.pop()
+            self._user_ids[slot] = user_id
+        elif slot is None:
+            slot = len(self._user_ids)
+            if slot == len(self.instant_available):
+                self._grow_users(2 * slot)
+            self._slot_of[user_id] = slot
+            self._user_ids.append(user_id)
+        return slot
+
+    def _grow_users(self, capacity: int):
+        self.instant_available = _grow(self.instant_available, capacity)
+        self.total_salary_received = _grow(self.total_salary_received, capacity)
+        self.instant_percent = _grow(self.instant_percent, capacity, 0.4)
+        self.max_wait_seconds = _grow(self.max_wait_seconds, capacity, 24 * 3600.0)
+        self.risk_level = _grow(self.risk_level, capacity, _DEFAULT_RISK)
+
+        buckets = np.zeros((capacity, len(self.bucket_names)), dtype=np.int64)
+        buckets[: len(self.buckets)] = self.buckets
+        self.buckets = buckets
+        weights = np.zeros((capacity, len(self.bucket_names)))
+        weights[:, : len(DEFAULT_WEIGHTS)] = DEFAULT_WEIGHTS
+        weights[: len(self.bucket_weights)] = self.bucket_weights
+        self.bucket_weights = weights
+
+    def _bucket_column(self, name: str) -> int:
+        """Column of bucket `name`, adding it (zero balance, zero weight) if new."""
+        if name not in self.bucket_names:
+            self.bucket_names.append(name)
+            self.buckets = np.hstack([self.buckets, np.zeros((len(self.buckets), 1), dtype=np.int64)])
+            self.bucket_weights = np.hstack([self.bucket_weights, np.zeros((len(self.bucket_weights), 1))])
+        return self.bucket_names.index(name)
+
+    def update_settings(
+        self,
+        user_id: str,
+        instant_percent: Optional[float] = None,
+        max_wait_seconds: Optional[int] = None,
+        rent_weight: Optional[float] = None,
+        savings_weight: Optional[float] = None,
+        investing_weight: Optional[float] = None,
+        risk_level: Optional[str] = None,
+    ):
+        """Raises ValueError (and changes nothing) for invalid weights or risk levels."""
+        if risk_level is not None and risk_level not in RISK_LEVELS:
+            raise ValueError(f"risk_level must be one of {RISK_LEVELS}")
+        with self._lock:
+            slot = self._slot(user_id)
+
+            weights = self.bucket_weights[slot].copy()
+            for i, value in enumerate((rent_weight, savings_weight, investing_weight)):
+                if value is not None:
+                    weights[i] = value
+            # same fallback as UserSettings.bucket_weights
+            fallback = np.zeros(len(weights))
+            fallback[: len(DEFAULT_WEIGHTS)] = DEFAULT_WEIGHTS
+            normalised = BucketWeights(self.bucket_names, weights.tolist(), fallback=fallback.tolist())
+
+            self.bucket_weights[slot] = normalised.weights
+            if instant_percent is not None:
+                self.instant_percent[slot] = instant_percent
+            if max_wait_seconds is not None:
+                self.max_wait_seconds[slot] = max_wait_seconds
+            if risk_level is not None:
+                self.risk_level[slot] = RISK_LEVELS.index(risk_level)
+
+    def reallocate(self, user_ids: Optional[Iterable[str]], weights: Dict[str, float]) -> Dict:
+        """
+        Set the same bucket weights for many users (None = every user) and
+        rebalance their existing bucket balances to match, in one vectorised
+        pass. Buckets not named in `weights` get weight 0 (and are emptied
+        into the others); new names (e.g. "emergency") add a bucket.
+        Each user's total across buckets is preserved to the micro.
+        """
+        target = BucketWeights.from_dict(weights)
+        with self._lock:
+            columns = [self._bucket_column(name) for name in target.names]
+            row = np.zeros(len(self.bucket_names))
+            row[columns] = target.weights
+
+            if user_ids is None:
+                slots = np.array(sorted(self._slot_of.values()), dtype=np.int64)
+            else:
+                slots = np.array(sorted({self._slot_of[u] for u in user_ids if u in self._slot_of}), dtype=np.int64)
+
+            new_weights = np.tile(row, (len(slots), 1))
+            self.bucket_weights[slots] = new_weights
+            totals = self.buckets[slots].sum(axis=1)
+            self.buckets[slots] = split_array(totals, new_weights)
+
+            return {
+                "users": int(len(slots)),
+                "rebalanced": from_micros(int(totals.sum())),
+                "weights": target.as_dict(),
+            }
+
+    def book(self, pair: str) -> PairBook:
+        book = self._books.get(pair)
+        if book is None:
+            book = self._books.setdefault(pair, PairBook(pair))
+        return book
+
+    def pairs(self) -> List[str]:
+        return list(self._books)
+
+    # -------------------------------------------------
+    # Shard handoff (see app/shard_router.py)
+    # -------------------------------------------------
+    def user_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._slot_of)
+
+    def export_users(self, user_ids: Iterable[str]) -> List[Dict]:
+        """
+        Everything held for these users (unknown ones are skipped), as
+        JSON-able records for import_users() on another process. Amounts
+        stay int micros, so a handoff is exact.
+        """
+        records = []
+        with self._lock:
+            for user_id in user_ids:
+                slot = self._slot_of.get(user_id)
+                if slot is None:
+                    continue
+                books = {}
+                for pair, book in self._books.items():
+                    row = book.row_of.get(slot)
+                    if row is None:
+                        continue
+                    books[pair] = {
+                        "pending": int(book.pending[row]),
+                        "baseline_rate": None if np.isnan(book.baseline_rate[row]) else float(book.baseline_rate[row]),
+                        "total_received": int(book.total_received[row]),
+                        "last_deposit": None if np.isnan(book.last_deposit[row]) else float(book.last_deposit[row]),
+                        "extra_gained": int(book.extra_gained[row]),
+                        "tranches": book.tranches.export_row(row),
+                    }
+                records.append({
+                    "user_id": user_id,
+                    "instant_available": int(self.instant_available[slot]),
+                    "total_salary_received": int(self.total_salary_received[slot]),
+                    "instant_percent": float(self.instant_percent[slot]),
+                    "max_wait_seconds": float(self.max_wait_seconds[slot]),
+                    "risk_level": RISK_LEVELS[self.risk_level[slot]],
+                    "buckets": dict(zip(self.bucket_names, self.buckets[slot].tolist())),
+                    "bucket_weights": dict(zip(self.bucket_names, self.bucket_weights[slot].tolist())),
+                    "books": books,
+                })
+        return records
+
+    def import_users(self, records: Iterable[Dict]) -> int:
+        """Load export_users() records, replacing these users if already present."""
+        count = 0
+        with self._lock:
+            for record in records:
+                user_id = record["user_id"]
+                self._drop(user_id)
+                slot = self._slot(user_id)
+                self.instant_available[slot] = record["instant_available"]
+                self.total_salary_received[slot] = record["total_salary_received"]
+                self.instant_percent[slot] = record["instant_percent"]
+                self.max_wait_seconds[slot] = record["max_wait_seconds"]
+                self.risk_level[slot] = RISK_LEVELS.index(record.get("risk_level", "safe"))
+                columns = [self._bucket_column(name) for name in record["buckets"]]
+                self.buckets[slot] = 0
+                self.buckets[slot, columns] = list(record["buckets"].values())
+                self.bucket_weights[slot] = 0.0
+                self.bucket_weights[slot, columns] = [record["bucket_weights"].get(name, 0.0) for name in record["buckets"]]
+
+                for pair, data in record["books"].items():
+                    book = self.book(pair)
+                    row = book.row(slot)
+                    book.pending[row] = data["pending"]
+                    book.baseline_rate[row] = np.nan if data["baseline_rate"] is None else data["baseline_rate"]
+                    book.total_received[row] = data["total_received"]
+                    book.last_deposit[row] = np.nan if data["last_deposit"] is None else data["last_deposit"]
+                    book.extra_gained[row] = data["extra_gained"]
+                    book.tranches.load_row(row, data["tranches"])
+                count += 1
+        return count
+
+    def drop_users(self, user_ids: Iterable[str]) -> int:
+        """Forget these users (after another shard imported them); returns how many."""
+        with self._lock:
+            return sum(self._drop(user_id) for user_id in user_ids)
+
+    def _drop(self, user_id: str) -> bool:
+        # the slot and its book rows go back to defaults and onto the free
+        # lists, for _slot() / PairBook.row() to reuse
+        slot = self._slot_of.pop(user_id, None)
+        if slot is None:
+            return False
+        self.instant_available[slot] = 0
+        self.total_salary_received[slot] = 0
+        self.buckets[slot] = 0
+        self.instant_percent[slot] = 0.4
+        self.max_wait_seconds[slot] = 24 * 3600.0
+        self.risk_level[slot] = _DEFAULT_RISK
+        self.bucket_weights[slot] = 0.0
+        self.bucket_weights[slot, : len(DEFAULT_WEIGHTS)] = DEFAULT_WEIGHTS
+        for book in self._books.values():
+            book.release(slot)
+        self._user_ids[slot] = None
+        self._free_slots.append(slot)
+        return True
+
+    # -------------------------------------------------
+    # Engine
+    # -------------------------------------------------
+    @metrics.timed("pair_routing.allocate_salary")
+    def allocate_salary(self, user_id: str, pair: str, amount: float, fx_rate_at_deposit: float, now: Optional[float] = None):
+        """Split a deposit (in USDC) into instant vs. optimised-for-`pair`."""
+        with self._lock:
+            slot = self._slot(user_id)
+            if amount <= 0:
+                return self.user_to_dict(user_id)
+
+            book = self.book(pair)
+            row = book.row(slot)
+            amount_micros = to_micros(amount)
+
+            # weighted baseline across this pair's deposits
+            previous_total = book.total_received[row]
+            if np.isnan(book.baseline_rate[row]) or previous_total <= 0:
+                book.baseline_rate[row] = fx_rate_at_deposit
+            else:
+                book.baseline_rate[row] = (
+                    book.baseline_rate[row] * previous_total + fx_rate_at_deposit * amount_micros
+                ) / (previous_total + amount_micros)
+
+            instant = mul_fraction(amount_micros, float(self.instant_percent[slot]))
+            book.pending[row] += amount_micros - instant
+            book.total_received[row] += amount_micros
+            book.last_deposit[row] = time.time() if now is None else now
+
+            self.instant_available[slot] += instant
+            self.total_salary_received[slot] += amount_micros
+
+            metrics.deposits_total.inc()
+            metrics.deposited_volume.inc(amount)
+            return self.user_to_dict(user_id)
+
+    @metrics.timed("pair_routing.optimisation_tick")
+    def optimisation_tick(
+        self,
+        pair: str,
+        market_condition: MarketCondition,
+        current_fx_rate: float,
+        now: Optional[float] = None,
+        policy: Optional[PolicyLookup] = None,
+    ) -> Dict:
+        """
+        One vectorised optimisation step over every user holding `pair`.
+        Users past their max wait convert everything, the rest convert
+        the market-condition fraction of their pending amount, or the
+        fraction from their own (max wait, risk level) policy table for
+        how far into their wait they are, when `policy` has that table.
+        """
+        with self._lock:
+            book = self._books.get(pair)
+            if book is None or book.size == 0:
+                return {"pair": pair, "users": 0, "converted": 0.0}
+
+            now = time.time() if now is None else now
+            n = book.size
+            slots = book.slots[:n]
+            pending = book.pending[:n]
+
+            waited = now - book.last_deposit[:n]
+            max_wait = self.max_wait_seconds[slots]
+            fraction = np.where(waited >= max_wait, 1.0, CONVERT_FRACTION_BY_CODE[market_condition.code])
+            if policy is not None:
+                # no max wait (<= 0): always converts in full, no table
+                has_wait = max_wait > 0
+                groups = max_wait_buckets(max_wait) * len(RISK_LEVELS) + self.risk_level[slots]
+                for group in np.unique(groups[has_wait]).tolist():
+                    hours, risk = divmod(group, len(RISK_LEVELS))
+                    table = policy(hours * 3600.0, RISK_LEVELS[risk])
+                    if table is not None:
+                        rows = (groups == group) & has_wait
+                        fraction[rows] = table.fractions(waited[rows] / max_wait[rows], market_condition)
+            amount = mul_fraction_array(pending, fraction)
+            amount[pending <= 0] = 0
+            return self._apply_conversion(book, np.arange(n), amount, current_fx_rate, now)
+
+    @metrics.timed("pair_routing.override_convert_now")
+    def override_convert_now(self, user_id: str, current_fx_rates: Dict[str, float], pair: Optional[str] = None) -> Dict:
+        """Convert everything pending for one user (in one pair or all of them)."""
+        with self._lock:
+            slot = self._slot(user_id)
+            for book in ([self.book(pair)] if pair else list(self._books.values())):
+                row = book.row_of.get(slot)
+                if row is None or book.pending[row] <= 0:
+                    continue
+                rate = current_fx_rates.get(book.pair)
+                rows = np.array([row])
+                self._apply_conversion(book, rows, book.pending[rows].copy(), rate, time.time())
+            return self.user_to_dict(user_id)
+
+    def _apply_conversion(
+        self,
+        book: PairBook,
+        rows: np.ndarray,
+        amount: np.ndarray,
+        current_fx_rate: Optional[float],
+        now: float,
+    ) -> Dict:
+        # converting rows only: a released row (pending 0) may still name a
+        # slot that was reused, and a repeated index would drop an update below
+        converting = amount > 0
+        rows, amount = rows[converting], amount[converting]
+        slots = book.slots[rows]
+
+        book.pending[rows] -= amount
+        self.instant_available[slots] += amount
+        self.buckets[slots] += split_array(amount, self.bucket_weights[slots])
+
+        gain = np.zeros(len(rows), dtype=np.int64)
+        if current_fx_rate is not None:
+            baseline = book.baseline_rate[rows]
+            gain = np.where(np.isnan(baseline), 0, np.rint(amount * (current_fx_rate - baseline))).astype(np.int64)
+            book.extra_gained[rows] += gain
+
+        book.tranches.append(rows, now, amount, current_fx_rate, gain)
+
+        converted = from_micros(int(amount.sum()))
+        converted_users = int(np.count_nonzero(amount))
+        if converted_users:
+            metrics.conversions_total.inc(converted_users)
+            metrics.converted_volume.inc(converted)
+        return {"pair": book.pair, "users": converted_users, "converted": converted}
+
+    # -------------------------------------------------
+    # Views
+    # -------------------------------------------------
+    def bulk_status(
+        self,
+        user_ids: Optional[Iterable[str]] = None,
+        min_pending: Optional[float] = None,
+        deadline_within: Optional[float] = None,
+        pair: Optional[str] = None,
+        now: Optional[float] = None,
+    ) -> Iterator[Dict]:
+        """
+        Optimisation status (pending, progress, time left, deadline) of every
+        (user, pair) row matching the filters:
+        - user_ids: only these users
+        - min_pending: pending > min_pending USDC
+        - deadline_within: max wait runs out within this many seconds
+        Computed per book in one vectorised pass over the columns (under the
+        lock), then yielded row by row so callers can stream the result.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            selected = None
+            if user_ids is not None:
+                selected = np.zeros(len(self._user_ids), dtype=bool)
+                slots = [self._slot_of[u] for u in user_ids if u in self._slot_of]
+                selected[slots] = True
+            books = [b for b in self._books.values() if not pair or b.pair == pair]
+            ids_by_slot = self._user_ids
+
+            snapshots = []
+            for book in books:
+                n = book.size
+                slots = book.slots[:n]
+                pending = book.pending[:n]
+                last_deposit = book.last_deposit[:n]
+                max_wait = self.max_wait_seconds[slots]
+
+                elapsed = now - last_deposit
+                time_left = np.maximum(max_wait - elapsed, 0.0)
+                has_wait = max_wait > 0
+                progress = np.where(has_wait, np.clip(elapsed / np.where(has_wait, max_wait, 1.0), 0.0, 1.0), 1.0)
+
+                mask = ~np.isnan(last_deposit)
+                if selected is not None:
+                    mask &= selected[slots]
+                if min_pending is not None:
+                    mask &= pending > to_micros(min_pending)
+                if deadline_within is not None:
+                    mask &= (pending > 0) & (time_left <= deadline_within)
+
+                rows = np.flatnonzero(mask)
+                # ids now: a slot can be reused once the lock is released
+                snapshots.append((
+                    book.pair,
+                    [ids_by_slot[slot] for slot in slots[rows].tolist()],
+                    (pending[rows] / MICROS).tolist(),
+                    progress[rows].tolist(),
+                    time_left[rows].tolist(),
+                    (last_deposit[rows] + max_wait[rows]).tolist(),
+                ))
+
+        for name, ids, pending, progress, time_left, deadline in snapshots:
+            for i, user_id in enumerate(ids):
+                yield {
+                    "userId": user_id,
+                    "pair": name,
+                    "pending": pending[i],
+                    "progress": progress[i],
+                    "timeLeft": time_left[i],
+                    "deadline": deadline[i],
+                }
+
+    def gain_report(self, user_id: str, edges: np.ndarray, pair: Optional[str] = None) -> Dict:
+        """Converted amount and FX gain per pair between `edges` (see gain_ledger.report)."""
+        with self._lock:
+            slot = self._slot_of.get(user_id)
+            pairs = {}
+            for name, book in self._books.items():
+                row = book.row_of.get(slot) if slot is not None else None
+                if row is None or (pair and name != pair):
+                    continue
+                pairs[name] = report(book.tranches.totals(row, edges), edges)
+
+            return {
+                "userId": user_id,
+                "converted": sum(p["converted"] for p in pairs.values()),
+                "gain": sum(p["gain"] for p in pairs.values()),
+                "tranches": sum(p["tranches"] for p in pairs.values()),
+                "exact": all(p["exact"] for p in pairs.values()),
+                "pairs": pairs,
+            }
+
+    def user_to_dict(self, user_id: str) -> Dict:
+        with self._lock:
+            slot = self._slot_of.get(user_id)
+            if slot is None:
+                return {"userId": user_id, "pairs": {}}
+
+            pairs = {}
+            for pair, book in self._books.items():
+                row = book.row_of.get(slot)
+                if row is None:
+                    continue
+                baseline = book.baseline_rate[row]
+                pairs[pair] = {
+                    "optimisedPending": int(book.pending[row]),
+                    "totalReceived": int(book.total_received[row]),
+                    "baselineFxRate": 0.0 if np.isnan(baseline) else float(baseline),
+                    "extraGainedVsInstant": int(book.extra_gained[row]),
+                }
+            pending = sum(p["optimisedPending"] for p in pairs.values())
+            gained = sum(p["extraGainedVsInstant"] for p in pairs.values())
+            for p in pairs.values():
+                for key in ("optimisedPending", "totalReceived", "extraGainedVsInstant"):
+                    p[key] = from_micros(p[key])
+
+            return {
+                "userId": user_id,
+                "instantAvailable": from_micros(int(self.instant_available[slot])),
+                "optimisedPending": from_micros(pending),
+                "rentBucket": from_micros(int(self.buckets[slot, 0])),
+                "savingsBucket": from_micros(int(self.buckets[slot, 1])),
+                "investingBucket": from_micros(int(self.buckets[slot, 2])),
+                "buckets": {name: from_micros(int(v)) for name, v in zip(self.bucket_names, self.buckets[slot])},
+                "bucketWeights": dict(zip(self.bucket_names, self.bucket_weights[slot].tolist())),
+                "maxWaitSeconds": float(self.max_wait_seconds[slot]),
+                "riskLevel": RISK_LEVELS[self.risk_level[slot]],
+                "totalSalaryReceived": from_micros(int(self.total_salary_received[slot])),
+                "extraGainedVsInstant": from_micros(gained),
+                "pairs": pairs,
+            }
+
+
+pair_router = PairRouter()
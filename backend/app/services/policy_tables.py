@@ -0,0 +1,269 @@
+"""
+PolicyTables
+------------
+Replaces the hand-picked convert fractions (GOOD 50%, OK 20%, BAD 0%) with
+precomputed optimal ones.
+
+Offline: solve_policy() runs dynamic programming over
+(time bucket until max wait) x (market regime) using a regime model
+(transition matrix + rate level/variance per regime) and a risk
+aversion per risk_level. The result is a tiny float32 table of
+"fraction of pending to convert now".
+
+Runtime: tables are saved as .npy and memory-mapped, so a tick does one
+table read instead of branch logic. PolicyCache keeps one table per
+(max_wait bucket, risk_level) and regenerates it in a background thread
+whenever the regime model changes; tables of older models are deleted.
+
+Rates are "local currency per USDC": converting now locks in the current
+regime's rate level; holding keeps the option of a better regime later but
+carries the regime's variance, and everything converts at the deadline.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.services.routing_service import MarketCondition
+
+logger = logging.getLogger(__name__)
+
+# Table column order = MarketCondition.code
+REGIMES = tuple(sorted(MarketCondition, key=lambda condition: condition.code))
+
+TIME_BUCKETS = 48
+ACTIONS = np.linspace(0.0, 1.0, 21)  # candidate convert fractions, 5% steps
+MAX_WAIT_BUCKETS_HOURS = (1, 6, 12, 24, 48, 72, 168)
+RISK_AVERSION = {"aggressive": 0.0, "balanced": 50.0, "safe": 200.0}
+
+
+@dataclass(frozen=True)
+class RegimeModel:
+    # transition[a][b]: probability that regime b follows regime a within one hour
+    transition: Tuple[Tuple[float, float, float], ...]
+    # rate in each regime relative to the average rate (1.0)
+    level: Tuple[float, float, float]
+    # hourly variance of log returns while in each regime
+    hourly_variance: Tuple[float, float, float]
+
+    def key(self) -> str:
+        """Short hash of the (rounded) inputs: tiny estimate changes don't trigger a re-solve."""
+        values = [*sum(self.transition, ()), *self.level, *self.hourly_variance]
+        raw = ",".join(f"{v:.2g}" for v in values)
+        return hashlib.sha1(raw.encode()).hexdigest()[:10]
+
+
+DEFAULT_MODEL = RegimeModel(
+    transition=((0.80, 0.15, 0.05), (0.20, 0.60, 0.20), (0.05, 0.25, 0.70)),
+    level=(1.004, 1.0, 0.996),
+    hourly_variance=(4e-6, 2e-6, 6e-6),
+)
+
+
+def max_wait_bucket(max_wait_seconds: float) -> int:
+    """Smallest bucket (in hours) that covers max_wait_seconds."""
+    hours = max_wait_seconds / 3600
+    for bucket in MAX_WAIT_BUCKETS_HOURS:
+        if hours <= bucket:
+            return bucket
+    return MAX_WAIT_BUCKETS_HOURS[-1]
+
+
+def max_wait_buckets(max_wait_seconds: np.ndarray) -> np.ndarray:
+    """Vectorised max_wait_bucket(): the bucket in hours per element."""
+    buckets = np.array(MAX_WAIT_BUCKETS_HOURS, dtype=np.int64)
+    index = np.searchsorted(buckets, max_wait_seconds / 3600, side="left")
+    return buckets[np.minimum(index, len(buckets) - 1)]
+
+
+def _step_transition(hourly: np.ndarray, hours: float) -> np.ndarray:
+    whole = int(hours)
+    partial = np.eye(3) + (hours - whole) * (hourly - np.eye(3))
+    return np.linalg.matrix_power(hourly, whole) @ partial
+
+
+def solve_policy(
+    max_wait_hours: float,
+    risk_level: str,
+    model: RegimeModel = DEFAULT_MODEL,
+    time_buckets: int = TIME_BUCKETS,
+) -> np.ndarray:
+    """
+    Backward induction from the deadline (where everything converts at
+    the regime's level). V[r] is the value of one pending unit in regime r.
+    Returns float32 [time_buckets, 3]: the fraction to convert now.
+    """
+    step_hours = max_wait_hours / time_buckets
+    transition = _step_transition(np.array(model.transition), step_hours)
+    level = np.array(model.level)
+    variance = np.array(model.hourly_variance) * step_hours
+    risk = RISK_AVERSION[risk_level]
+
+    table = np.empty((time_buckets, len(REGIMES)), dtype=np.float32)
+    value = level.copy()
+
+    hold = 1.0 - ACTIONS[:, None]
+    for t in reversed(range(time_buckets)):
+        continuation = transition @ value
+        candidates = (
+            ACTIONS[:, None] * level[None, :]
+            + hold * continuation[None, :]
+            - risk * hold ** 2 * variance[None, :]
+        )
+        best = candidates.argmax(axis=0)
+        table[t] = ACTIONS[best]
+        value = candidates[best, np.arange(len(REGIMES))]
+
+    return table
+
+
+class PolicyTable:
+
+    def __init__(self, table: np.ndarray, model_key: str):
+        self.table = table
+        self.model_key = model_key
+        self.time_buckets = table.shape[0]
+
+    def fraction(self, elapsed_seconds: float, max_wait_seconds: float, market_condition: MarketCondition) -> float:
+        if max_wait_seconds <= 0 or elapsed_seconds >= max_wait_seconds:
+            return 1.0
+        bucket = int(elapsed_seconds / max_wait_seconds * self.time_buckets)
+        return float(self.table[max(bucket, 0), market_condition.code])
+
+    def fractions(self, elapsed_ratio: np.ndarray, market_condition: MarketCondition) -> np.ndarray:
+        """Vectorised fraction() for an array of elapsed / max_wait ratios."""
+        buckets = np.clip((elapsed_ratio * self.time_buckets).astype(np.int64), 0, self.time_buckets - 1)
+        column = self.table[:, market_condition.code]
+        return np.where(elapsed_ratio >= 1.0, 1.0, column[buckets])
+
+
+class PolicyCache:
+
+    def __init__(self, directory: str, model: RegimeModel = DEFAULT_MODEL):
+        self.directory = directory
+        self.model = model
+        self._tables: Dict[Tuple[int, str], PolicyTable] = {}
+        self._solving: set = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        self._prune(model.key())
+
+    def get(self, max_wait_seconds: float, risk_level: str) -> Optional[PolicyTable]:
+        """
+        Table for the user's (max_wait bucket, risk_level). While a table is
+        being (re)generated this returns the previous one, or None, and the
+        caller falls back to the built-in fractions.
+        """
+        key = (max_wait_bucket(max_wait_seconds), risk_level if risk_level in RISK_AVERSION else "safe")
+        table = self._tables.get(key)
+        model_key = self.model.key()
+        if table is not None and table.model_key == model_key:
+            return table
+
+        path = self._path(key, model_key)
+        if os.path.exists(path):
+            table = self._tables[key] = PolicyTable(np.load(path, mmap_mode="r"), model_key)
+            return table
+
+        self._solve_in_background(key, self.model)
+        return table
+
+    def update_model(self, model: RegimeModel):
+        """Tables built from an older model are regenerated lazily on next use."""
+        if model.key() != self.model.key():
+            logger.info("Regime model changed (%s -> %s)", self.model.key(), model.key())
+            self.model = model
+            self._prune(model.key())
+
+    def start_refresh(self, model_fn: Callable[[], Optional[RegimeModel]], interval_seconds: float = 60.0):
+        """Periodically re-estimate the regime model (e.g. from the market classifier)."""
+        def run():
+            while not self._stop.wait(interval_seconds):
+                model = model_fn()
+                if model is not None:
+                    self.update_model(model)
+
+        threading.Thread(target=run, name="policy-refresh", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _path(self, key: Tuple[int, str], model_key: str) -> str:
+        hours, risk_level = key
+        return os.path.join(self.directory, f"policy_{hours}h_{risk_level}_{model_key}.npy")
+
+    def _prune(self, model_key: str):
+        """Delete saved tables of other models (tables in use stay readable: they're mmapped)."""
+        for name in os.listdir(self.directory):
+            if not name.startswith("policy_") or not name.endswith(".npy") or ".tmp" in name:
+                continue
+            if name[: -len(".npy")].rsplit("_", 1)[-1] != model_key:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def _solve_in_background(self, key: Tuple[int, str], model: RegimeModel):
+        job = (key, model.key())
+        with self._lock:
+            if job in self._solving:
+                return
+            self._solving.add(job)
+
+        def run():
+            try:
+                path = self._path(key, model.key())
+                tmp_path = path + ".tmp.npy"
+                np.save(tmp_path, solve_policy(key[0], key[1], model))
+                os.replace(tmp_path, path)
+                self._tables[key] = PolicyTable(np.load(path, mmap_mode="r"), model.key())
+                if model.key() != self.model.key():
+                    # the model changed while solving: usable until its replacement is ready
+                    self._prune(self.model.key())
+            except Exception:
+                logger.exception("Failed to build policy table %s", key)
+            finally:
+                with self._lock:
+                    self._solving.discard(job)
+
+        threading.Thread(target=run, name=f"policy-solve-{key}", daemon=True).start()
+
+
+def estimate_model(history, prior: RegimeModel = DEFAULT_MODEL, prior_weight: float = 50.0) -> Optional[RegimeModel]:
+    """
+    Regime model from MarketClassifier.regime_history(pair): transition
+    counts, per-regime rate levels and returns, blended with `prior` so thin
+    data doesn't produce extreme tables. Per-tick figures are scaled to
+    hours using the average tick interval.
+    """
+    if history is None or history.tick_seconds.n < 2 or history.tick_seconds.mean <= 0:
+        return None
+    ticks_per_hour = 3600.0 / history.tick_seconds.mean
+
+    per_tick = np.array([[history.transitions[a][b] for b in REGIMES] for a in REGIMES], dtype=float)
+    prior_per_tick = _step_transition(np.array(prior.transition), 1.0 / ticks_per_hour)
+    per_tick = per_tick + prior_weight * prior_per_tick
+    per_tick /= per_tick.sum(axis=1, keepdims=True)
+    hourly = _step_transition(per_tick, ticks_per_hour)
+
+    level, variance = [], []
+    for i, regime in enumerate(REGIMES):
+        levels = history.regime_levels[regime]
+        w = levels.n / (levels.n + prior_weight)
+        level.append(w * levels.mean + (1 - w) * prior.level[i])
+
+        returns = history.regime_returns[regime]
+        w = returns.n / (returns.n + prior_weight)
+        variance.append(w * returns.stdev ** 2 * ticks_per_hour + (1 - w) * prior.hourly_variance[i])
+
+    return RegimeModel(
+        transition=tuple(tuple(float(p) for p in row) for row in hourly),
+        level=tuple(level),
+        hourly_variance=tuple(variance),
+    )
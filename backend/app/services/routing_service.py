@@ -1,22 +1,46 @@
 from __future__ import annotations
 
-from dataclasses import dataclass # Used for defining simple classes for data without __init__
+import time # Unix timestamps for the gain ledger
+from dataclasses import dataclass, field, replace # Used for defining simple classes for data without __init__
 from datetime import datetime # Used to track when deposits happen
 from enum import Enum # Used for MarketCondition (GOOD/OK/BAD)
-from typing import Dict, Optional # Used for Type hints: Dict[str, float] - (value can also be None)
+from typing import Dict, Optional, Tuple # Used for Type hints: Dict[str, float] - (value can also be None)
+
+from app.services.gain_ledger import UserLedger # Per-conversion gain records for range reports
+from app.utils import metrics # Latency histograms + deposit/conversion counters for /metrics
+from app.utils.money import MICROS, cumulative, mul_fraction, to_micros # int micro-USDC amounts
+from app.utils.weights import DEFAULT_BUCKETS, DEFAULT_WEIGHTS, BucketWeights # validated, normalised weights
 
 class MarketCondition(str, Enum):
-    GOOD = "GOOD"
-    OK = "OK"
-    BAD = "BAD"
+    GOOD = ("GOOD", 0)
+    OK = ("OK", 1)
+    BAD = ("BAD", 2)
 
     """
     Using an enum with three possible values: GOOD/OK/BAD.
     Use this in optimisation logic to decide how aggresively to convert money from optimised to instant.
     Enums give autocompletion, safety and clearer code instead of passing raw strings.
+    Each member also carries a small int `code` (GOOD=0, OK=1, BAD=2) so ticks can index
+    tuples/arrays instead of comparing str enums.
     """
 
-@dataclass
+    def __new__(cls, value: str, code: int):
+        member = str.__new__(cls, value)
+        member._value_ = value
+        member.code = code
+        return member
+
+# Fraction of the optimised amount converted per tick, indexed by MarketCondition.code
+CONVERT_FRACTION_BY_CODE = (
+    0.5,  # GOOD: convert 50% of remaining
+    0.2,  # OK: convert 20% of remaining
+    0.0,  # BAD: convert nothing
+)
+
+# slots=True: no per-instance __dict__, which dominates memory once we keep a row per user
+# frozen=True: settings are immutable snapshots; updates build a new one (with_changes)
+# and swap it in (see app/utils/versioned.py), so a tick never sees a half-applied update
+@dataclass(frozen=True, slots=True)
 class UserSettings:
     instant_percent: float # The fraction of each salary that should be available immediately.
     max_wait_seconds: int # The time a user is willing to wait for optimisation (in seconds)
@@ -24,45 +48,68 @@ class UserSettings:
     savings_weight: float = 0.3 # The share of converted funds that go to savings.
     investing_weight: float = 0.2 # The share of converted funds that go to investing
 
-    def normalise_bucket_weights(self):
+    # Normalised (rent, savings, investing), computed once per snapshot
+    _weights: Tuple[float, ...] = field(default=DEFAULT_WEIGHTS, init=False, repr=False, compare=False)
+    # Their running sums (rent, rent + savings): split()'s bounds, so ticks don't redo them
+    _bounds: Tuple[float, ...] = field(default=cumulative(DEFAULT_WEIGHTS), init=False, repr=False, compare=False)
+
+    def __post_init__(self):
         """
-        Ensures the weights add up to 1.0 or 100% to protect us if weird values are set.
+        Validates the weights (ValueError for negative / non-finite values);
+        weights summing to 0 fall back to the 50/30/20 defaults.
         """
-        total = self.rent_weight + self.savings_weight + self.investing_weight
+        raw = (self.rent_weight, self.savings_weight, self.investing_weight)
+        weights = BucketWeights(DEFAULT_BUCKETS, raw, fallback=DEFAULT_WEIGHTS).weights
+        object.__setattr__(self, "_weights", weights)
+        object.__setattr__(self, "_bounds", cumulative(weights))
 
-        if total <= 0:
-            self.rent_weight = 0.5
-            self.savings_weight = 0.3
-            self.investing_weight = 0.2
-            return
+    def bucket_weights(self) -> Tuple[float, ...]:
+        return self._weights
+
+    def with_changes(self, **changes) -> UserSettings:
+        """
+        New snapshot with the non-None `changes` applied; raises ValueError
+        (and `self` is untouched) for invalid weights.
+        """
+        changes = {name: value for name, value in changes.items() if value is not None}
+        return replace(self, **changes) if changes else self
 
-        self.rent_weight /= total
-        self.savings_weight /= total
-        self.investing_weight /= total
+    def normalised(self) -> UserSettings:
+        """
+        Same settings with weights that add up to 1.0 or 100% to protect us if weird values are set.
+        """
+        rent_weight, savings_weight, investing_weight = self._weights
+        return replace(self, rent_weight=rent_weight, savings_weight=savings_weight, investing_weight=investing_weight)
 
-@dataclass
+@dataclass(slots=True)
 class UserState:
     """
     Represents current situation for one user in the optimiser.
+    All amounts are int micro-USDC (see app/utils/money.py).
     """
 
-    instant_available: float = 0.0 # Represents how much USDC they can use right nowe
-    optimised_pending: float = 0.0 # Represents how much is still waiting in the optimised lane
+    instant_available: int = 0 # Represents how much USDC they can use right nowe
+    optimised_pending: int = 0 # Represents how much is still waiting in the optimised lane
     
     # Represents allocations of converted funds
-    rent_bucket: float = 0.0
-    savings_bucket: float = 0.0
-    investing_bucket: float = 0.0
+    rent_bucket: int = 0
+    savings_bucket: int = 0
+    investing_bucket: int = 0
 
     # Represents time tracking for optimisation logic
     last_deposit_time: Optional[datetime] = None
-    total_salary_received: float = 0.0
+    total_salary_received: int = 0
 
     # Rpresents FX Comparison compared to the idea of converting everything instantly
+    # (micros of local currency)
     baseline_fx_rate: Optional[float] = None
-    extra_gained_vs_instant: float = 0.0
+    extra_gained_vs_instant: int = 0
+
+    # Represents every conversion (tranche) with its gain, for "gain last month" queries.
+    # Created on the first conversion so idle users don't carry empty arrays.
+    tranches: Optional[UserLedger] = field(default=None, repr=False, compare=False)
 
-def _update_baseline_fx_rate(state: UserState, deposit_amount: float, fx_rate_at_deposit: float):
+def _update_baseline_fx_rate(state: UserState, deposit_amount: int, fx_rate_at_deposit: float):
     """
     Maintain a weighted average baseline FX rate across multiple deposits.
     This lets us estimate what happens if everything was converted instantly at deposit time.
@@ -81,53 +128,83 @@ def _update_baseline_fx_rate(state: UserState, deposit_amount: float, fx_rate_at
     weighted_rate = ((previous_rate * previous_total) + (fx_rate_at_deposit * deposit_amount)) / new_total
     state.baseline_fx_rate = weighted_rate
 
-def _allocate_to_buckets(amount: float, settings: UserSettings, state: UserState):
+def _allocate_to_buckets(amount: int, settings: UserSettings, state: UserState):
     """
     Allocate a converted amount into rent/savings/investing buckets, according to user preferences.
+    The three shares always add up to exactly `amount`.
     """
 
     if amount <= 0:
         return
-    
-    settings.normalise_bucket_weights()
 
-    state.rent_bucket += amount * settings.rent_weight
-    state.savings_bucket += amount * settings.savings_weight
-    state.investing_bucket += amount * settings.investing_weight
+    # split(amount, settings.bucket_weights()) unrolled over the precomputed bounds
+    rent_bound, savings_bound = settings._bounds
+    rent = int(amount * rent_bound)
+    savings = int(amount * savings_bound)
+    if savings > amount:  # weights summing to 1.0000000001
+        savings = amount
+        rent = min(rent, amount)
+    state.rent_bucket += rent
+    state.savings_bucket += savings - rent
+    state.investing_bucket += amount - savings
+
+_EPOCH = datetime(1970, 1, 1)
 
-def _update_fx_gain(state: UserState, converted_amount: float, current_fx_rate: float):
+def _update_fx_gain(state: UserState, converted_amount: int, current_fx_rate: float, now: Optional[datetime] = None):
     """
     Estimate the extra value the user gained vs converting instantly
     """
 
     if converted_amount <= 0:
         return
-    if state.baseline_fx_rate is None:
-        return
-    
-    extra = converted_amount * (current_fx_rate - state.baseline_fx_rate)
-    state.extra_gained_vs_instant += extra
+    extra = 0
+    if state.baseline_fx_rate is not None:
+        extra = round(converted_amount * (current_fx_rate - state.baseline_fx_rate))
+        state.extra_gained_vs_instant += extra
+
+    # unix seconds; naive UTC `now` -> seconds is much cheaper than .replace(tzinfo=...).timestamp()
+    ts = time.time() if now is None else (now - _EPOCH).total_seconds()
+    if state.tranches is None:
+        state.tranches = UserLedger()
+    state.tranches.append(ts, converted_amount, current_fx_rate, extra)
+
+def _record_conversion(amount: int):
+    if amount > 0:
+        metrics.conversions_total.inc()
+        metrics.converted_volume.inc(amount / MICROS)
+
+def settings_to_dict(settings: UserSettings):
+    return {
+        "instantPercent": settings.instant_percent,
+        "maxWaitSeconds": settings.max_wait_seconds,
+        "rentWeight": settings.rent_weight,
+        "savingsWeight": settings.savings_weight,
+        "investingWeight": settings.investing_weight,
+    }
 
 def state_to_dict(state: UserState):
     """
-    Turn the state object into a dictionary for JSON responses.
+    Turn the state object into a dictionary for JSON responses (amounts back in USDC).
     """
+    # inlined from_micros(): this runs on every response
     return {
-        "instantAvailable": state.instant_available,
-        "optimisedPending": state.optimised_pending,
-        "rentBucket": state.rent_bucket,
-        "savingsBucket": state.savings_bucket,
-        "investingBucket": state.investing_bucket,
-        "totalSalaryReceived": state.total_salary_received,
-        "extraGainedVsInstant": state.extra_gained_vs_instant,
+        "instantAvailable": state.instant_available / MICROS,
+        "optimisedPending": state.optimised_pending / MICROS,
+        "rentBucket": state.rent_bucket / MICROS,
+        "savingsBucket": state.savings_bucket / MICROS,
+        "investingBucket": state.investing_bucket / MICROS,
+        "totalSalaryReceived": state.total_salary_received / MICROS,
+        "extraGainedVsInstant": state.extra_gained_vs_instant / MICROS,
         "baselineFxRate": state.baseline_fx_rate if state.baseline_fx_rate is not None else 0.0,
     }
 
+@metrics.timed("allocate_salary")
 def allocate_salary(amount: float, settings: UserSettings, state: UserState, fx_rate_at_deposit: float):
     """
     Handle a new salary deposit:
     - Split into instant vs optimised parts
     - Update baseline FX rate and totals
+    `amount` is in USDC; it is stored as micros.
     """
 
     if amount <= 0:
@@ -139,38 +216,46 @@ def allocate_salary(amount: float, settings: UserSettings, state: UserState, fx_
     
     now = datetime.utcnow()
     state.last_deposit_time = now
+    amount_micros = to_micros(amount)
 
     # Update total salary and baseline FX
-    state.total_salary_received += amount
-    _update_baseline_fx_rate(state, deposit_amount=amount, fx_rate_at_deposit=fx_rate_at_deposit)
+    state.total_salary_received += amount_micros
+    _update_baseline_fx_rate(state, deposit_amount=amount_micros, fx_rate_at_deposit=fx_rate_at_deposit)
 
-    # Split into instant and optimised
-    instant_amount = amount * settings.instant_percent
-    optimised_amount = amount - instant_amount
+    # Split into instant and optimised (instant rounds down, the optimised lane gets the rest)
+    instant_amount = mul_fraction(amount_micros, settings.instant_percent)
+    optimised_amount = amount_micros - instant_amount
 
 
     state.instant_available += instant_amount
     state.optimised_pending += optimised_amount
 
+    metrics.deposits_total.inc()
+    metrics.deposited_volume.inc(amount)
+
     return {
         "deposited": amount,
         "converted_this_run": 0.0,
         **state_to_dict(state),
     }
 
+@metrics.timed("optimisation_tick")
 def optimisation_tick(
     settings: UserSettings,
     state: UserState,
     market_condition: MarketCondition,
     current_fx_rate: float,
     now: datetime = None,
+    policy=None,
 ):
     """
     Run an optimisation step:
     - Decide how much of the optimised amount to convert
     - Based on market condition and max wait time
+    - With a policy table (see policy_tables), the fraction is one table read
     """
 
+    ledger_now = now  # None: the ledger stamps the tranche with time.time()
     if now is None:
         now = datetime.utcnow()
 
@@ -189,16 +274,14 @@ def optimisation_tick(
     if time_since_deposit >= max_wait:
         # Max wait time reached: convert everything
         convert_fraction = 1.0
+    elif policy is not None:
+        # Precomputed optimal fraction for (time left, market condition)
+        convert_fraction = policy.fraction(time_since_deposit, max_wait, market_condition)
     else:
         # Otherwise decide based on market condition
-        if market_condition == MarketCondition.GOOD:
-            convert_fraction = 0.5  # convert 50% of remaining
-        elif market_condition == MarketCondition.OK:
-            convert_fraction = 0.2  # convert 20% of remaining
-        else:  # BAD
-            convert_fraction = 0.0  # convert nothing
+        convert_fraction = CONVERT_FRACTION_BY_CODE[market_condition.code]
 
-    amount_to_convert = state.optimised_pending * convert_fraction
+    amount_to_convert = mul_fraction(state.optimised_pending, convert_fraction)
 
     # Update balances
     state.optimised_pending -= amount_to_convert
@@ -206,15 +289,17 @@ def optimisation_tick(
 
     # Allocate to buckets and update FX gain
     _allocate_to_buckets(amount_to_convert, settings, state)
-    _update_fx_gain(state, converted_amount=amount_to_convert, current_fx_rate=current_fx_rate)
+    _update_fx_gain(state, converted_amount=amount_to_convert, current_fx_rate=current_fx_rate, now=ledger_now)
+    _record_conversion(amount_to_convert)
 
     return {
         "deposited": 0.0,
-        "converted_this_run": amount_to_convert,
+        "converted_this_run": amount_to_convert / MICROS,
         **state_to_dict(state),
     }
 
 
+@metrics.timed("override_convert_now")
 def override_convert_now(settings: UserSettings, state: UserState, current_fx_rate: float):
     """
     User presses a button to convert everything now:
@@ -231,15 +316,16 @@ def override_convert_now(settings: UserSettings, state: UserState, current_fx_ra
             **state_to_dict(state),
         }
     
-    state.optimised_pending = 0.0
+    state.optimised_pending = 0
     state.instant_available += amount_to_convert
 
     _allocate_to_buckets(amount_to_convert, settings, state)
     _update_fx_gain(state, converted_amount=amount_to_convert, current_fx_rate=current_fx_rate)
+    _record_conversion(amount_to_convert)
 
     return {
         "deposited": 0.0,
-        "converted_this_run": amount_to_convert,
+        "converted_this_run": amount_to_convert / MICROS,
         **state_to_dict(state),
     }
 
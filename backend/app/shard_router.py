@@ -0,0 +1,440 @@
+"""
+Shard router
+------------
+Front for N backend processes (app.main:app), each holding the users that
+consistent hashing (app/utils/hash_ring.py) assigns to it:
+
+- requests for one user (/api/pairs/*?user_id=...) go to its owning shard
+- pair ticks, bulk status and reallocation are scattered to every shard
+  (user_ids split by owner) and the results gathered into one response
+- FX ticks are broadcast so every shard sees the same feed
+- anything else (the single-user demo, FX reads) goes to the first shard
+- POST /shards adds a shard: only the users the new shard now owns are
+  exported from their old shards, imported, then dropped from the old ones.
+  Those users are frozen meanwhile: writes to them (and ticks /
+  reallocations over every user) get a 503 with Retry-After, and the copy
+  starts once writes already forwarded to them have finished
+
+Shards are listed in CROSSPAY_SHARDS (comma-separated base URLs) and each
+needs its own CROSSPAY_DATA_DIR. The ring membership is saved to
+CROSSPAY_RING_FILE (default shard_ring.json in the router's data dir) when
+a shard is added; once that file exists it wins over CROSSPAY_SHARDS, so a
+restarted router keeps the shards, in the order they were added. To try it
+with local processes:
+
+    cd backend
+    python -m app.shard_router --spawn 3     # shards on :8001-8003, router on :8000
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel
+
+from app.utils import metrics
+from app.utils.admin import require_admin
+from app.utils.data_dir import data_path
+from app.utils.hash_ring import DEFAULT_VNODES, HashRing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_USER_ID = "demo-user"  # what the shards assume without ?user_id=
+SHARD_TIMEOUT = 30.0
+HANDOFF_CHUNK = 5_000
+HANDOFF_RETRY_AFTER = 1  # seconds, for writes refused during a handoff
+
+# not forwarded: set again by httpx / the ASGI server for each hop
+_HOP_HEADERS = {"host", "content-length", "connection", "transfer-encoding", "accept-encoding", "content-encoding"}
+
+
+def _forwarded(shard: str):
+    return metrics.counter("crosspay_router_requests_total", "Requests forwarded to each shard", shard=shard)
+
+
+def _headers(headers) -> Dict[str, str]:
+    return {k: v for k, v in headers.items() if k.lower() not in _HOP_HEADERS}
+
+
+class HandoffInProgress(Exception):
+    """A write to users that add_shard() is moving (503 + Retry-After)."""
+
+
+class ShardSet:
+    """The ring plus one HTTP client per shard."""
+
+    def __init__(
+        self,
+        urls: List[str],
+        admin_token: Optional[str] = None,
+        vnodes: int = DEFAULT_VNODES,
+        ring_path: Optional[str] = None,
+    ):
+        self.ring_path = ring_path
+        if ring_path and os.path.exists(ring_path):
+            with open(ring_path) as f:
+                saved = json.load(f)
+            if urls and urls != saved["shards"]:
+                logger.warning("Using the shards saved in %s, not CROSSPAY_SHARDS: %s", ring_path, saved["shards"])
+            urls, vnodes = saved["shards"], saved["vnodes"]
+        self.ring = HashRing(urls, vnodes=vnodes)
+        self.admin_token = admin_token
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._resize = asyncio.Lock()
+        # while add_shard() runs: the ring it switches to and the new shard
+        self._next: Optional[HashRing] = None
+        self._adding: Optional[str] = None
+        # forwarded writes still waiting on a shard: id -> user_ids (None = every user)
+        self._writes: Dict[int, Optional[List[str]]] = {}
+
+    @property
+    def shards(self) -> List[str]:
+        return self.ring.nodes
+
+    def owner(self, user_id: str) -> str:
+        return self.ring.node_for(user_id)
+
+    def client(self, shard: str) -> httpx.AsyncClient:
+        client = self._clients.get(shard)
+        if client is None:
+            client = self._clients[shard] = httpx.AsyncClient(base_url=shard, timeout=SHARD_TIMEOUT)
+        return client
+
+    async def request(self, shard: str, method: str, path: str, **kwargs) -> httpx.Response:
+        _forwarded(shard).inc()
+        return await self.client(shard).request(method, path, **kwargs)
+
+    async def scatter(self, method: str, path: str, bodies: Dict[str, dict], **kwargs) -> Dict[str, httpx.Response]:
+        """Same route on several shards at once, one JSON body per shard."""
+        responses = await asyncio.gather(*(
+            self.request(shard, method, path, json=body, **kwargs) for shard, body in bodies.items()
+        ))
+        return dict(zip(bodies, responses))
+
+    async def _admin(self, shard: str, method: str, path: str, body: Optional[dict] = None) -> dict:
+        headers = {"X-Admin-Token": self.admin_token} if self.admin_token else {}
+        response = await self.request(shard, method, path, json=body, headers=headers)
+        response.raise_for_status()
+        return response.json()
+
+    # -------------------------------------------------
+    # Writes vs handoff
+    # -------------------------------------------------
+    def _moving(self, user_ids: Optional[List[str]]) -> bool:
+        if self._next is None:
+            return False
+        if user_ids is None:
+            return True
+        return any(self._next.node_for(user_id) == self._adding for user_id in user_ids)
+
+    @asynccontextmanager
+    async def writing(self, user_ids: Optional[List[str]]) -> AsyncIterator[None]:
+        """
+        Around forwarding a write to `user_ids` (None = every user, like a
+        tick). Raises HandoffInProgress if add_shard() is moving any of them.
+        """
+        if self._moving(user_ids):
+            raise HandoffInProgress("Users are moving to a new shard, retry shortly")
+        token = object()
+        self._writes[id(token)] = user_ids
+        try:
+            yield
+        finally:
+            del self._writes[id(token)]
+
+    async def _drain(self):
+        """Wait for writes forwarded before the freeze that touch moving users."""
+        while any(self._moving(user_ids) for user_ids in self._writes.values()):
+            await asyncio.sleep(0.01)
+
+    def _save_ring(self, ring: HashRing):
+        if not self.ring_path:
+            return
+        tmp_path = self.ring_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"shards": ring.nodes, "vnodes": ring.vnodes}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.ring_path)
+
+    async def add_shard(self, url: str) -> Dict:
+        """
+        Put `url` on the ring and hand it the users it now owns: freeze
+        them, copy them over, save and switch the ring, then drop them from
+        their old shards. A failure before the switch leaves the ring as it
+        was (and a retry imports over the partial copy).
+        """
+        async with self._resize:
+            if url in self.ring:
+                raise ValueError(f"{url} is already a shard")
+            ring = self.ring.copy()
+            ring.add(url)
+
+            self._next, self._adding = ring, url
+            try:
+                await self._drain()
+                moving: Dict[str, List[str]] = {}
+                for shard in self.ring.nodes:
+                    user_ids = (await self._admin(shard, "GET", "/api/admin/shard/users"))["userIds"]
+                    moving[shard] = [user_id for user_id in user_ids if ring.node_for(user_id) == url]
+                    for start in range(0, len(moving[shard]), HANDOFF_CHUNK):
+                        chunk = moving[shard][start:start + HANDOFF_CHUNK]
+                        exported = await self._admin(shard, "POST", "/api/admin/shard/export", {"user_ids": chunk})
+                        await self._admin(url, "POST", "/api/admin/shard/import", {"users": exported["users"]})
+
+                self._save_ring(ring)
+                self.ring = ring
+            finally:
+                self._next = self._adding = None
+
+            # only stale copies left on the old shards: requests go to `url` now
+            for shard, user_ids in moving.items():
+                for start in range(0, len(user_ids), HANDOFF_CHUNK):
+                    await self._admin(shard, "POST", "/api/admin/shard/drop", {"user_ids": user_ids[start:start + HANDOFF_CHUNK]})
+
+            moved = {shard: len(user_ids) for shard, user_ids in moving.items()}
+            return {"shards": self.ring.nodes, "moved": moved, "total": sum(moved.values())}
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.aclose()
+
+
+def _shard_urls() -> List[str]:
+    return [url.strip().rstrip("/") for url in os.getenv("CROSSPAY_SHARDS", "").split(",") if url.strip()]
+
+
+shards = ShardSet(
+    _shard_urls(),
+    admin_token=os.getenv("CROSSPAY_ADMIN_TOKEN"),
+    ring_path=os.getenv("CROSSPAY_RING_FILE") or data_path("shard_ring.json"),
+)
+app = FastAPI()
+
+
+@app.exception_handler(HandoffInProgress)
+async def handoff_in_progress(request: Request, exc: HandoffInProgress):
+    return JSONResponse(
+        status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(HANDOFF_RETRY_AFTER)}
+    )
+
+
+@app.on_event("shutdown")
+async def close_clients():
+    await shards.close()
+
+
+def _relay(response: httpx.Response, shard: Optional[str] = None) -> Response:
+    headers = _headers(response.headers)
+    if shard:
+        headers["X-Crosspay-Shard"] = shard
+    return Response(response.content, status_code=response.status_code, headers=headers)
+
+
+def _first_error(responses: Dict[str, httpx.Response]) -> Optional[Response]:
+    for shard, response in responses.items():
+        if response.status_code >= 400:
+            return _relay(response, shard)
+    return None
+
+
+def _bodies(payload: dict) -> Dict[str, dict]:
+    """Every shard gets `payload`; with user_ids, only their owners get them (their own share)."""
+    if not shards.shards:
+        raise HTTPException(status_code=503, detail="No shards configured (CROSSPAY_SHARDS)")
+    user_ids = payload.get("user_ids")
+    if user_ids is None:
+        return {shard: payload for shard in shards.shards}
+    return {shard: {**payload, "user_ids": owned} for shard, owned in shards.ring.partition(user_ids).items()}
+
+
+def _idempotency(idempotency_key: Optional[str]) -> Dict[str, str]:
+    return {"Idempotency-Key": idempotency_key} if idempotency_key else {}
+
+
+# -------------------------------------------------
+# Routes
+# -------------------------------------------------
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """The router's own counters; scrape each shard for theirs."""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/shards")
+def list_shards():
+    return {"shards": shards.shards, "vnodes": shards.ring.vnodes}
+
+
+class AddShardRequest(BaseModel):
+    url: str
+
+
+@app.post("/shards")
+async def add_shard(req: AddShardRequest, request: Request, x_admin_token: str | None = Header(None)):
+    require_admin(request, x_admin_token)
+    try:
+        return await shards.add_shard(req.url.rstrip("/"))
+    except ValueError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    except httpx.HTTPError as exc:
+        raise HTTPException(status_code=502, detail=f"Shard handoff failed: {exc}")
+
+
+@app.post("/api/pairs/{currency}/optimise")
+async def scatter_pair_optimisation(currency: str, request: Request, idempotency_key: str | None = Header(None)):
+    """One tick per shard; users and converted amounts are summed."""
+    payload = json.loads(await request.body() or b"{}")
+    async with shards.writing(None):
+        responses = await shards.scatter(
+            "POST", f"/api/pairs/{currency}/optimise", _bodies(payload), headers=_idempotency(idempotency_key)
+        )
+    error = _first_error(responses)
+    if error is not None:
+        return error
+    results = [response.json() for response in responses.values()]
+    return {
+        "pair": results[0]["pair"],
+        "users": sum(r["users"] for r in results),
+        "converted": round(sum(r["converted"] for r in results), 6),
+        "shards": len(results),
+    }
+
+
+@app.post("/api/pairs/reallocate")
+async def scatter_reallocate(request: Request, idempotency_key: str | None = Header(None)):
+    payload = json.loads(await request.body())
+    async with shards.writing(payload.get("user_ids")):
+        responses = await shards.scatter("POST", "/api/pairs/reallocate", _bodies(payload), headers=_idempotency(idempotency_key))
+    error = _first_error(responses)
+    if error is not None:
+        return error
+    results = [response.json() for response in responses.values()]
+    if not results:
+        return {"users": 0, "rebalanced": 0.0, "weights": payload.get("weights")}
+    return {
+        "users": sum(r["users"] for r in results),
+        "rebalanced": round(sum(r["rebalanced"] for r in results), 6),
+        "weights": results[0]["weights"],
+    }
+
+
+@app.post("/api/pairs/status")
+async def scatter_pair_status(request: Request):
+    """NDJSON from every shard that holds matching users, shard after shard."""
+    payload = json.loads(await request.body())
+    bodies = _bodies(payload)
+    upstreams = await asyncio.gather(*(
+        shards.client(shard).send(shards.client(shard).build_request("POST", "/api/pairs/status", json=body), stream=True)
+        for shard, body in bodies.items()
+    ))
+    for shard in bodies:
+        _forwarded(shard).inc()
+
+    for shard, upstream in zip(bodies, upstreams):
+        if upstream.status_code >= 400:
+            await upstream.aread()
+            for other in upstreams:
+                await other.aclose()
+            return _relay(upstream, shard)
+
+    async def lines():
+        try:
+            for upstream in upstreams:
+                async for chunk in upstream.aiter_raw():
+                    yield chunk
+        finally:
+            for upstream in upstreams:
+                await upstream.aclose()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.post("/api/fx/tick")
+async def broadcast_fx_tick(request: Request):
+    responses = await shards.scatter("POST", "/api/fx/tick", _bodies(json.loads(await request.body())))
+    error = _first_error(responses)
+    return error if error is not None else _relay(next(iter(responses.values())))
+
+
+@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def forward(path: str, request: Request):
+    if not shards.shards:
+        raise HTTPException(status_code=503, detail="No shards configured (CROSSPAY_SHARDS)")
+    # only /api/pairs/* users are sharded (and moved); the rest lives on the first shard
+    user_id = request.query_params.get("user_id", DEFAULT_USER_ID) if path.startswith("api/pairs/") else None
+    writes = [user_id] if user_id is not None and request.method != "GET" else []
+    async with shards.writing(writes):
+        # looked up once the write is registered, so add_shard() waits for it
+        shard = shards.shards[0] if user_id is None else shards.owner(user_id)
+        response = await shards.request(
+            shard,
+            request.method,
+            "/" + path,
+            params=request.query_params,
+            content=await request.body(),
+            headers=_headers(request.headers),
+        )
+    return _relay(response, shard)
+
+
+# -------------------------------------------------
+# Local cluster
+# -------------------------------------------------
+def _wait_until_up(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            httpx.get(f"{url}/api/settings", timeout=1.0)
+            return
+        except httpx.TransportError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run the shard router, optionally with local shards")
+    parser.add_argument("--spawn", type=int, default=0, help="start this many local shards (app.main:app) first")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000, help="router port; spawned shards use the next ones")
+    parser.add_argument("--data-dir", default=os.getenv("CROSSPAY_DATA_DIR", "data"))
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    processes = []
+    urls = _shard_urls()
+    try:
+        for i in range(args.spawn):
+            port = args.port + 1 + i
+            env = {**os.environ, "CROSSPAY_DATA_DIR": os.path.join(args.data_dir, f"shard-{i}")}
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--host", args.host, "--port", str(port)], env=env
+            ))
+            urls.append(f"http://{args.host}:{port}")
+        for url in urls[len(urls) - args.spawn:]:
+            _wait_until_up(url)
+
+        os.environ["CROSSPAY_SHARDS"] = ",".join(urls)
+        uvicorn.run("app.shard_router:app", host=args.host, port=args.port)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,9 +2,13 @@
 AllocationService
 -----------------
 Allows changing user allocation percentages.
+Allocations are stored as validated, normalised BucketWeights, so readers
+never re-normalise; any bucket names work (e.g. "emergency").
 """
 
-from typing import Dict
+from typing import Dict, Iterable
+
+from app.utils.weights import BucketWeights
 from .user_state import default_user_state
 
 class AllocationService:
@@ -19,13 +23,22 @@ class AllocationService:
         Must sum to ~1.0
         """
         
-        if abs(sum(new_alloc.values()) - 1.0) > 0.001:
-            raise ValueError("Allocations must sum to 1.0")
-        
-        user = self.state.get_state(user_id)
-        user["allocations"] = new_alloc
+        weights = BucketWeights.from_dict(new_alloc, tolerance=0.001)
+
+        self.state.set_allocations(user_id, weights)
+
+        return weights.as_dict()
 
-        return new_alloc
+    def update_allocations_bulk(self, user_ids: Iterable[str], new_alloc: Dict[str, float]):
+        """Same allocations for many users: validated once, one shared (immutable) instance."""
+
+        weights = BucketWeights.from_dict(new_alloc, tolerance=0.001)
+
+        updated = 0
+        for user_id in user_ids:
+            self.state.set_allocations(user_id, weights)
+            updated += 1
+
+        return {"updated": updated, "allocations": weights.as_dict()}
     
 allocation_service = AllocationService()
-
@@ -0,0 +1,275 @@
+"""
+Storage engine conformance
+--------------------------
+The same checks, run against every engine in ENGINES, so a new engine
+(or a change to one) can be verified against the interface in engines.py:
+
+    cd backend
+    python -m app.state.conformance                  # all engines
+    python -m app.state.conformance --engine sqlite
+
+Each check gets a factory that opens the engine on a fresh temp directory;
+calling it again on the same directory reopens (durable engines must
+still have their data). Exits with status 1 if any check fails.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import traceback
+from typing import Callable, Dict, List, Tuple
+
+from .engines import RECORD_FIELDS, AppendLogEngine, ColumnarEngine, MemoryEngine, StorageEngine, from_record, to_record
+from .sqlite_store import SQLiteEngine
+from .user_state import new_user
+from app.utils.weights import BucketWeights
+
+# name -> (open(directory) -> engine, durable)
+ENGINES: Dict[str, Tuple[Callable[[str], StorageEngine], bool]] = {
+    "memory": (lambda directory: MemoryEngine(), False),
+    "columnar": (lambda directory: ColumnarEngine(capacity=4), False),
+    "sqlite": (lambda directory: SQLiteEngine(os.path.join(directory, "users.sqlite3")), True),
+    "appendlog": (lambda directory: AppendLogEngine(os.path.join(directory, "users.log")), True),
+}
+
+_CHECKS: List[Callable] = []
+
+
+def check(fn):
+    _CHECKS.append(fn)
+    return fn
+
+
+def record(**changes):
+    return {**to_record(new_user()), **changes}
+
+
+def add(field: str, amount):
+    return lambda current: {**(current or record()), field: (current or record())[field] + amount}
+
+
+class Failure(AssertionError):
+    pass
+
+
+def expect(condition: bool, message: str):
+    if not condition:
+        raise Failure(message)
+
+
+# -------------------------------------------------
+# Checks: each takes (open, directory, durable)
+# -------------------------------------------------
+@check
+def empty(open_engine, directory, durable):
+    engine = open_engine(directory)
+    expect(engine.get("nobody") is None, "get() of an unknown user is None")
+    expect(len(engine) == 0 and list(engine.scan()) == [], "a new engine is empty")
+
+
+@check
+def mutate_creates_and_updates(open_engine, directory, durable):
+    engine = open_engine(directory)
+    created = engine.mutate("a", lambda current: record(pending=5) if current is None else None)
+    expect(created["pending"] == 5, "mutate() returns the stored record")
+    updated = engine.mutate("a", add("pending", 7))
+    expect(updated["pending"] == 12 and engine.get("a")["pending"] == 12, "mutate() sees the current record")
+    expect(set(engine.get("a")) == set(RECORD_FIELDS), "records keep exactly RECORD_FIELDS")
+
+
+@check
+def returned_records_are_copies(open_engine, directory, durable):
+    engine = open_engine(directory)
+    engine.mutate("a", lambda _: record(pending=1))
+    engine.get("a")["pending"] = 99
+    expect(engine.get("a")["pending"] == 1, "changing a returned record doesn't change the engine")
+
+
+@check
+def delete(open_engine, directory, durable):
+    engine = open_engine(directory)
+    engine.mutate("a", lambda _: record())
+    engine.mutate("a", lambda _: None)
+    expect(engine.get("a") is None and len(engine) == 0, "returning None deletes")
+
+
+@check
+def batch_sees_own_writes(open_engine, directory, durable):
+    engine = open_engine(directory)
+    results = engine.batch_mutate([("a", add("pending", 1)), ("b", add("pending", 2)), ("a", add("pending", 3))])
+    expect([r["pending"] for r in results] == [1, 2, 4], "batch results in order, later mutations see earlier ones")
+    expect(engine.get("a")["pending"] == 4 and engine.get("b")["pending"] == 2, "batch stored")
+
+
+@check
+def batch_is_atomic(open_engine, directory, durable):
+    engine = open_engine(directory)
+    engine.mutate("a", lambda _: record(pending=1))
+
+    def boom(current):
+        raise RuntimeError("boom")
+
+    try:
+        engine.batch_mutate([("a", add("pending", 1)), ("b", add("pending", 1)), ("c", boom)])
+        expect(False, "exceptions from a mutation propagate")
+    except RuntimeError:
+        pass
+    expect(engine.get("a")["pending"] == 1 and engine.get("b") is None, "a failed batch stores nothing")
+
+
+@check
+def meta_with_batch(open_engine, directory, durable):
+    engine = open_engine(directory)
+    expect(engine.get_meta("job") is None, "get_meta() of an unknown key is None")
+    engine.put_many([("a", record(pending=1))], meta={"job": {"line": 10}})
+    expect(engine.get_meta("job") == {"line": 10}, "put_many() stores its meta")
+    try:
+        engine.batch_mutate([("a", add("pending", 1)), ("b", lambda _: 1 / 0)], meta={"job": {"line": 20}})
+    except ZeroDivisionError:
+        pass
+    expect(engine.get_meta("job") == {"line": 10}, "a failed batch stores no meta")
+    engine.batch_mutate([("a", add("pending", 1))], meta={"job": {"line": 30}, "other": [1]})
+    engine.put_many([], meta={"other": None})
+    expect(engine.get_meta("other") is None, "None deletes a meta key")
+    if durable:
+        engine.close()
+        engine = open_engine(directory)
+        expect(
+            engine.get_meta("job") == {"line": 30} and engine.get("a")["pending"] == 2 and engine.get_meta("other") is None,
+            "meta survives close + reopen",
+        )
+        if hasattr(engine, "compact"):
+            engine.compact()
+            engine.close()
+            engine = open_engine(directory)
+            expect(engine.get_meta("job") == {"line": 30}, "meta survives compact()")
+
+
+@check
+def rejects_bad_records(open_engine, directory, durable):
+    engine = open_engine(directory)
+    try:
+        engine.mutate("a", lambda _: {"pending": 1})
+        expect(False, "records without every field are rejected")
+    except ValueError:
+        pass
+    expect(engine.get("a") is None, "a rejected record is not stored")
+
+
+@check
+def scan_and_projection(open_engine, directory, durable):
+    engine = open_engine(directory)
+    engine.put_many([(f"u{i}", record(pending=i, risk_level="balanced" if i % 2 else "safe")) for i in range(10)])
+    rows = dict(engine.scan())
+    expect(sorted(rows) == sorted(f"u{i}" for i in range(10)), "scan() returns every user once")
+    expect(all(rows[f"u{i}"]["pending"] == i for i in range(10)), "scan() returns the stored values")
+    projected = dict(engine.scan(["pending", "risk_level"]))
+    expect(projected["u3"] == {"pending": 3, "risk_level": "balanced"}, "scan(fields) returns only those fields")
+
+
+@check
+def snapshot_isolation(open_engine, directory, durable):
+    engine = open_engine(directory)
+    engine.put_many([("a", record(pending=1)), ("b", record(pending=2))])
+    snapshot = engine.snapshot()
+    engine.batch_mutate([("a", add("pending", 10)), ("b", lambda _: None), ("c", add("pending", 3))])
+    try:
+        expect(snapshot.get("a")["pending"] == 1 and snapshot.get("b")["pending"] == 2, "snapshot keeps old values")
+        expect(snapshot.get("c") is None and len(snapshot) == 2, "snapshot doesn't see later users")
+        expect(sorted(user_id for user_id, _ in snapshot.scan()) == ["a", "b"], "snapshot scan is point-in-time")
+    finally:
+        snapshot.close()
+    expect(engine.get("a")["pending"] == 11 and engine.get("b") is None, "engine moved on")
+
+
+@check
+def user_roundtrip(open_engine, directory, durable):
+    engine = open_engine(directory)
+    user = new_user()
+    user["salary"]["instant_bucket"] = 123_456_789
+    user["optimisation"]["pending"] = 42
+    user["allocations"] = BucketWeights.from_dict({"rent": 0.7, "emergency": 0.3})
+    engine.mutate("a", lambda _: to_record(user))
+    loaded = from_record(engine.get("a"))
+    expect(loaded["salary"] == user["salary"] and loaded["optimisation"] == user["optimisation"], "balances round-trip")
+    expect(loaded["allocations"] == user["allocations"], "allocations round-trip")
+    expect(dict(loaded["settings"]) == dict(user["settings"]), "settings round-trip")
+
+
+@check
+def concurrent_mutations(open_engine, directory, durable):
+    engine = open_engine(directory)
+    threads = [
+        threading.Thread(target=lambda: [engine.mutate("a", add("instant_bucket", 1)) for _ in range(200)])
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    expect(engine.get("a")["instant_bucket"] == 1600, "concurrent mutate() calls never lose an update")
+
+
+@check
+def survives_reopen(open_engine, directory, durable):
+    if not durable:
+        return
+    engine = open_engine(directory)
+    engine.put_many([("a", record(pending=1)), ("b", record(pending=2))])
+    engine.mutate("a", add("pending", 1))
+    engine.mutate("b", lambda _: None)
+    if hasattr(engine, "compact"):
+        engine.compact()
+        engine.mutate("c", lambda _: record(pending=3))
+    engine.close()
+    engine = open_engine(directory)
+    expect(engine.get("a")["pending"] == 2 and engine.get("b") is None, "data survives close + reopen")
+    expect(not hasattr(engine, "compact") or engine.get("c")["pending"] == 3, "writes after compact() survive")
+
+
+def run(names: List[str]) -> List[str]:
+    failures = []
+    for name in names:
+        open_engine, durable = ENGINES[name]
+        for fn in _CHECKS:
+            with tempfile.TemporaryDirectory(prefix="crosspay-conformance-") as directory:
+                opened: List[StorageEngine] = []
+
+                def tracked(path, open_engine=open_engine, opened=opened):
+                    engine = open_engine(path)
+                    opened.append(engine)
+                    return engine
+
+                try:
+                    fn(tracked, directory, durable)
+                    status = "ok"
+                except Exception as exc:
+                    status = f"FAIL {exc if isinstance(exc, Failure) else traceback.format_exc()}"
+                    failures.append(f"{name}.{fn.__name__}")
+                finally:
+                    for engine in opened:
+                        try:
+                            engine.close()
+                        except Exception:
+                            pass
+            print(f"{name:10s} {fn.__name__:28s} {status}")
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Storage engine conformance checks")
+    parser.add_argument("--engine", action="append", choices=sorted(ENGINES), help="repeatable; default all")
+    args = parser.parse_args(argv)
+
+    failures = run(args.engine or list(ENGINES))
+    if failures:
+        print(f"\n{len(failures)} failed: {', '.join(failures)}")
+        return 1
+    print("\nAll checks passed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,643 @@
+"""
+Storage engines
+---------------
+Interchangeable backends for per-user records, behind one small interface:
+
+- get(user_id)                  -> record or None
+- mutate(user_id, fn)           -> fn(current record or None) is stored
+                                   atomically (None deletes)
+- batch_mutate([(user_id, fn)]) -> same, all applied atomically as one batch
+- scan(fields)                  -> (user_id, record) for every user
+- snapshot()                    -> read-only, point-in-time view (get/scan)
+- get_meta(key)                 -> a JSON value stored with `meta=` by
+                                   batch_mutate / put_many, atomically with
+                                   their records (e.g. an import checkpoint)
+
+A record is a flat dict with exactly the RECORD_FIELDS keys (ints, floats,
+strings; settings and allocations as JSON). to_record()/from_record()
+convert to and from the nested user dicts of userStateScore.
+PersistentUserState (persistent_state.py) puts any engine behind the
+in-memory users, so the app/state services work unchanged.
+
+Engines here:
+- MemoryEngine: dict of immutable tuples; snapshots are a dict copy
+- ColumnarEngine: one NumPy array per field (object arrays for strings),
+  so whole-column reads are vectorised
+- AppendLogEngine: append-only NDJSON file plus an in-memory offset index;
+  the last record for a user wins, None is a tombstone, compact() rewrites
+  the live records (PersistentUserState calls it once garbage() says most
+  of the file is dead)
+SQLiteEngine lives in sqlite_store.py.
+
+`python -m app.state.conformance` checks every engine against the same
+expectations.
+"""
+
+import json
+import os
+import threading
+from itertools import islice
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.utils.weights import BucketWeights
+from .user_state import DEFAULT_ALLOCATIONS, new_user
+
+Record = Dict[str, Any]
+Mutation = Callable[[Optional[Record]], Optional[Record]]
+Meta = Dict[str, Any]  # key -> JSON-able value, None deletes
+
+RECORD_FIELDS = (
+    "total_received", "instant_bucket", "optimised_bucket", "pending", "converted",
+    "last_update", "max_wait_time", "risk_level", "settings", "allocations",
+)
+# what the secondary indexes need (see indexes.py)
+INDEXED_FIELDS = ("pending", "last_update", "max_wait_time", "risk_level")
+
+
+# field -> value from a userStateScore user dict
+_FROM_USER: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "total_received": lambda user: user["salary"]["total_received"],
+    "instant_bucket": lambda user: user["salary"]["instant_bucket"],
+    "optimised_bucket": lambda user: user["salary"]["optimised_bucket"],
+    "pending": lambda user: user["optimisation"]["pending"],
+    "converted": lambda user: user["optimisation"]["converted"],
+    "last_update": lambda user: user["optimisation"]["last_update"],
+    "max_wait_time": lambda user: user["settings"]["max_wait_time"],
+    "risk_level": lambda user: user["settings"]["risk_level"],
+    "settings": lambda user: json.dumps(dict(user["settings"])),
+    # None = the shared defaults
+    "allocations": lambda user: (
+        None if user["allocations"] is DEFAULT_ALLOCATIONS else json.dumps(user["allocations"].as_dict())
+    ),
+}
+
+
+def to_record(user: Dict[str, Any], fields: Optional[Sequence[str]] = None) -> Record:
+    """The record for a user dict; with `fields`, only those (like scan(fields))."""
+    if fields is None:
+        # spelled out: this is on every flush
+        salary, opt, settings = user["salary"], user["optimisation"], user["settings"]
+        allocations = user["allocations"]
+        return {
+            "total_received": salary["total_received"],
+            "instant_bucket": salary["instant_bucket"],
+            "optimised_bucket": salary["optimised_bucket"],
+            "pending": opt["pending"],
+            "converted": opt["converted"],
+            "last_update": opt["last_update"],
+            "max_wait_time": settings["max_wait_time"],
+            "risk_level": settings["risk_level"],
+            "settings": json.dumps(dict(settings)),
+            "allocations": None if allocations is DEFAULT_ALLOCATIONS else json.dumps(allocations.as_dict()),
+        }
+    for field in fields:
+        if field not in _FROM_USER:
+            raise KeyError(field)
+    return {field: _FROM_USER[field](user) for field in fields}
+
+
+def from_record(record: Record) -> Dict[str, Any]:
+    user = new_user()
+    user["salary"].update(
+        total_received=record["total_received"],
+        instant_bucket=record["instant_bucket"],
+        optimised_bucket=record["optimised_bucket"],
+    )
+    user["optimisation"].update(
+        pending=record["pending"],
+        converted=record["converted"],
+        last_update=record["last_update"],
+    )
+    user["settings"] = MappingProxyType(json.loads(record["settings"]))
+    if record["allocations"] is not None:
+        user["allocations"] = BucketWeights.from_dict(json.loads(record["allocations"]))
+    return user
+
+
+def check_record(record: Optional[Record]) -> Optional[Record]:
+    if record is not None and set(record) != set(RECORD_FIELDS):
+        raise ValueError(f"Record fields must be exactly {RECORD_FIELDS}")
+    return record
+
+
+def _project(record: Record, fields: Optional[Sequence[str]]) -> Record:
+    return dict(record) if fields is None else {field: record[field] for field in fields}
+
+
+def _encode_meta(meta: Optional[Meta]) -> Dict[str, Optional[str]]:
+    # encoded up front, so a value that isn't JSON fails before anything is stored
+    return {key: None if value is None else json.dumps(value) for key, value in (meta or {}).items()}
+
+
+def _store_meta(target: Dict[str, str], encoded: Dict[str, Optional[str]]):
+    for key, text in encoded.items():
+        if text is None:
+            target.pop(key, None)
+        else:
+            target[key] = text
+
+
+class StorageEngine:
+    """Interface; see the module docstring. Mutations are serialised per engine."""
+
+    name = "base"
+    durable = False  # survives a restart
+
+    def get(self, user_id: str) -> Optional[Record]:
+        raise NotImplementedError
+
+    def mutate(self, user_id: str, fn: Mutation) -> Optional[Record]:
+        return self.batch_mutate([(user_id, fn)])[0]
+
+    def batch_mutate(self, mutations: Iterable[Tuple[str, Mutation]], meta: Optional[Meta] = None) -> List[Optional[Record]]:
+        """
+        Applies the mutations in order (later ones see earlier results) and
+        returns each stored record, and stores `meta` (key -> JSON value,
+        None deletes) in the same batch. If any fn raises, nothing is stored.
+        """
+        raise NotImplementedError
+
+    def put_many(self, records: Iterable[Tuple[str, Optional[Record]]], meta: Optional[Meta] = None):
+        """batch_mutate() with fixed values (None deletes)."""
+        self.batch_mutate([(user_id, lambda _, record=record: record) for user_id, record in records], meta)
+
+    def get_meta(self, key: str) -> Any:
+        raise NotImplementedError
+
+    def scan(self, fields: Optional[Sequence[str]] = None) -> Iterator[Tuple[str, Record]]:
+        raise NotImplementedError
+
+    def snapshot(self) -> "Snapshot":
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class Snapshot:
+    """Read-only view of an engine at one point in time."""
+
+    def __init__(self, records: Dict[str, Record]):
+        self._records = records
+
+    def get(self, user_id: str) -> Optional[Record]:
+        record = self._records.get(user_id)
+        return None if record is None else dict(record)
+
+    def scan(self, fields: Optional[Sequence[str]] = None) -> Iterator[Tuple[str, Record]]:
+        for user_id, record in self._records.items():
+            yield user_id, _project(record, fields)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def close(self):
+        pass
+
+
+class StripedSnapshot(Snapshot):
+    """
+    snapshot() of an in-memory userStateScore, at one point in time without
+    copying every user. Opening it takes every stripe lock for a moment
+    (no write is half done) and registers it with the store; from then on
+    a write first hands the snapshot the user's record as it was (once per
+    user, under the user's stripe lock), and a new user is noted as absent.
+    So a user is read from that before-image if it has one, and live
+    otherwise, since a live user without one hasn't changed since. Memory
+    is one record per user written while the snapshot is open; close() it.
+    """
+
+    SCAN_CHUNK = 1024  # user ids per round of stripe locks
+
+    def __init__(self, store):
+        super().__init__({})
+        self._store = store
+        # user_id -> record when the snapshot was taken (None: didn't exist)
+        self._before: Dict[str, Optional[Record]] = {}
+        for lock in store._locks:
+            lock.acquire()
+        try:
+            self._count = len(store._users)
+            with store._snapshots_lock:
+                store._snapshots = store._snapshots + [self]
+        finally:
+            for lock in store._locks:
+                lock.release()
+
+    def preserve(self, user_id: str, user: Optional[Dict[str, Any]]):
+        """Called by the store under user_id's stripe lock, before changing (or adding) it."""
+        if user_id not in self._before:
+            self._before[user_id] = None if user is None else to_record(user)
+
+    def _read(self, user_id: str, fields: Optional[Sequence[str]]) -> Optional[Record]:
+        # caller holds user_id's stripe lock
+        if user_id in self._before:
+            record = self._before[user_id]
+            return None if record is None else _project(record, fields)
+        user = self._store._users.get(user_id)
+        return None if user is None else to_record(user, fields)
+
+    def get(self, user_id: str) -> Optional[Record]:
+        with self._store.lock_for(user_id):
+            return self._read(user_id, None)
+
+    def scan(self, fields: Optional[Sequence[str]] = None) -> Iterator[Tuple[str, Record]]:
+        store = self._store
+        # users are never removed from an in-memory store, so these are the
+        # snapshot's users plus any added since (absent in _before)
+        user_ids = list(store._users)
+        for start in range(0, len(user_ids), self.SCAN_CHUNK):
+            by_stripe: Dict[int, List[str]] = {}
+            for user_id in user_ids[start:start + self.SCAN_CHUNK]:
+                by_stripe.setdefault(store._stripe(user_id), []).append(user_id)
+            rows = []
+            for stripe, chunk in by_stripe.items():
+                with store._locks[stripe]:
+                    rows += [(user_id, self._read(user_id, fields)) for user_id in chunk]
+            yield from ((user_id, record) for user_id, record in rows if record is not None)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def close(self):
+        store = self._store
+        with store._snapshots_lock:
+            store._snapshots = [snapshot for snapshot in store._snapshots if snapshot is not self]
+
+
+def apply_mutations(current: Dict[str, Optional[Record]], get: Callable[[str], Optional[Record]],
+           mutations: Iterable[Tuple[str, Mutation]]) -> List[Optional[Record]]:
+    """
+    Run mutations against `get`, staging results in `current` (user_id ->
+    new record) so a batch sees its own writes. The caller stores
+    `current` only if this returns.
+    """
+    results = []
+    for user_id, fn in mutations:
+        before = current[user_id] if user_id in current else get(user_id)
+        record = check_record(fn(None if before is None else dict(before)))
+        current[user_id] = None if record is None else dict(record)
+        results.append(record)
+    return results
+
+
+# -------------------------------------------------
+# In-memory dict
+# -------------------------------------------------
+class MemoryEngine(StorageEngine):
+
+    name = "memory"
+
+    def __init__(self):
+        # values are tuples in RECORD_FIELDS order: never mutated, so a dict copy is a snapshot
+        self._rows: Dict[str, tuple] = {}
+        self._meta: Dict[str, str] = {}  # key -> JSON text
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> Optional[Record]:
+        row = self._rows.get(user_id)
+        return None if row is None else dict(zip(RECORD_FIELDS, row))
+
+    def batch_mutate(self, mutations: Iterable[Tuple[str, Mutation]], meta: Optional[Meta] = None) -> List[Optional[Record]]:
+        with self._lock:
+            staged: Dict[str, Optional[Record]] = {}
+            results = apply_mutations(staged, self.get, mutations)
+            encoded = _encode_meta(meta)
+            for user_id, record in staged.items():
+                if record is None:
+                    self._rows.pop(user_id, None)
+                else:
+                    self._rows[user_id] = tuple(record[field] for field in RECORD_FIELDS)
+            _store_meta(self._meta, encoded)
+            return results
+
+    def get_meta(self, key: str) -> Any:
+        text = self._meta.get(key)
+        return None if text is None else json.loads(text)
+
+    def scan(self, fields: Optional[Sequence[str]] = None) -> Iterator[Tuple[str, Record]]:
+        positions = [RECORD_FIELDS.index(field) for field in (fields or RECORD_FIELDS)]
+        names = fields or RECORD_FIELDS
+        for user_id, row in list(self._rows.items()):
+            yield user_id, {name: row[i] for name, i in zip(names, positions)}
+
+    def snapshot(self) -> Snapshot:
+        with self._lock:
+            rows = dict(self._rows)
+        return Snapshot({user_id: dict(zip(RECORD_FIELDS, row)) for user_id, row in rows.items()})
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+# -------------------------------------------------
+# Columnar arrays
+# -------------------------------------------------
+_COLUMN_DTYPES = {
+    "total_received": np.int64,
+    "instant_bucket": np.int64,
+    "optimised_bucket": np.int64,
+    "pending": np.int64,
+    "converted": np.int64,
+    "last_update": np.float64,
+    "max_wait_time": np.float64,
+    "risk_level": object,
+    "settings": object,
+    "allocations": object,
+}
+
+
+class ColumnarEngine(StorageEngine):
+
+    name = "columnar"
+
+    def __init__(self, capacity: int = 1024):
+        self._columns = {field: np.zeros(capacity, dtype=dtype) for field, dtype in _COLUMN_DTYPES.items()}
+        self._slot: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._next = 0
+        self._meta: Dict[str, str] = {}  # key -> JSON text
+        self._lock = threading.Lock()
+
+    def _row(self, slot: int) -> Record:
+        return {field: column[slot].item() if column.dtype != object else column[slot]
+                for field, column in self._columns.items()}
+
+    def get(self, user_id: str) -> Optional[Record]:
+        slot = self._slot.get(user_id)
+        return None if slot is None else self._row(slot)
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        capacity = len(self._columns["pending"])
+        if self._next == capacity:
+            for field, column in self._columns.items():
+                grown = np.zeros(2 * capacity, dtype=column.dtype)
+                grown[:capacity] = column
+                self._columns[field] = grown
+        self._next += 1
+        return self._next - 1
+
+    def batch_mutate(self, mutations: Iterable[Tuple[str, Mutation]], meta: Optional[Meta] = None) -> List[Optional[Record]]:
+        with self._lock:
+            staged: Dict[str, Optional[Record]] = {}
+            results = apply_mutations(staged, self.get, mutations)
+            encoded = _encode_meta(meta)
+            for user_id, record in staged.items():
+                slot = self._slot.get(user_id)
+                if record is None:
+                    if slot is not None:
+                        del self._slot[user_id]
+                        self._free.append(slot)
+                    continue
+                if slot is None:
+                    slot = self._slot[user_id] = self._allocate()
+                for field, column in self._columns.items():
+                    column[slot] = record[field]
+            _store_meta(self._meta, encoded)
+            return results
+
+    def get_meta(self, key: str) -> Any:
+        text = self._meta.get(key)
+        return None if text is None else json.loads(text)
+
+    def column(self, field: str) -> Tuple[List[str], np.ndarray]:
+        """(user_ids, values) for one field: a vectorised read of every user."""
+        with self._lock:
+            user_ids = list(self._slot)
+            slots = np.fromiter(self._slot.values(), dtype=np.int64, count=len(user_ids))
+            return user_ids, self._columns[field][slots]
+
+    def scan(self, fields: Optional[Sequence[str]] = None) -> Iterator[Tuple[str, Record]]:
+        with self._lock:
+            user_ids = list(self._slot)
+            slots = np.fromiter(self._slot.values(), dtype=np.int64, count=len(user_ids))
+            columns = {field: self._columns[field][slots] for field in (fields or RECORD_FIELDS)}
+        values = {field: column.tolist() for field, column in columns.items()}
+        for i, user_id in enumerate(user_ids):
+            yield user_id, {field: values[field][i] for field in values}
+
+    def snapshot(self) -> Snapshot:
+        return Snapshot(dict(self.scan()))
+
+    def __len__(self) -> int:
+        return len(self._slot)
+
+
+# -------------------------------------------------
+# Append-only file
+# -------------------------------------------------
+def _log_line(entry: Dict[str, Any]) -> bytes:
+    return (json.dumps(entry, separators=(",", ":")) + "\n").encode()
+
+
+def _log_entry(line: bytes) -> Optional[Dict[str, Any]]:
+    """A parsed log line, or None for a half-written one (a crash mid-append)."""
+    if not line.endswith(b"\n"):
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+class AppendLogEngine(StorageEngine):
+    """
+    Lines are {"id": user_id, "r": record or None} and {"m": key, "v": meta
+    value or None}. A write of several lines starts with {"n": count}: on
+    replay the batch counts only if all `count` lines made it to disk.
+    """
+
+    name = "appendlog"
+    durable = True
+
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = path
+        self.fsync = fsync
+        # user_id -> (offset, length) of its latest line
+        self._offsets: Dict[str, Tuple[int, int]] = {}
+        # meta key -> (JSON text, length of its line)
+        self._meta: Dict[str, Tuple[str, int]] = {}
+        # bytes of superseded lines, tombstones and batch headers, and of the
+        # whole file; compact() reclaims the former (see garbage())
+        self._dead = 0
+        self._size = 0
+        self._lock = threading.Lock()
+        self._replay()
+        self._file = open(path, "ab")
+        self._fd = os.open(path, os.O_RDONLY)
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        offset = 0
+        with open(self.path, "rb") as f:
+            lines = iter(f)
+            for line in lines:
+                entry = _log_entry(line)
+                if entry is None:
+                    break
+                batch = [(line, entry)]
+                if "n" in entry:
+                    batch = [(line, _log_entry(line)) for line in islice(lines, entry["n"])]
+                    if len(batch) < entry["n"] or any(e is None for _, e in batch):
+                        break  # torn batch: dropped whole, from its header on
+                    self._dead += len(line)
+                    offset += len(line)
+                for line, entry in batch:
+                    if "m" in entry:
+                        self._place_meta(entry["m"], None if entry["v"] is None else json.dumps(entry["v"]), len(line))
+                    else:
+                        self._place(entry["id"], offset, len(line), entry["r"] is None)
+                    offset += len(line)
+        if offset != os.path.getsize(self.path):
+            os.truncate(self.path, offset)
+        self._size = offset
+
+    def _place(self, user_id: str, offset: int, length: int, deleted: bool):
+        # the line at offset is user_id's latest; its previous one (and a
+        # tombstone itself) is dead weight until compact()
+        previous = self._offsets.pop(user_id, None)
+        if previous is not None:
+            self._dead += previous[1]
+        if deleted:
+            self._dead += length
+        else:
+            self._offsets[user_id] = (offset, length)
+
+    def _place_meta(self, key: str, text: Optional[str], length: int):
+        previous = self._meta.pop(key, None)
+        if previous is not None:
+            self._dead += previous[1]
+        if text is None:
+            self._dead += length
+        else:
+            self._meta[key] = (text, length)
+
+    def _read(self, location: Tuple[int, int], fd: Optional[int] = None) -> Record:
+        offset, length = location
+        return json.loads(os.pread(self._fd if fd is None else fd, length, offset))["r"]
+
+    def get(self, user_id: str) -> Optional[Record]:
+        # under the lock: compact() swaps the file, fd and offsets together
+        with self._lock:
+            return self._get(user_id)
+
+    def _get(self, user_id: str) -> Optional[Record]:
+        location = self._offsets.get(user_id)
+        return None if location is None else self._read(location)
+
+    def get_meta(self, key: str) -> Any:
+        entry = self._meta.get(key)
+        return None if entry is None else json.loads(entry[0])
+
+    def batch_mutate(self, mutations: Iterable[Tuple[str, Mutation]], meta: Optional[Meta] = None) -> List[Optional[Record]]:
+        with self._lock:
+            staged: Dict[str, Optional[Record]] = {}
+            results = apply_mutations(staged, self._get, mutations)
+            users = [(user_id, record is None, _log_line({"id": user_id, "r": record})) for user_id, record in staged.items()]
+            metas = [
+                (key, None if value is None else json.dumps(value), _log_line({"m": key, "v": value}))
+                for key, value in (meta or {}).items()
+            ]
+            lines = [line for *_, line in users + metas]
+            offset = self._file.tell()
+            header = _log_line({"n": len(lines)}) if len(lines) > 1 else b""
+            # one write per batch; the offsets only move once it is on disk
+            self._file.write(header + b"".join(lines))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._dead += len(header)
+            offset += len(header)
+            for user_id, deleted, line in users:
+                self._place(user_id, offset, len(line), deleted)
+                offset += len(line)
+            for key, text, line in metas:
+                self._place_meta(key, text, len(line))
+                offset += len(line)
+            self._size = offset
+            return results
+
+    def scan(self, fields: Optional[Sequence[str]] = None) -> Iterator[Tuple[str, Record]]:
+        # through a snapshot, whose fd and offsets outlive a concurrent compact()
+        snapshot = self.snapshot()
+        try:
+            yield from snapshot.scan(fields)
+        finally:
+            snapshot.close()
+
+    def garbage(self) -> Tuple[int, int]:
+        """(dead bytes compact() would reclaim, file size)."""
+        return self._dead, self._size
+
+    def snapshot(self) -> "LogSnapshot":
+        # lines are never rewritten in place, so copied offsets stay valid; the
+        # snapshot's own fd keeps reading the old file even after compact()
+        with self._lock:
+            return LogSnapshot(self, dict(self._offsets), os.open(self.path, os.O_RDONLY))
+
+    def compact(self):
+        """Rewrite only the live records and meta; blocks writers while it runs."""
+        with self._lock:
+            tmp_path = self.path + ".compact"
+            offsets = {}
+            meta = {}
+            with open(tmp_path, "wb") as out:
+                for user_id, location in self._offsets.items():
+                    line = _log_line({"id": user_id, "r": self._read(location)})
+                    offsets[user_id] = (out.tell(), len(line))
+                    out.write(line)
+                for key, (text, _) in self._meta.items():
+                    line = _log_line({"m": key, "v": json.loads(text)})
+                    meta[key] = (text, len(line))
+                    out.write(line)
+                out.flush()
+                os.fsync(out.fileno())
+            self._file.close()
+            os.close(self._fd)
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, "ab")
+            self._fd = os.open(self.path, os.O_RDONLY)
+            self._offsets = offsets
+            self._meta = meta
+            self._dead = 0
+            self._size = os.path.getsize(self.path)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            os.close(self._fd)
+
+
+class LogSnapshot(Snapshot):
+
+    def __init__(self, engine: AppendLogEngine, offsets: Dict[str, Tuple[int, int]], fd: int):
+        super().__init__({})
+        self._engine = engine
+        self._offsets = offsets
+        self._fd = fd
+
+    def get(self, user_id: str) -> Optional[Record]:
+        location = self._offsets.get(user_id)
+        return None if location is None else self._engine._read(location, self._fd)
+
+    def scan(self, fields: Optional[Sequence[str]] = None) -> Iterator[Tuple[str, Record]]:
+        for user_id, location in self._offsets.items():
+            yield user_id, _project(self._engine._read(location, self._fd), fields)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def close(self):
+        os.close(self._fd)
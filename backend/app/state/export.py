@@ -0,0 +1,192 @@
+"""
+State export
+------------
+Full dump of every user's balances for reconciliation and analytics, read
+from store.snapshot() (a point-in-time engine snapshot for persistent
+stores, a copy-on-write one in memory; see engines.py) and encoded chunk
+by chunk, so only one chunk of rows is in memory and writers keep going.
+
+Formats:
+- ndjson: {"user_id": ..., <field>: ...} per line
+- csv: header row, then one row per user
+- columnar: chunked binary columns for NumPy / pandas, see read_columnar()
+
+Amounts (total_received, buckets, pending, converted) are int micro-USDC.
+
+CLI (exports CROSSPAY_USER_STORE, see user_state.py):
+
+    cd backend
+    python -m app.state.export --format csv -o balances.csv
+"""
+
+import argparse
+import csv
+import io
+import json
+import struct
+import sys
+from itertools import islice
+from typing import IO, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# user_state first: building its default store imports engines
+from .user_state import default_user_state, userStateScore
+from .engines import RECORD_FIELDS, Record
+
+EXPORT_FIELDS = (
+    "total_received", "instant_bucket", "optimised_bucket", "pending", "converted",
+    "last_update", "max_wait_time", "risk_level",
+)
+DEFAULT_CHUNK_SIZE = 10_000
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "columnar": "application/vnd.crosspay.columnar",
+}
+
+# columnar: MAGIC, then per chunk a uint32 header length + JSON header
+# {"rows": n, "columns": [{"name", "dtype", "bytes"}]} + the column buffers,
+# then a zero length. "utf8" columns are int64 offsets (rows + 1) followed
+# by the UTF-8 bytes; None (default allocations) is stored as ""
+MAGIC = b"CPXCOL1\n"
+_DTYPES = {
+    "total_received": "<i8", "instant_bucket": "<i8", "optimised_bucket": "<i8", "pending": "<i8",
+    "converted": "<i8", "last_update": "<f8", "max_wait_time": "<f8",
+    "risk_level": "utf8", "settings": "utf8", "allocations": "utf8",
+}
+
+Chunk = List[Tuple[str, Record]]
+
+
+def parse_fields(fields: Optional[str]) -> Tuple[str, ...]:
+    """Comma-separated field names (None = EXPORT_FIELDS); ValueError for unknown ones."""
+    if not fields:
+        return EXPORT_FIELDS
+    names = tuple(name.strip() for name in fields.split(",") if name.strip())
+    unknown = [name for name in names if name not in RECORD_FIELDS]
+    if unknown or not names:
+        raise ValueError(f"Unknown export fields {unknown}, expected some of {RECORD_FIELDS}")
+    return names
+
+
+def _chunks(rows: Iterator[Tuple[str, Record]], size: int) -> Iterator[Chunk]:
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# -------------------------------------------------
+# Encoders: chunks -> bytes
+# -------------------------------------------------
+def encode_ndjson(chunks: Iterator[Chunk], fields: Sequence[str]) -> Iterator[bytes]:
+    for chunk in chunks:
+        yield "".join(
+            json.dumps({"user_id": user_id, **record}) + "\n" for user_id, record in chunk
+        ).encode()
+
+
+def encode_csv(chunks: Iterator[Chunk], fields: Sequence[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(("user_id", *fields))
+    for chunk in chunks:
+        writer.writerows((user_id, *(record[field] for field in fields)) for user_id, record in chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _utf8_column(values: List[Optional[str]]) -> bytes:
+    encoded = [(value or "").encode() for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return offsets.tobytes() + b"".join(encoded)
+
+
+def encode_columnar(chunks: Iterator[Chunk], fields: Sequence[str]) -> Iterator[bytes]:
+    yield MAGIC
+    for chunk in chunks:
+        buffers = [_utf8_column([user_id for user_id, _ in chunk])]
+        for field in fields:
+            values = [record[field] for _, record in chunk]
+            dtype = _DTYPES[field]
+            buffers.append(_utf8_column(values) if dtype == "utf8" else np.asarray(values, dtype=dtype).tobytes())
+        header = json.dumps({
+            "rows": len(chunk),
+            "columns": [
+                {"name": name, "dtype": "utf8" if name == "user_id" else _DTYPES[name], "bytes": len(buffer)}
+                for name, buffer in zip(("user_id", *fields), buffers)
+            ],
+        }).encode()
+        yield struct.pack("<I", len(header)) + header + b"".join(buffers)
+    yield struct.pack("<I", 0)
+
+
+ENCODERS = {"ndjson": encode_ndjson, "csv": encode_csv, "columnar": encode_columnar}
+
+
+def export(
+    store: userStateScore = default_user_state,
+    fmt: str = "ndjson",
+    fields: Sequence[str] = EXPORT_FIELDS,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """Every user's `fields` as `fmt`, one encoded chunk at a time."""
+    encode = ENCODERS[fmt]
+    snapshot = store.snapshot()
+    try:
+        yield from encode(_chunks(snapshot.scan(fields), chunk_size), fields)
+    finally:
+        snapshot.close()
+
+
+def read_columnar(stream: IO[bytes]) -> Iterator[Dict[str, np.ndarray]]:
+    """Chunks of a columnar export as {name: array} (utf8 columns as object arrays)."""
+    if stream.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a columnar export")
+    while True:
+        (length,) = struct.unpack("<I", stream.read(4))
+        if length == 0:
+            return
+        header = json.loads(stream.read(length))
+        columns = {}
+        for column in header["columns"]:
+            buffer = stream.read(column["bytes"])
+            if column["dtype"] == "utf8":
+                split = (header["rows"] + 1) * 8
+                offsets = np.frombuffer(buffer[:split], dtype="<i8")
+                data = buffer[split:]
+                columns[column["name"]] = np.array(
+                    [data[offsets[i]:offsets[i + 1]].decode() for i in range(header["rows"])], dtype=object
+                )
+            else:
+                columns[column["name"]] = np.frombuffer(buffer, dtype=column["dtype"])
+        yield columns
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Export every user's balances")
+    parser.add_argument("--format", choices=sorted(ENCODERS), default="ndjson")
+    parser.add_argument("--fields", help=f"comma-separated, default {','.join(EXPORT_FIELDS)}")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("-o", "--output", help="default: stdout")
+    args = parser.parse_args(argv)
+
+    fields = parse_fields(args.fields)
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for data in export(default_user_state, args.format, fields, args.chunk_size):
+            out.write(data)
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+UserIndexes
+-----------
+Secondary indexes over userStateScore, kept up to date on every mutation
+so ticks and admin queries touch only the users they need:
+
+- pending: ids of users with pending > 0
+- by_deadline: (deadline, user_id) for users with pending > 0, where
+  deadline = optimisation.last_update + max_wait_time hours
+- by_pending: (pending micros, user_id) for users with pending > 0
+- by_risk: risk_level -> ids
+
+update() is O(log n) (skip lists + sets) and only touches an index when
+the user's key for it changed. A small lock guards the index structures
+themselves; callers already hold the user's stripe lock, so updates for
+one user arrive in order.
+
+Inside `with indexes.bulk():` (e.g. a payroll import) updates are only
+collected and applied when the block ends, as one rebuild when they touch
+a large share of the users; queries meanwhile see the pre-bulk keys.
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from app.utils.skiplist import SkipList
+
+
+def _deadline(user: Dict[str, Any]) -> float:
+    return user["optimisation"]["last_update"] + user["settings"]["max_wait_time"] * 3600
+
+
+class UserIndexes:
+
+    def __init__(self):
+        self.pending: Set[str] = set()
+        self.by_deadline = SkipList()
+        self.by_pending = SkipList()
+        self.by_risk: Dict[str, Set[str]] = {}
+        # user_id -> (pending, deadline, risk_level) as currently indexed
+        self._keys: Dict[str, Tuple[int, float, str]] = {}
+        self._lock = threading.Lock()
+        # user_id -> latest keys, while inside bulk()
+        self._deferred: Optional[Dict[str, Tuple[int, float, str]]] = None
+        self._bulk_depth = 0
+
+    def update(self, user_id: str, user: Dict[str, Any]):
+        """Re-index one user after a change to pending, deadline or settings."""
+        self.update_keys(user_id, user["optimisation"]["pending"], _deadline(user), user["settings"]["risk_level"])
+
+    def update_keys(self, user_id: str, pending: int, deadline: float, risk_level: str):
+        """update() from the indexed values, for users that aren't loaded (e.g. rows in a store)."""
+        with self._lock:
+            if self._deferred is not None:
+                self._deferred[user_id] = (pending, deadline, risk_level)
+                return
+            self._apply(user_id, pending, deadline, risk_level)
+
+    def _apply(self, user_id: str, pending: int, deadline: float, risk_level: str):
+        old = self._keys.get(user_id)
+        if old == (pending, deadline, risk_level):
+            return
+        old_pending, old_deadline, old_risk = old if old is not None else (0, None, None)
+
+        # each skip list is only touched when its own key changed: a
+        # deposit changes pending but keeps the deadline
+        was_pending, is_pending = old_pending > 0, pending > 0
+        if was_pending and (not is_pending or old_pending != pending):
+            self.by_pending.discard((old_pending, user_id))
+        if was_pending and (not is_pending or old_deadline != deadline):
+            self.by_deadline.discard((old_deadline, user_id))
+        if is_pending:
+            self.pending.add(user_id)
+            if not was_pending or old_pending != pending:
+                self.by_pending.add((pending, user_id))
+            if not was_pending or old_deadline != deadline:
+                self.by_deadline.add((deadline, user_id))
+        else:
+            self.pending.discard(user_id)
+
+        if old_risk != risk_level:
+            if old_risk is not None:
+                self.by_risk[old_risk].discard(user_id)
+            self.by_risk.setdefault(risk_level, set()).add(user_id)
+
+        self._keys[user_id] = (pending, deadline, risk_level)
+
+    @contextmanager
+    def bulk(self) -> Iterator["UserIndexes"]:
+        """Collect updates until the outermost bulk() ends, then apply them at once."""
+        with self._lock:
+            self._bulk_depth += 1
+            if self._deferred is None:
+                self._deferred = {}
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._bulk_depth -= 1
+                if self._bulk_depth == 0:
+                    deferred, self._deferred = self._deferred, None
+                    # a rebuild is O(n); one update per user is O(log n) each
+                    if len(deferred) * 4 >= len(self._keys):
+                        self._keys.update(deferred)
+                        self._rebuild()
+                    else:
+                        for user_id, keys in deferred.items():
+                            self._apply(user_id, *keys)
+
+    def _rebuild(self):
+        pending = [(keys, user_id) for user_id, keys in self._keys.items() if keys[0] > 0]
+        self.pending = {user_id for _, user_id in pending}
+        self.by_pending = SkipList.from_sorted(sorted((keys[0], user_id) for keys, user_id in pending))
+        self.by_deadline = SkipList.from_sorted(sorted((keys[1], user_id) for keys, user_id in pending))
+        self.by_risk = {}
+        for user_id, (_, _, risk_level) in self._keys.items():
+            self.by_risk.setdefault(risk_level, set()).add(user_id)
+
+    # -------------------------------------------------
+    # Queries (each returns a list, so callers can mutate users while walking it)
+    # -------------------------------------------------
+    def pending_users(self) -> List[str]:
+        with self._lock:
+            return list(self.pending)
+
+    def due_before(self, ts: float) -> List[str]:
+        """Users with pending funds whose deadline is <= ts, earliest first."""
+        with self._lock:
+            return [user_id for _, user_id in self._take_while(self.by_deadline.iter_from(), ts)]
+
+    def pending_above(self, micros: int, limit: Optional[int] = None) -> List[str]:
+        """Users with pending > micros, smallest pending first."""
+        with self._lock:
+            users = []
+            # (micros + 1,) sorts before every (micros + 1, user_id)
+            for _, user_id in self.by_pending.iter_from((micros + 1,)):
+                if limit is not None and len(users) >= limit:
+                    break
+                users.append(user_id)
+            return users
+
+    def with_risk_level(self, risk_level: str) -> List[str]:
+        with self._lock:
+            return list(self.by_risk.get(risk_level, ()))
+
+    @staticmethod
+    def _take_while(keys: Iterator[Tuple[float, str]], limit: float) -> Iterator[Tuple[float, str]]:
+        for key in keys:
+            if key[0] > limit:
+                return
+            yield key
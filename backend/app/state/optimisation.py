@@ -3,12 +3,17 @@ OptimisationService
 -------------------
 Handles:
 - tracking pending optimisation
-- returning progress/status
-- converting funds now
+- returning progress/status (one user, or many at once)
+- converting funds now, or for every user whose max wait has passed
+
+Bulk queries start from the store's secondary indexes (users due soon,
+pending above a threshold, risk level) instead of scanning every user.
 """
 
 import time
-from typing import Dict
+from typing import Dict, Iterable, Iterator, Optional
+
+from app.utils.money import from_micros, to_micros
 from .user_state import default_user_state
 
 class OptimisationService:
@@ -17,28 +22,86 @@ class OptimisationService:
         self.state = state
     
     def get_status(self, user_id: str) -> Dict:
-        user = self.state.get_state(user_id)
+        return self._status(self.state.get_state(user_id), time.time())
+
+    def get_statuses(
+        self,
+        user_ids: Optional[Iterable[str]] = None,
+        min_pending: Optional[float] = None,
+        deadline_within: Optional[float] = None,
+        risk_level: Optional[str] = None,
+    ) -> Iterator[Dict]:
+        """
+        Status of many users (default: all of them), filtered by
+        pending > min_pending USDC, time_left <= deadline_within seconds
+        (users with pending funds only) and/or risk_level. One clock read
+        for the whole batch; unknown ids are skipped.
+        """
+        now = time.time()
+        min_pending = None if min_pending is None else to_micros(min_pending)
+        indexes = self.state.indexes
+        if user_ids is not None:
+            candidates = user_ids
+        elif deadline_within is not None:
+            candidates = indexes.due_before(now + deadline_within)
+        elif min_pending is not None:
+            candidates = indexes.pending_above(min_pending)
+        elif risk_level is not None:
+            candidates = indexes.with_risk_level(risk_level)
+        else:
+            candidates = self.state.user_ids()
+
+        for user_id in candidates:
+            user = self.state.find(user_id)
+            if user is None:
+                continue
+            if min_pending is not None and user["optimisation"]["pending"] <= min_pending:
+                continue
+            if risk_level is not None and user["settings"]["risk_level"] != risk_level:
+                continue
+            status = self._status(user, now)
+            if deadline_within is not None and (
+                user["optimisation"]["pending"] <= 0 or status["time_left"] > deadline_within
+            ):
+                continue
+            yield {"user_id": user_id, **status}
+
+    def _status(self, user: Dict, now: float) -> Dict:
         opt = user["optimisation"]
 
-        elapsed = time.time() - opt["last_update"]
+        elapsed = now - opt["last_update"]
         max_wait = user["settings"]["max_wait_time"] * 3600
 
         progress = min(1.0, elapsed / max_wait) if max_wait > 0 else 1.0
 
         return{
-            "pending": opt["pending"],
-            "converted": opt["converted"],
+            "pending": from_micros(opt["pending"]),
+            "converted": from_micros(opt["converted"]),
             "progress": progress,
             "time_left": max(0,max_wait - elapsed),
         }
     
     def convert_now(self, user_id: str,) -> Dict:
-        user = self.state.get_state(user_id)
-        pending = user["optimisation"]["pending"]
+        # the store reads pending under the user's lock, see convert_optimised()
+        return self.state.convert_optimised(user_id)
 
-        if pending <= 0:
-            return {"converted": 0}
-        
-        return self.state.convert_optimised(user_id,pending)
+    def convert_due(self, now: Optional[float] = None, risk_level: Optional[str] = None) -> Dict:
+        """
+        Converts everything pending for users past their max wait (only
+        those with `risk_level`, if given); touches only those users.
+        """
+        now = time.time() if now is None else now
+        due = self.state.indexes.due_before(now)
+        if risk_level is not None:
+            with_level = set(self.state.indexes.with_risk_level(risk_level))
+            due = [user_id for user_id in due if user_id in with_level]
+        users = 0
+        converted = 0.0
+        for user_id in due:
+            result = self.convert_now(user_id)
+            if result["converted"]:
+                users += 1
+                converted += result["converted"]
+        return {"users": users, "converted": converted}
     
 optimisation_service = OptimisationService()
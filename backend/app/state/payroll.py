@@ -0,0 +1,353 @@
+"""
+Payroll import
+--------------
+Streams an HR payroll export (CSV with a header row, or NDJSON) into
+salary deposits, through generator stages:
+
+    parse -> validate -> chunk -> dedupe -> apply (SalaryService.deposit_many)
+
+- each stage pulls from the previous one, so only one chunk of rows is in
+  memory at a time and parsing never runs ahead of the deposits
+- rows need user_id and amount (USDC, at most MAX_AMOUNT_USDC). Rows with a payment_id already seen
+  earlier in the file are skipped (and listed under "skipped"); rows
+  without one are all applied, since two equal payments to one user can
+  be legitimate. Dedupe keeps 8 bytes per payment_id
+- deposits go through SalaryService.deposit_many (the store's vectorised
+  split); the store's secondary indexes are updated in bulk when the
+  import ends (see UserIndexes.bulk()); balances are live after every chunk
+- each chunk's deposits and its checkpoint (the progress report) are
+  stored together by store.commit(): one engine batch for persistent
+  stores, so a crash leaves both or neither. Running the same job_id
+  again resumes after the last committed chunk. The report is mirrored to
+  <data dir>/imports/<job_id>.json for progress queries; a job whose
+  checkpoint the store doesn't have (an in-memory store since restarted)
+  can't resume, ImportResumeRefused, and needs a new job_id
+
+CLI (imports into CROSSPAY_USER_STORE, see user_state.py):
+
+    cd backend
+    python -m app.state.payroll payroll.csv [--job-id march] [--chunk-size 10000]
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from decimal import ROUND_HALF_EVEN, Decimal, InvalidOperation
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from app.utils import metrics
+from app.utils.data_dir import data_path
+from app.utils.money import MICROS, from_micros
+from .salary import SalaryService, salary_service
+
+DEFAULT_CHUNK_SIZE = 10_000
+MAX_REPORTED_ERRORS = 100
+# per row; keeps each amount, and a chunk's split, well inside int64 micros
+MAX_AMOUNT_USDC = 1_000_000_000
+FORMATS = ("csv", "ndjson")
+
+_rows_imported = metrics.counter("crosspay_payroll_rows_total", "Payroll import rows", outcome="imported")
+_rows_duplicate = metrics.counter("crosspay_payroll_rows_total", "Payroll import rows", outcome="duplicate")
+_rows_rejected = metrics.counter("crosspay_payroll_rows_total", "Payroll import rows", outcome="rejected")
+
+_META_PREFIX = "payroll:"  # store meta key of a job's checkpoint
+
+
+# job ids being imported in this process
+_running = set()
+_running_lock = threading.Lock()
+
+
+class ImportRunning(RuntimeError):
+    """Raised when the same job_id is already being imported."""
+
+
+class ImportResumeRefused(RuntimeError):
+    """Raised when a job has a checkpoint that the store has no record of."""
+
+
+class PayrollRow(NamedTuple):
+    line: int
+    user_id: str
+    amount: int  # micros
+    payment_id: Optional[str]
+
+
+class Rejected(NamedTuple):
+    line: int
+    error: str
+
+
+def format_for(filename: str) -> str:
+    return "ndjson" if filename.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+# -------------------------------------------------
+# Stages
+# -------------------------------------------------
+def parse(stream: IO[str], fmt: str) -> Iterator[Tuple[int, Any]]:
+    """(line number, raw record) per data row; a record is a dict, or an error message."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == "ndjson":
+        for line, text in enumerate(stream, start=1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError as exc:
+                yield line, f"invalid JSON: {exc}"
+                continue
+            yield line, record if isinstance(record, dict) else "expected a JSON object"
+    else:
+        raise ValueError(f"Unknown payroll format {fmt!r}, expected one of {FORMATS}")
+
+
+def _amount_micros(value: Any) -> int:
+    # from the text itself (no float round trip), rounded like to_micros()
+    try:
+        amount = Decimal(value if isinstance(value, str) else repr(value))
+    except (InvalidOperation, TypeError):
+        raise ValueError(f"amount {value!r} is not a number")
+    if not amount.is_finite() or amount <= 0:
+        raise ValueError(f"amount must be positive, got {value!r}")
+    if amount > MAX_AMOUNT_USDC:
+        raise ValueError(f"amount {value!r} is over the {MAX_AMOUNT_USDC} USDC limit")
+    return int((amount * MICROS).to_integral_value(ROUND_HALF_EVEN))
+
+
+def validate(records: Iterable[Tuple[int, Any]]) -> Iterator[Any]:
+    """PayrollRow for every valid record, Rejected for the rest."""
+    for line, record in records:
+        if isinstance(record, str):
+            yield Rejected(line, record)
+            continue
+        user_id = record.get("user_id")
+        if not isinstance(user_id, str) or not user_id.strip():
+            yield Rejected(line, "missing user_id")
+            continue
+        user_id = user_id.strip()
+        try:
+            amount = _amount_micros(record.get("amount"))
+        except ValueError as exc:
+            yield Rejected(line, str(exc))
+            continue
+        if amount <= 0:
+            yield Rejected(line, "amount rounds to 0")
+            continue
+        payment_id = record.get("payment_id")
+        yield PayrollRow(line, user_id, amount, None if payment_id in (None, "") else str(payment_id))
+
+
+def chunked(rows: Iterable[Any], size: int) -> Iterator[Tuple[List[PayrollRow], List[Rejected], int]]:
+    """(valid rows, rejected rows, last line) per `size` valid rows."""
+    valid: List[PayrollRow] = []
+    rejected: List[Rejected] = []
+    last_line = 0
+    for row in rows:
+        last_line = row.line
+        if isinstance(row, Rejected):
+            rejected.append(row)
+            continue
+        valid.append(row)
+        if len(valid) == size:
+            yield valid, rejected, last_line
+            valid, rejected = [], []
+    if valid or rejected:
+        yield valid, rejected, last_line
+
+
+class Deduper:
+    """Keys seen so far, as one sorted int64 array (8 bytes per row)."""
+
+    def __init__(self):
+        self.seen = np.empty(0, dtype=np.int64)
+
+    def first_seen(self, keys: np.ndarray) -> np.ndarray:
+        """Mask of keys not seen before (nor earlier in `keys`); remembers them."""
+        unique, first = np.unique(keys, return_index=True)
+        positions = np.searchsorted(self.seen, unique)
+        known = positions < len(self.seen)
+        known[known] = self.seen[positions[known]] == unique[known]
+        fresh = unique[~known]
+        self.seen = np.insert(self.seen, positions[~known], fresh)
+
+        mask = np.zeros(len(keys), dtype=bool)
+        mask[first[~known]] = True
+        return mask
+
+
+# -------------------------------------------------
+# Job
+# -------------------------------------------------
+def checkpoint_path(job_id: str) -> str:
+    if not job_id or not all(c.isalnum() or c in "-_." for c in job_id) or job_id.startswith("."):
+        raise ValueError(f"Invalid import job id {job_id!r}")
+    os.makedirs(data_path("imports"), exist_ok=True)
+    return data_path("imports", f"{job_id}.json")
+
+
+def load_progress(job_id: str) -> Optional[Dict]:
+    try:
+        with open(checkpoint_path(job_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class PayrollImport:
+    """One import job; progress is checkpointed with every committed chunk."""
+
+    def __init__(self, job_id: str, salary: SalaryService = salary_service, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.job_id = job_id
+        self.salary = salary
+        self.chunk_size = chunk_size
+        self.path = checkpoint_path(job_id)
+        self.meta_key = _META_PREFIX + job_id
+        self.progress = self._checkpoint() or {
+            "jobId": job_id,
+            "status": "new",
+            "committedLine": 0,
+            "chunks": 0,
+            "imported": 0,
+            "duplicates": 0,
+            "rejected": 0,
+            "deposited": 0,  # micros while running, USDC in the report
+            "errors": [],
+            "skipped": [],  # duplicate payment_ids
+            "startedAt": time.time(),
+        }
+
+    def _checkpoint(self) -> Optional[Dict]:
+        """The store's checkpoint; refuses a file one the store never got."""
+        stored = self.salary.state.get_meta(self.meta_key)
+        if stored is not None:
+            return stored
+        saved = load_progress(self.job_id)
+        if saved is not None and saved["committedLine"] > 0:
+            reason = "isn't persistent" if not self.salary.state.durable else "has no record of it"
+            raise ImportResumeRefused(
+                f"Import {self.job_id!r} was checkpointed at line {saved['committedLine']} but this store "
+                f"{reason}: its deposits may be gone, import the file under a new job_id"
+            )
+        return None
+
+    def _save(self, apply: Optional[Callable[[], Any]] = None, **changes):
+        """Store `changes` to the checkpoint, together with apply()'s deposits."""
+        progress = {**self.progress, **changes, "updatedAt": time.time()}
+        self.salary.state.commit(apply or (lambda: None), {self.meta_key: progress})
+        self.progress = progress
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(progress, f)
+        os.replace(tmp, self.path)
+
+    def report(self) -> Dict:
+        return {**self.progress, "deposited": from_micros(self.progress["deposited"])}
+
+    def run(self, stream: IO[str], fmt: str) -> Dict:
+        with _running_lock:
+            if self.job_id in _running:
+                raise ImportRunning(f"Import {self.job_id!r} is already running")
+            _running.add(self.job_id)
+        try:
+            self.progress = self._checkpoint() or self.progress
+            if self.progress["status"] == "done":
+                return self.report()
+            return self._run(stream, fmt)
+        finally:
+            with _running_lock:
+                _running.discard(self.job_id)
+
+    def _run(self, stream: IO[str], fmt: str) -> Dict:
+        resume_after = self.progress["committedLine"]
+        deduper = Deduper()
+        self._save(status="running", format=fmt)
+        try:
+            # secondary indexes are rebuilt once at the end, not per row
+            with self.salary.state.indexes.bulk():
+                for valid, rejected, last_line in chunked(validate(parse(stream, fmt)), self.chunk_size):
+                    # rows without a payment_id are never duplicates
+                    fresh = np.ones(len(valid), dtype=bool)
+                    with_id = [i for i, row in enumerate(valid) if row.payment_id is not None]
+                    if with_id:
+                        keys = np.fromiter((hash(valid[i].payment_id) for i in with_id), dtype=np.int64, count=len(with_id))
+                        fresh[with_id] = deduper.first_seen(keys)
+                    # chunks committed by an earlier run only add their dedupe keys
+                    if last_line > resume_after:
+                        self._commit(valid, rejected, last_line, fresh, resume_after)
+        except Exception as exc:
+            self._save(status="failed", error=str(exc))
+            raise
+        self._save(status="done")
+        return self.report()
+
+    def _commit(self, valid: List[PayrollRow], rejected: List[Rejected], last_line: int, fresh: np.ndarray, resume_after: int):
+        new = np.fromiter((row.line > resume_after for row in valid), dtype=bool, count=len(valid))
+        rejected = [r for r in rejected if r.line > resume_after]
+        apply = np.flatnonzero(fresh & new)
+        skipped = np.flatnonzero(~fresh & new)
+        user_ids = [valid[i].user_id for i in apply]
+        amounts = np.fromiter((valid[i].amount for i in apply), dtype=np.int64, count=len(apply))
+
+        errors = self.progress["errors"]
+        room = MAX_REPORTED_ERRORS - len(errors)
+        if room > 0:
+            errors = errors + [{"line": r.line, "error": r.error} for r in rejected[:room]]
+        listed = self.progress.get("skipped", [])
+        room = MAX_REPORTED_ERRORS - len(listed)
+        if room > 0:
+            listed = listed + [
+                {"line": valid[i].line, "paymentId": valid[i].payment_id, "reason": "duplicate payment_id"}
+                for i in skipped[:room]
+            ]
+        self._save(
+            (lambda: self.salary.deposit_many(user_ids, amounts)) if len(apply) else None,
+            committedLine=last_line,
+            chunks=self.progress["chunks"] + 1,
+            imported=self.progress["imported"] + len(apply),
+            duplicates=self.progress["duplicates"] + len(skipped),
+            rejected=self.progress["rejected"] + len(rejected),
+            deposited=self.progress["deposited"] + int(amounts.sum(dtype=object)),
+            errors=errors,
+            skipped=listed,
+        )
+        _rows_imported.inc(len(apply))
+        _rows_duplicate.inc(len(skipped))
+        _rows_rejected.inc(len(rejected))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Import a payroll CSV/NDJSON file as salary deposits")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    parser.add_argument("--job-id", help="default: the file name; re-run with the same id to resume")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    job_id = args.job_id or os.path.basename(args.path).replace(" ", "_")
+    try:
+        job = PayrollImport(job_id, chunk_size=args.chunk_size)
+    except ImportResumeRefused as exc:
+        parser.exit(1, f"{exc}\n")
+    start = time.perf_counter()
+    with open(args.path, newline="", encoding="utf-8") as f:
+        report = job.run(f, args.format or format_for(args.path))
+    close = getattr(job.salary.state, "close", None)
+    if close is not None:
+        close()
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+PersistentUserState
+-------------------
+userStateScore in front of any storage engine (see engines.py), for when
+users should survive restarts (CROSSPAY_USER_STORE, see user_state.py).
+
+- The in-memory user dicts stay the working set: a write-back cache, so
+  services (SalaryService, OptimisationService, ...) read them directly and
+  never wait on disk
+- Writes go through the store's methods (reads like get_state() don't
+  count) and only mark the user dirty; flush() stores every dirty user with one
+  engine.put_many() (one transaction / one append); commit() does writes
+  plus a flush with meta (e.g. an import checkpoint) in that batch. Use
+  `with store.batch():` around a tick or batch to flush once at the end,
+  and/or flush_interval for a background writer, which also compacts
+  engines that support it (AppendLogEngine) once over COMPACT_DEAD_RATIO of
+  the file is superseded lines
+- Users are loaded on first access; at startup only the indexed fields
+  are scanned, so the secondary indexes cover every stored user
+
+Settings history (the audit trail of old versions) stays in memory only.
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from .engines import INDEXED_FIELDS, Snapshot, StorageEngine, from_record, to_record
+from .user_state import userStateScore
+
+# compact when dead bytes pass this share of the file and COMPACT_MIN_BYTES,
+# so a small log isn't rewritten on every flush
+COMPACT_DEAD_RATIO = 0.5
+COMPACT_MIN_BYTES = 4 << 20
+
+
+class PersistentUserState(userStateScore):
+
+    def __init__(self, engine: StorageEngine, flush_interval: Optional[float] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.engine = engine
+        self._flush_lock = threading.Lock()
+        self._dirty: set = set()
+        self._flushing: set = set()  # taken out of _dirty, not yet in the engine
+        self._dirty_lock = threading.Lock()
+        self._local = threading.local()  # .depth: this thread's batch() nesting
+        self._open_batches = 0  # outermost batches open in any thread
+        self._batch_lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self._stored = set()
+        for user_id, record in engine.scan(INDEXED_FIELDS):
+            self._stored.add(user_id)
+            self.indexes.update_keys(
+                user_id,
+                record["pending"],
+                record["last_update"] + record["max_wait_time"] * 3600,
+                record["risk_level"],
+            )
+
+        if flush_interval:
+            threading.Thread(target=self._flush_loop, args=(flush_interval,), name="user-store-flush", daemon=True).start()
+
+    # -------------------------------------------------
+    # userStateScore hooks
+    # -------------------------------------------------
+    def _load(self, user_id: str) -> Optional[Dict[str, Any]]:
+        if user_id not in self._stored:
+            return None
+        record = self.engine.get(user_id)
+        return None if record is None else from_record(record)
+
+    def _changed(self, user_id: str):
+        with self._dirty_lock:
+            self._dirty.add(user_id)
+
+    def user_ids(self) -> List[str]:
+        return list(self._stored.union(self._users))
+
+    @property
+    def durable(self) -> bool:
+        return self.engine.durable
+
+    def get_meta(self, key: str) -> Any:
+        return self.engine.get_meta(key)
+
+    def commit(self, apply: Callable[[], Any], meta: Dict[str, Any]) -> Any:
+        # under the flush lock: no other flush can store apply()'s writes without `meta`
+        with self._flush_lock:
+            result = apply()
+            self._flush(meta)
+            return result
+
+    # -------------------------------------------------
+    # Write-back
+    # -------------------------------------------------
+    def flush(self) -> int:
+        """Store every dirty user in one engine batch; returns how many."""
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self, meta: Optional[Dict[str, Any]] = None) -> int:
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+            self._flushing = dirty
+        if not dirty and not meta:
+            return 0
+        try:
+            records = []
+            for user_id in dirty:
+                user = self._users.get(user_id)
+                if user is not None:
+                    with self.lock_for(user_id):
+                        records.append((user_id, to_record(user)))
+            self.engine.put_many(records, meta)
+            self._stored |= dirty
+        except Exception:
+            with self._dirty_lock:
+                self._dirty |= dirty
+            raise
+        finally:
+            with self._dirty_lock:
+                self._flushing = set()
+        return len(records)
+
+    def snapshot(self) -> Snapshot:
+        """
+        Flush, then the engine's snapshot: one point in time for every user,
+        stored or in memory, that readers hold without blocking writers.
+        """
+        self.flush()
+        return self.engine.snapshot()
+
+    @contextmanager
+    def batch(self) -> Iterator["PersistentUserState"]:
+        """
+        Group the writes of a tick / batch: one flush when this thread's
+        outermost batch ends. The background flush waits while any thread
+        has a batch open.
+        """
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        if depth == 0:
+            with self._batch_lock:
+                self._open_batches += 1
+        try:
+            yield self
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                with self._batch_lock:
+                    self._open_batches -= 1
+                self.flush()
+
+    def _flush_loop(self, interval: float):
+        while not self._stop.wait(interval):
+            if self._open_batches == 0:
+                self.flush()
+                self.compact_if_needed()
+
+    def compact_if_needed(self) -> bool:
+        garbage = getattr(self.engine, "garbage", None)
+        if garbage is None:
+            return False
+        dead, size = garbage()
+        if dead < COMPACT_MIN_BYTES or dead < size * COMPACT_DEAD_RATIO:
+            return False
+        self.engine.compact()
+        return True
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+        self.engine.close()
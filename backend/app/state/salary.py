@@ -6,7 +6,12 @@ Handles:
 - automatic splitting into instant + optimisation
 """
 
-from typing import Dict
+import math
+from typing import Dict, Sequence
+
+import numpy as np
+
+from app.utils.money import from_micros
 from .user_state import default_user_state
 
 class SalaryService:
@@ -15,7 +20,7 @@ class SalaryService:
         self.state = state
     
     def deposit_salary(self, user_id: str, amount: float) -> Dict:
-        if amount <= 0:
+        if not math.isfinite(amount) or amount <= 0:
             raise ValueError("Deposit amount must be positive")
         
         split = self.state.apply_salary_split(user_id, amount)
@@ -26,6 +31,25 @@ class SalaryService:
             "instant_bucket": split["instant"],
             "optimised_bucket": split["optimised"],
         }
-    
+
+    def deposit_many(self, user_ids: Sequence[str], amounts: np.ndarray) -> Dict:
+        """
+        Many deposits at once (amounts: int64 micros, all positive), e.g. a
+        chunk of a payroll import (see payroll.py).
+        """
+        if len(amounts) and amounts.min() <= 0:
+            raise ValueError("Deposit amount must be positive")
+
+        instant, optimised = self.state.apply_salary_splits(user_ids, amounts)
+
+        # dtype=object: totals as Python ints, an int64 sum can wrap
+        return {
+            "status": "ok",
+            "deposits": len(user_ids),
+            "deposited": from_micros(int(amounts.sum(dtype=object))),
+            "instant_bucket": from_micros(int(instant.sum(dtype=object))),
+            "optimised_bucket": from_micros(int(optimised.sum(dtype=object))),
+        }
+
 
 salary_service = SalaryService()
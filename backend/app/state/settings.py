@@ -5,9 +5,12 @@ Updates user-defined configuration for:
 - instant %
 - max wait time
 - risk level
+
+Each update creates a new read-only settings version (see userStateScore);
+responses carry the active "version".
 """
 
-from typing import Dict
+from typing import Dict, Optional
 from .user_state import default_user_state
 
 class SettingsService:
@@ -16,6 +19,14 @@ class SettingsService:
         self.state = state
     
     def update(self, user_id: str, new_settings: Dict):
-        return self.state.update_settings(user_id, new_settings)
+        return dict(self.state.update_settings(user_id, new_settings))
+
+    def current(self, user_id: str) -> Optional[Dict]:
+        """Active settings version, or None for an unknown user (not created)."""
+        user = self.state.find(user_id)
+        return None if user is None else dict(user["settings"])
+
+    def history(self, user_id: str):
+        return [dict(version) for version in self.state.settings_history(user_id)]
     
 settings_service = SettingsService()
@@ -0,0 +1,183 @@
+"""
+SQLite store
+------------
+SQLiteEngine: the storage-engine interface (engines.py) on a local SQLite
+file, and SQLiteUserState, the write-back user store on top of it
+(CROSSPAY_USER_STORE=sqlite, see user_state.py).
+
+- WAL mode with synchronous=NORMAL: readers don't block the writer, and a
+  crash can lose at most the last uncheckpointed commits
+- batch_mutate() is one transaction (with its meta, in the meta table);
+  writes go through executemany with one statement, compiled once by
+  sqlite3's statement cache
+- snapshot() is a read transaction on its own connection, which WAL keeps
+  at a fixed point in time while writers carry on
+"""
+
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .engines import RECORD_FIELDS, Meta, Mutation, Record, Snapshot, StorageEngine, apply_mutations, check_record
+from .persistent_state import PersistentUserState
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id          TEXT PRIMARY KEY,
+    total_received   INTEGER NOT NULL,
+    instant_bucket   INTEGER NOT NULL,
+    optimised_bucket INTEGER NOT NULL,
+    pending          INTEGER NOT NULL,
+    converted        INTEGER NOT NULL,
+    last_update      REAL NOT NULL,
+    max_wait_time    REAL NOT NULL,
+    risk_level       TEXT NOT NULL,
+    settings         TEXT NOT NULL,
+    allocations      TEXT
+) WITHOUT ROWID
+"""
+META_SCHEMA = "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID"
+
+COLUMNS = ("user_id", *RECORD_FIELDS)
+UPSERT = (
+    f"INSERT INTO users ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+    "ON CONFLICT(user_id) DO UPDATE SET "
+    + ", ".join(f"{column} = excluded.{column}" for column in RECORD_FIELDS)
+)
+DELETE = "DELETE FROM users WHERE user_id = ?"
+SELECT_ONE = f"SELECT {', '.join(RECORD_FIELDS)} FROM users WHERE user_id = ?"
+UPSERT_META = "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value"
+DELETE_META = "DELETE FROM meta WHERE key = ?"
+
+
+def _select_all(fields: Optional[Sequence[str]]) -> str:
+    for field in fields or ():
+        if field not in RECORD_FIELDS:
+            raise KeyError(field)
+    return f"SELECT user_id, {', '.join(fields or RECORD_FIELDS)} FROM users"
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+class SQLiteEngine(StorageEngine):
+
+    name = "sqlite"
+    durable = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = _connect(path)
+        self._db.execute(SCHEMA)
+        self._db.execute(META_SCHEMA)
+        self._lock = threading.Lock()
+
+    def _get(self, user_id: str) -> Optional[Record]:
+        row = self._db.execute(SELECT_ONE, (user_id,)).fetchone()
+        return None if row is None else dict(zip(RECORD_FIELDS, row))
+
+    def get(self, user_id: str) -> Optional[Record]:
+        with self._lock:
+            return self._get(user_id)
+
+    def get_meta(self, key: str) -> Any:
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _write_meta(self, meta: Optional[Meta]):
+        meta = meta or {}
+        self._db.executemany(UPSERT_META, [(key, json.dumps(value)) for key, value in meta.items() if value is not None])
+        self._db.executemany(DELETE_META, [(key,) for key, value in meta.items() if value is None])
+
+    def batch_mutate(self, mutations: Iterable[Tuple[str, Mutation]], meta: Optional[Meta] = None) -> List[Optional[Record]]:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                staged: Dict[str, Optional[Record]] = {}
+                results = apply_mutations(staged, self._get, mutations)
+                self._db.executemany(UPSERT, [
+                    (user_id, *(record[field] for field in RECORD_FIELDS))
+                    for user_id, record in staged.items() if record is not None
+                ])
+                self._db.executemany(DELETE, [(user_id,) for user_id, record in staged.items() if record is None])
+                self._write_meta(meta)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            return results
+
+    def put_many(self, records: Iterable[Tuple[str, Optional[Record]]], meta: Optional[Meta] = None):
+        # nothing to read back: straight to executemany, one transaction
+        records = [(user_id, check_record(record)) for user_id, record in records]
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(UPSERT, [
+                    (user_id, *(record[field] for field in RECORD_FIELDS))
+                    for user_id, record in records if record is not None
+                ])
+                self._db.executemany(DELETE, [(user_id,) for user_id, record in records if record is None])
+                self._write_meta(meta)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def scan(self, fields: Optional[Sequence[str]] = None) -> Iterator[Tuple[str, Record]]:
+        names = fields or RECORD_FIELDS
+        with self._lock:
+            rows = self._db.execute(_select_all(fields)).fetchall()
+        for user_id, *values in rows:
+            yield user_id, dict(zip(names, values))
+
+    def snapshot(self) -> "SQLiteSnapshot":
+        return SQLiteSnapshot(self.path)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class SQLiteSnapshot(Snapshot):
+
+    def __init__(self, path: str):
+        super().__init__({})
+        self._db = _connect(path)
+        self._db.execute("BEGIN")
+        # the read transaction's snapshot starts at its first read
+        self._db.execute("SELECT COUNT(*) FROM users").fetchone()
+
+    def get(self, user_id: str) -> Optional[Record]:
+        row = self._db.execute(SELECT_ONE, (user_id,)).fetchone()
+        return None if row is None else dict(zip(RECORD_FIELDS, row))
+
+    def scan(self, fields: Optional[Sequence[str]] = None) -> Iterator[Tuple[str, Record]]:
+        names = fields or RECORD_FIELDS
+        for user_id, *values in self._db.execute(_select_all(fields)):
+            yield user_id, dict(zip(names, values))
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def close(self):
+        self._db.execute("ROLLBACK")
+        self._db.close()
+
+
+class SQLiteUserState(PersistentUserState):
+    """PersistentUserState on a SQLiteEngine at `path`."""
+
+    def __init__(self, path: str, flush_interval: Optional[float] = None, **kwargs):
+        self.path = path
+        super().__init__(SQLiteEngine(path), flush_interval=flush_interval, **kwargs)
@@ -0,0 +1,188 @@
+"""
+TieredUserState
+---------------
+PersistentUserState with a bounded hot tier: most users are touched once
+per pay cycle, so only recently used users stay in RAM and the rest live
+in the engine (the cold tier: SQLite or the append-only log) until they
+are needed again.
+
+- Every ensure_user / get_state / find moves the user to the young end of
+  an LRU. A user that isn't hot is faulted in from the engine, transparently
+- evict_idle() (every evict_interval seconds in the background) flushes,
+  then drops users idle for longer than idle_seconds
+- max_hot_users is the memory ceiling: past it, the least recently used
+  clean users are dropped right away (dirty ones wait for the next flush,
+  so the ceiling is soft while writes are unflushed)
+- stats() and /metrics report hits, faults (+ fault latency under
+  crosspay_stage_duration_seconds{stage="user_fault"}) and evictions
+
+Writes pin their users (_pinned(), a refcount per user) from before the
+lookup until the user is marked dirty, and eviction skips pinned, dirty and
+mid-flush users, so a write never lands on a dict that was already dropped,
+however large the batch is next to max_hot_users. Settings history of an
+evicted user is dropped with it (it is in-memory only).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from app.utils import metrics
+from .engines import StorageEngine
+from .persistent_state import PersistentUserState
+
+DEFAULT_MAX_HOT_USERS = 100_000
+DEFAULT_IDLE_SECONDS = 3600.0
+
+_hits = metrics.counter("crosspay_user_store_hits_total", "User lookups served from the hot tier")
+_faults = metrics.counter("crosspay_user_store_faults_total", "Users loaded back from the cold tier")
+_fault_latency = metrics.histogram(metrics.STAGE_HISTOGRAM, "Time spent in internal stages", stage="user_fault")
+
+
+def _evictions(reason: str):
+    return metrics.counter("crosspay_user_store_evictions_total", "Users dropped from the hot tier", reason=reason)
+
+
+class TieredUserState(PersistentUserState):
+
+    def __init__(
+        self,
+        engine: StorageEngine,
+        max_hot_users: int = DEFAULT_MAX_HOT_USERS,
+        idle_seconds: float = DEFAULT_IDLE_SECONDS,
+        evict_interval: Optional[float] = None,
+        **kwargs,
+    ):
+        self.max_hot_users = max_hot_users
+        self.idle_seconds = idle_seconds
+        # user_id -> last access (time.monotonic()), oldest first
+        self._lru: "OrderedDict[str, float]" = OrderedDict()
+        self._pins: Dict[str, int] = {}  # user_id -> writes in progress; guarded by _lru_lock
+        self._lru_lock = threading.Lock()
+        self._counts = {"hits": 0, "faults": 0, "fault_ns": 0, "evicted_idle": 0, "evicted_ceiling": 0}
+        super().__init__(engine, **kwargs)
+
+        if evict_interval:
+            threading.Thread(target=self._evict_loop, args=(evict_interval,), name="user-store-evict", daemon=True).start()
+
+    # -------------------------------------------------
+    # Access tracking
+    # -------------------------------------------------
+    def _touch(self, user_id: str):
+        with self._lru_lock:
+            self._lru[user_id] = time.monotonic()
+            self._lru.move_to_end(user_id)
+
+    @contextmanager
+    def _pinned(self, user_ids: Iterable[str]) -> Iterator[None]:
+        user_ids = list(user_ids)
+        with self._lru_lock:
+            for user_id in user_ids:
+                self._pins[user_id] = self._pins.get(user_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lru_lock:
+                for user_id in user_ids:
+                    left = self._pins.pop(user_id) - 1
+                    if left:
+                        self._pins[user_id] = left
+
+    def _load(self, user_id: str) -> Optional[Dict[str, Any]]:
+        start = time.perf_counter_ns()
+        user = super()._load(user_id)
+        if user is not None:
+            elapsed = time.perf_counter_ns() - start
+            _faults.inc()
+            _fault_latency.observe_ns(elapsed)
+            self._counts["faults"] += 1
+            self._counts["fault_ns"] += elapsed
+        return user
+
+    def _lookup(self, user_id: str, miss) -> Optional[Dict[str, Any]]:
+        user = self._users.get(user_id)
+        if user is not None:
+            _hits.inc()
+            self._counts["hits"] += 1
+        else:
+            user = miss(user_id)
+            if user is None:
+                return None
+        self._touch(user_id)
+        if len(self._users) > self.max_hot_users:
+            self._evict_over_ceiling()
+        return user
+
+    def ensure_user(self, user_id: str) -> Dict[str, Any]:
+        return self._lookup(user_id, super().ensure_user)
+
+    def find(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return self._lookup(user_id, super().find)
+
+    # -------------------------------------------------
+    # Eviction
+    # -------------------------------------------------
+    def _evict(self, user_id: str, last_access: float) -> bool:
+        """Drop one clean, unpinned user that hasn't been touched since `last_access`."""
+        with self.lock_for(user_id):
+            with self._dirty_lock:
+                if user_id in self._dirty or user_id in self._flushing or user_id not in self._stored:
+                    return False
+            # popped under _lru_lock: a writer that pinned first finds either
+            # the cached dict or none (and faults in the stored record)
+            with self._lru_lock:
+                if self._lru.get(user_id) != last_access or user_id in self._pins:
+                    return False
+                del self._lru[user_id]
+                self._users.pop(user_id, None)
+            return True
+
+    def _evict_over_ceiling(self):
+        # a little below the ceiling, so we don't evict on every miss
+        target = self.max_hot_users - max(1, self.max_hot_users // 100)
+        with self._lru_lock:
+            oldest = []
+            for user_id, last_access in self._lru.items():
+                if len(self._users) - len(oldest) <= target:
+                    break
+                if user_id not in self._pins:
+                    oldest.append((user_id, last_access))
+        evicted = sum(self._evict(user_id, last_access) for user_id, last_access in oldest)
+        _evictions("ceiling").inc(evicted)
+        self._counts["evicted_ceiling"] += evicted
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Flush, then drop every user idle for longer than idle_seconds; returns how many."""
+        cutoff = (time.monotonic() if now is None else now) - self.idle_seconds
+        self.flush()
+        with self._lru_lock:
+            idle = []
+            for user_id, last_access in self._lru.items():
+                if last_access > cutoff:
+                    break
+                idle.append((user_id, last_access))
+        evicted = sum(self._evict(user_id, last_access) for user_id, last_access in idle)
+        _evictions("idle").inc(evicted)
+        self._counts["evicted_idle"] += evicted
+        return evicted
+
+    def _evict_loop(self, interval: float):
+        while not self._stop.wait(interval):
+            self.evict_idle()
+
+    def stats(self) -> Dict[str, Any]:
+        counts = dict(self._counts)
+        lookups = counts["hits"] + counts["faults"]
+        return {
+            "hot_users": len(self._users),
+            "stored_users": len(self._stored),
+            "max_hot_users": self.max_hot_users,
+            "hits": counts["hits"],
+            "faults": counts["faults"],
+            "hit_rate": counts["hits"] / lookups if lookups else None,
+            "avg_fault_ms": counts["fault_ns"] / counts["faults"] / 1e6 if counts["faults"] else None,
+            "evicted_idle": counts["evicted_idle"],
+            "evicted_ceiling": counts["evicted_ceiling"],
+        }
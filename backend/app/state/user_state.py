@@ -9,56 +9,227 @@ State stored per user:
     * total_received
     * instant_bucket
     * optimised_bucket
-- allocations (rent/savings/investing/emergency)
-- settings:
+- allocations (rent/savings/investing/emergency, as normalised BucketWeights)
+- settings (read-only snapshot, replaced on update):
     * instant_percent (0–100)
     * max_wait_time
     * risk_level
+    * version
+
+Amounts are stored as int micro-USDC (see app/utils/money.py) and converted
+back to USDC floats by to_dict() / the return values.
+
+Balance updates take a per-user striped lock (user_id hash -> one of
+LOCK_STRIPES locks), so concurrent withdrawals can't overdraw and
+different users never wait on one global lock. While a snapshot() is open,
+a write first hands it the user's old record (copy-on-write, see
+engines.StripedSnapshot). Settings are copy-on-write:
+readers take user["settings"] once and get a consistent version without
+locking; the last SETTINGS_HISTORY versions are kept for audit.
+
+`indexes` (see indexes.py) is updated under the same stripe lock whenever
+pending, the deadline or settings change, so queries like "users due in
+the next hour" don't scan every user.
 """
 
+import os
+import threading
 import time
-from typing import Dict, Any
+from collections import deque
+from contextlib import nullcontext
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.utils.data_dir import data_path
+from app.utils.money import from_micros, mul_fraction, mul_fraction_array, to_micros
+from app.utils.weights import BucketWeights
+from .indexes import UserIndexes
+
+# Shared by every user until they change their allocations (BucketWeights is immutable)
+DEFAULT_ALLOCATIONS = BucketWeights.from_dict({"rent": 0.4, "savings": 0.2, "investing": 0.3, "emergency": 0.1})
+
+LOCK_STRIPES = 64
+SETTINGS_HISTORY = 10
+
+_NOT_PINNED = nullcontext()
+
+def new_user() -> Dict[str, Any]:
+    return {
+        "salary": {
+            "total_received": 0,
+            "instant_bucket": 0,
+            "optimised_bucket": 0,
+        },
+        "allocations": DEFAULT_ALLOCATIONS,
+        "settings": MappingProxyType({
+            "instant_percent": 30,
+            "max_wait_time": 24,
+            "risk_level": "safe",
+            "version": 1,
+            "updated_at": time.time(),
+        }),
+        "settings_history": deque(maxlen=SETTINGS_HISTORY),
+        "optimisation": {
+            "pending": 0,
+            "converted": 0,
+            "last_update": time.time(),
+        }
+    }
 
 class userStateScore:
 
-    def __init__(self):
+    durable = False  # users survive a restart (see persistent_state.py)
+
+    def __init__(self, stripes: int = LOCK_STRIPES):
         self._users: Dict[str, Dict[str, Any]] = {}
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self.indexes = UserIndexes()
+        self._meta: Dict[str, Any] = {}
+        # open StripedSnapshots (replaced, never mutated, so writers can iterate it)
+        self._snapshots: List[Any] = []
+        self._snapshots_lock = threading.Lock()
+
+    def _stripe(self, user_id: str) -> int:
+        return hash(user_id) % len(self._locks)
+
+    def lock_for(self, user_id: str) -> threading.Lock:
+        return self._locks[self._stripe(user_id)]
+
+    # -------------------------------------------------
+    # Hooks for persistent stores (see sqlite_store.py)
+    # -------------------------------------------------
+    def _load(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """A user that isn't in memory yet; None = unknown."""
+        return None
+
+    def _changed(self, user_id: str):
+        """Called after every write to a user, under its stripe lock."""
+
+    def _pinned(self, user_ids: Iterable[str]):
+        """
+        Context in which these users' dicts stay cached, taken before
+        fetching them for a write so the write can't land on an evicted
+        copy (see tiered_state.py).
+        """
+        return _NOT_PINNED
+
+    def _preserve(self, user_id: str, user: Optional[Dict[str, Any]]):
+        # under user_id's stripe lock, before a write (user None: being added)
+        for snapshot in self._snapshots:
+            snapshot.preserve(user_id, user)
+
+    def _cache(self, user_id: str, user: Dict[str, Any]) -> Dict[str, Any]:
+        # setdefault: two threads adding the same user end up sharing one dict
+        with self.lock_for(user_id):
+            cached = self._users.setdefault(user_id, user)
+            if cached is user:
+                if self._snapshots:
+                    self._preserve(user_id, None)
+                self.indexes.update(user_id, user)
+        return cached
 
     def ensure_user(self, user_id: str) -> Dict[str, Any]:
-        if user_id not in self._users:
-            self._users[user_id] = {
-                "salary": {
-                    "total_received": 0.0,
-                    "instant_bucket": 0.0,
-                    "optimised_bucket": 0.0,
-                },
-                "allocations": {
-                    "rent": 0.4,
-                    "savings": 0.2,
-                    "investing": 0.3,
-                    "emergency": 0.1,
-
-                },
-                "settings": {
-                    "instant_percent": 30,
-                    "max_wait_time": 24,
-                    "risk_level": "safe",
-                },
-                "optimisation": {
-                    "pending": 0.0,
-                    "converted": 0.0,
-                    "last_update": time.time(),
-                }
-            }
-        return self._users[user_id]
+        user = self._users.get(user_id)
+        if user is None:
+            user = self._load(user_id)
+            if user is not None:
+                return self._cache(user_id, user)
+            user = self._cache(user_id, new_user())
+            with self.lock_for(user_id):
+                self._changed(user_id)
+        return user
     
     def get_state(self,user_id: str) -> dict[str, Any]:
+        """The live user dict, for reading: writes go through the methods below, which mark the user changed."""
         return self.ensure_user(user_id)
+
+    def find(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Like get_state(), without creating unknown users (read-only)."""
+        user = self._users.get(user_id)
+        if user is None:
+            user = self._load(user_id)
+            if user is not None:
+                user = self._cache(user_id, user)
+        return user
+
+    def user_ids(self) -> List[str]:
+        return list(self._users)
+
+    def get_meta(self, key: str) -> Any:
+        """Value stored by commit() (e.g. an import checkpoint), or None."""
+        return self._meta.get(key)
+
+    def commit(self, apply: Callable[[], Any], meta: Dict[str, Any]) -> Any:
+        """
+        apply() (writes to this store), then store `meta` (key -> JSON-able
+        value, None deletes). Persistent stores write both in one engine
+        batch, so after a crash either both are there or neither is.
+        """
+        result = apply()
+        for key, value in meta.items():
+            if value is None:
+                self._meta.pop(key, None)
+            else:
+                self._meta[key] = value
+        return result
+
+    def snapshot(self):
+        """Point-in-time view of every user for exports; close() it (see engines.StripedSnapshot)."""
+        from .engines import StripedSnapshot
+        return StripedSnapshot(self)
+
+    def to_dict(self, user_id: str) -> Dict[str, Any]:
+        """Same shape as get_state(), amounts in USDC."""
+        user = self.ensure_user(user_id)
+        user = {k: v for k, v in user.items() if k != "settings_history"}
+        return {
+            **user,
+            "settings": dict(user["settings"]),
+            "allocations": user["allocations"].as_dict(),
+            "salary": {k: from_micros(v) for k, v in user["salary"].items()},
+            "optimisation": {
+                **user["optimisation"],
+                "pending": from_micros(user["optimisation"]["pending"]),
+                "converted": from_micros(user["optimisation"]["converted"]),
+            },
+        }
     
-    def update_settings(self,user_id: str, new_settings: Dict[str, Any]):
+    def update_settings(self,user_id: str, new_settings: Dict[str, Any]) -> Mapping[str, Any]:
+        """Swaps in a new settings version; the replaced one goes to the history."""
+        with self._pinned((user_id,)):
+            user = self.ensure_user(user_id)
+            with self.lock_for(user_id):
+                if self._snapshots:
+                    self._preserve(user_id, user)
+                current = user["settings"]
+                user["settings_history"].append(current)
+                user["settings"] = MappingProxyType({
+                    **current,
+                    **new_settings,
+                    "version": current["version"] + 1,
+                    "updated_at": time.time(),
+                })
+                self.indexes.update(user_id, user)
+                self._changed(user_id)
+            return user["settings"]
+
+    def set_allocations(self, user_id: str, weights: BucketWeights):
+        """Swaps in new (immutable) allocations."""
+        with self._pinned((user_id,)):
+            user = self.ensure_user(user_id)
+            with self.lock_for(user_id):
+                if self._snapshots:
+                    self._preserve(user_id, user)
+                user["allocations"] = weights
+                self._changed(user_id)
+
+    def settings_history(self, user_id: str) -> List[Mapping[str, Any]]:
+        """Replaced settings versions, oldest first."""
         user = self.ensure_user(user_id)
-        user["settings"].update(new_settings)
-        return user["settings"]
+        with self.lock_for(user_id):
+            return list(user["settings_history"])
     
     def apply_salary_split(self, user_id: str, amount: float) -> Dict[str, Any]:
         """splits salary into:
@@ -66,51 +237,186 @@ class userStateScore:
           -instant buckets 
         based on user settings"""
 
-        user = self.ensure_user(user_id)
-        pct = user["settings"]["instant_percent"] / 100
+        with self._pinned((user_id,)):
+            user = self.ensure_user(user_id)
+            pct = user["settings"]["instant_percent"] / 100
 
-        instant = amount * pct
-        optimised = amount - instant
+            amount = to_micros(amount)
+            instant = mul_fraction(amount, pct)
+            optimised = amount - instant
 
-        user["salary"]["total_recevied"] += amount
-        user["salary"]["instant_bucket"] += instant
-        user["salary"]["optimised_bucket"] += optimised
+            with self.lock_for(user_id):
+                if self._snapshots:
+                    self._preserve(user_id, user)
+                user["salary"]["total_received"] += amount
+                user["salary"]["instant_bucket"] += instant
+                user["salary"]["optimised_bucket"] += optimised
 
-        user["optimisation"]["pending"] += optimised
+                user["optimisation"]["pending"] += optimised
+                self.indexes.update(user_id, user)
+                self._changed(user_id)
 
-        return {"instant": instant,
-                "optimised": optimised
+        return {"instant": from_micros(instant),
+                "optimised": from_micros(optimised)
         }
 
-    def convert_optimised(self,user_id: str, amount: float):
-        
-        """Converts pending optimisation -> instantly available"""
+    def apply_salary_splits(self, user_ids: Sequence[str], amounts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Batch apply_salary_split(), amounts in micros (int64 array): the
+        splits are computed in one vectorised step, then applied one lock
+        stripe at a time. Unknown users are created. Returns the (instant,
+        optimised) micros per row.
+        """
+        with self._pinned(set(user_ids)):
+            return self._apply_salary_splits(user_ids, amounts)
 
-        user = self.ensure_user(user_id)
-        opt = user["optimisation"]
+    def _apply_salary_splits(self, user_ids: Sequence[str], amounts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        users = [self.ensure_user(user_id) for user_id in user_ids]
+        pct = np.fromiter((user["settings"]["instant_percent"] for user in users), dtype=float, count=len(users))
+        instant = mul_fraction_array(amounts, np.clip(pct / 100, 0.0, 1.0))
+        optimised = amounts - instant
+
+        by_stripe: Dict[int, List[int]] = {}
+        for i, user_id in enumerate(user_ids):
+            by_stripe.setdefault(self._stripe(user_id), []).append(i)
+        amount_list, instant_list, optimised_list = amounts.tolist(), instant.tolist(), optimised.tolist()
+        for stripe, rows in by_stripe.items():
+            with self._locks[stripe]:
+                for i in rows:
+                    user = users[i]
+                    if self._snapshots:
+                        self._preserve(user_ids[i], user)
+                    salary = user["salary"]
+                    salary["total_received"] += amount_list[i]
+                    salary["instant_bucket"] += instant_list[i]
+                    salary["optimised_bucket"] += optimised_list[i]
+                    user["optimisation"]["pending"] += optimised_list[i]
+                # once per user, however many of its rows are in the batch
+                for i in {user_ids[i]: i for i in rows}.values():
+                    self.indexes.update(user_ids[i], users[i])
+                    self._changed(user_ids[i])
+        return instant, optimised
+
+    def convert_optimised(self, user_id: str, amount_micros: Optional[int] = None):
         
-        opt["pending"] -= amount
-        opt["converted"] += amount
-        user["salary"]["instant_bucket"] += amount
-        opt["last_update"] = time.time()
+        """
+        Converts `amount_micros` (None: all) of pending optimisation ->
+        instantly available. The amount is capped at what is pending when
+        the lock is taken, so concurrent converts never take it twice.
+        """
 
-        return {"converted": amount,
-                "pending_left": opt["spending"]
+        with self._pinned((user_id,)):
+            user = self.ensure_user(user_id)
+            opt = user["optimisation"]
+
+            with self.lock_for(user_id):
+                pending = opt["pending"]
+                amount_micros = pending if amount_micros is None else min(amount_micros, pending)
+                if amount_micros <= 0:
+                    return {"converted": 0, "pending_left": from_micros(pending)}
+                if self._snapshots:
+                    self._preserve(user_id, user)
+                opt["pending"] -= amount_micros
+                opt["converted"] += amount_micros
+                user["salary"]["instant_bucket"] += amount_micros
+                opt["last_update"] = time.time()
+                pending_left = opt["pending"]
+                self.indexes.update(user_id, user)
+                self._changed(user_id)
+
+        return {"converted": from_micros(amount_micros),
+                "pending_left": from_micros(pending_left)
         }
     
+    def compare_and_decrement(self, user_id: str, amount: int, bucket: str = "instant_bucket") -> Optional[int]:
+        """
+        Atomically take `amount` micros from a salary bucket if it holds at
+        least that much. Returns the new balance, or None (nothing changed)
+        when funds are insufficient.
+        """
+        with self._pinned((user_id,)):
+            user = self.ensure_user(user_id)
+            salary = user["salary"]
+            with self.lock_for(user_id):
+                if amount > salary[bucket]:
+                    return None
+                if self._snapshots:
+                    self._preserve(user_id, user)
+                salary[bucket] -= amount
+                self._changed(user_id)
+                return salary[bucket]
+
     def withdraw(self,user_id: str,amount: float) -> bool:
         
-        "Simple decrease in miney available from the instant bucket"
-
-        user = self.ensure_user(user_id)
-        available = user["salary"]["instant_bucket"]
+        "Atomic decrease in money available from the instant bucket"
 
-        if amount > available:
+        if self.compare_and_decrement(user_id, to_micros(amount)) is None:
             raise ValueError("Insufficient funds")
-        
-        user["salary"]["instant_bucket"] -= amount
         return True
 
-default_user_state = userStateScore()
+    def withdraw_many(self, rows: Iterable[Tuple[str, int]]) -> List[Optional[int]]:
+        """
+        Batch compare_and_decrement() on instant buckets, amounts in micros.
+        Rows are grouped by lock stripe and each stripe is locked once; rows
+        for the same user apply in input order. Unknown users fail without
+        being created. Returns the new balance per row (input order), or
+        None where the row failed.
+        """
+        rows = list(rows)
+        with self._pinned({user_id for user_id, _ in rows}):
+            return self._withdraw_many(rows)
+
+    def _withdraw_many(self, rows: List[Tuple[str, int]]) -> List[Optional[int]]:
+        by_stripe: Dict[int, List[int]] = {}
+        for i, (user_id, _) in enumerate(rows):
+            by_stripe.setdefault(self._stripe(user_id), []).append(i)
+        # bring stored users into memory before taking any stripe lock
+        users = {user_id: self.find(user_id) for user_id, _ in rows}
+
+        results: List[Optional[int]] = [None] * len(rows)
+        for stripe, indexes in by_stripe.items():
+            with self._locks[stripe]:
+                for i in indexes:
+                    user_id, amount = rows[i]
+                    user = users[user_id]
+                    if user is None:
+                        continue
+                    salary = user["salary"]
+                    if amount <= salary["instant_bucket"]:
+                        if self._snapshots:
+                            self._preserve(user_id, user)
+                        salary["instant_bucket"] -= amount
+                        results[i] = salary["instant_bucket"]
+                        self._changed(user_id)
+        return results
+
+def _default_store() -> userStateScore:
+    """
+    CROSSPAY_USER_STORE: memory (default), sqlite (<data dir>/users.sqlite3)
+    or appendlog (<data dir>/users.log). The persistent stores keep at most
+    CROSSPAY_HOT_USERS users in memory (~2 KB each) and evict users idle for
+    CROSSPAY_USER_IDLE_SECONDS (see tiered_state.py).
+    """
+    kind = os.getenv("CROSSPAY_USER_STORE", "memory")
+    if kind == "memory":
+        return userStateScore()
+    from .tiered_state import DEFAULT_IDLE_SECONDS, DEFAULT_MAX_HOT_USERS, TieredUserState
+    if kind == "sqlite":
+        from .sqlite_store import SQLiteEngine
+        engine = SQLiteEngine(data_path("users.sqlite3"))
+    elif kind == "appendlog":
+        from .engines import AppendLogEngine
+        engine = AppendLogEngine(data_path("users.log"))
+    else:
+        raise ValueError(f"Unknown CROSSPAY_USER_STORE {kind!r}")
+    return TieredUserState(
+        engine,
+        max_hot_users=int(os.getenv("CROSSPAY_HOT_USERS", DEFAULT_MAX_HOT_USERS)),
+        idle_seconds=float(os.getenv("CROSSPAY_USER_IDLE_SECONDS", DEFAULT_IDLE_SECONDS)),
+        evict_interval=60.0,
+        flush_interval=1.0,
+    )
+
+default_user_state = _default_store()
 
 
@@ -1,23 +1,68 @@
 """
 WithdrawService
 ---------------
-Withdraws from the user's instant bucket.
+Withdraws from the user's instant bucket, one user at a time or as a batch
+of payouts (validated up front, then applied with the store's atomic
+compare-and-decrement; no global lock). Bad amounts raise ValueError, an
+overdraft InsufficientFunds.
 """
 
+import math
+from typing import Dict, Iterable, List, Tuple
+
+from app.utils.money import from_micros, to_micros
 from .user_state import default_user_state
 
+
+class InsufficientFunds(ValueError):
+    """Raised when the instant bucket holds less than the withdrawal."""
+
+
 class WithdrawService:
 
     def __init__(self, state = default_user_state):
         self.state = state
 
     def withdraw(self, user_id: str, amount: float):
-        if amount <= 0:
+        if not math.isfinite(amount) or amount <= 0:
             raise ValueError("withdrawal must be positive")
-        self.state.withdraw(user_id, amount)
+        balance = self.state.compare_and_decrement(user_id, to_micros(amount))
+        if balance is None:
+            raise InsufficientFunds("Insufficient funds")
 
         return {"status": "success",
-                 "amount": amount
+                 "amount": amount,
+                 "balance": from_micros(balance),
         }
 
+    def withdraw_batch(self, payouts: Iterable[Tuple[str, float]]) -> Dict:
+        """
+        payouts: (user_id, amount) pairs. Each row succeeds or fails on its
+        own; results are in input order with the new instant balance or an
+        error.
+        """
+        payouts = list(payouts)
+        valid: List[Tuple[int, str, int]] = []
+        results: List[Dict] = []
+        for i, (user_id, amount) in enumerate(payouts):
+            if not math.isfinite(amount) or amount <= 0:
+                results.append({"userId": user_id, "amount": amount, "status": "failed",
+                                "error": "withdrawal must be positive"})
+                continue
+            results.append({"userId": user_id, "amount": amount, "status": "success"})
+            valid.append((i, user_id, to_micros(amount)))
+
+        balances = self.state.withdraw_many((user_id, micros) for _, user_id, micros in valid)
+
+        failed = len(payouts) - len(valid)
+        for (i, user_id, _), balance in zip(valid, balances):
+            if balance is None:
+                results[i]["status"] = "failed"
+                results[i]["error"] = "unknown user" if self.state.find(user_id) is None else "Insufficient funds"
+                failed += 1
+            else:
+                results[i]["balance"] = from_micros(balance)
+
+        return {"succeeded": len(payouts) - failed, "failed": failed, "results": results}
+
 withdraw_service = WithdrawService()
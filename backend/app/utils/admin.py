@@ -0,0 +1,16 @@
+import os
+
+from fastapi import HTTPException, Request
+
+
+def require_admin(request: Request, admin_token: str | None):
+    """
+    Admin routes need X-Admin-Token when CROSSPAY_ADMIN_TOKEN is set,
+    otherwise they are only reachable from localhost.
+    """
+    expected = os.getenv("CROSSPAY_ADMIN_TOKEN")
+    if expected:
+        if admin_token != expected:
+            raise HTTPException(status_code=403, detail="Invalid admin token")
+    elif request.client is None or request.client.host not in ("127.0.0.1", "::1", "localhost"):
+        raise HTTPException(status_code=403, detail="Admin routes are localhost-only without CROSSPAY_ADMIN_TOKEN")
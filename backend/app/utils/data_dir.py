@@ -0,0 +1,12 @@
+import os
+
+DATA_DIR = os.getenv("CROSSPAY_DATA_DIR", "data")
+
+
+def data_path(*parts: str) -> str:
+    """
+    Returns a path inside the backend data directory (created on demand).
+    Defaults to ./data relative to where uvicorn is started (backend/).
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, *parts)
@@ -0,0 +1,90 @@
+"""
+HashRing
+--------
+Consistent hashing of keys (user ids) onto nodes (shard URLs).
+
+Each node is placed at `vnodes` pseudo-random points on a 64-bit ring; a
+key belongs to the first point clockwise from its hash. Adding a node only
+moves the keys that land on its new points (~1/N of them, all to the new
+node), and many points per node keep shards within a few % of each other.
+
+Hashes are blake2b, so every process (router, tools, tests) agrees on
+ownership regardless of PYTHONHASHSEED.
+"""
+
+import hashlib
+from bisect import bisect_right, insort
+from typing import Dict, Iterable, List, Tuple
+
+DEFAULT_VNODES = 160
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = DEFAULT_VNODES):
+        self.vnodes = vnodes
+        self._points: List[int] = []
+        self._owners: Dict[int, str] = {}
+        self._nodes: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self) -> List[str]:
+        return list(self._nodes)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, node: str) -> bool:
+        return node in self._nodes
+
+    def add(self, node: str):
+        if node in self._nodes:
+            raise ValueError(f"{node} is already on the ring")
+        for i in range(self.vnodes):
+            point = _hash(f"{node}#{i}")
+            # a 64-bit collision is practically impossible; first owner keeps it
+            if point not in self._owners:
+                self._owners[point] = node
+                insort(self._points, point)
+        self._nodes.append(node)
+
+    def remove(self, node: str):
+        self._nodes.remove(node)
+        for point in [p for p, owner in self._owners.items() if owner == node]:
+            del self._owners[point]
+        self._points = sorted(self._owners)
+
+    def copy(self) -> "HashRing":
+        ring = HashRing(vnodes=self.vnodes)
+        ring._points = list(self._points)
+        ring._owners = dict(self._owners)
+        ring._nodes = list(self._nodes)
+        return ring
+
+    def node_for(self, key: str) -> str:
+        if not self._points:
+            raise LookupError("No nodes on the ring")
+        i = bisect_right(self._points, _hash(key))
+        return self._owners[self._points[i % len(self._points)]]
+
+    def partition(self, keys: Iterable[str]) -> Dict[str, List[str]]:
+        """node -> its keys, for nodes owning at least one of `keys`."""
+        parts: Dict[str, List[str]] = {}
+        for key in keys:
+            parts.setdefault(self.node_for(key), []).append(key)
+        return parts
+
+    def moves(self, other: "HashRing", keys: Iterable[str]) -> List[Tuple[str, str, str]]:
+        """(key, owner here, owner in `other`) for every key that changes owner."""
+        moved = []
+        for key in keys:
+            before, after = self.node_for(key), other.node_for(key)
+            if before != after:
+                moved.append((key, before, after))
+        return moved
@@ -0,0 +1,145 @@
+"""
+IdempotencyCache
+----------------
+Remembers the response stored under each Idempotency-Key so a retried
+POST gets the original result back instead of applying the mutation twice.
+
+- bounded LRU + TTL (oldest keys are evicted first)
+- concurrent duplicates wait for the first request and share its result
+- in memory: keys are lost on a restart, like the in-memory state they
+  protect (main.py). Pass path= to also keep an append-only NDJSON log
+  that is replayed on start, for callers whose state survives a restart
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class IdempotencyConflict(ValueError):
+    """Raised when a key is re-used with a different request body."""
+
+
+def fingerprint(payload: Any) -> str:
+    """Stable hash of a JSON-able request body."""
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class IdempotencyCache:
+
+    def __init__(
+        self,
+        max_entries: int = 10_000,
+        ttl_seconds: float = 24 * 3600,
+        path: Optional[str] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+
+        # key -> (expires_at, fingerprint, response)
+        self._entries: "OrderedDict[str, Tuple[float, str, Any]]" = OrderedDict()
+        self._in_flight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._log = None
+        self._log_lines = 0
+
+        if path:
+            self._load()
+
+    def run(self, key: str, request_fingerprint: str, fn: Callable[[], Any]) -> Any:
+        """
+        Returns the stored response for `key`, or runs `fn` once and stores it.
+        If `fn` raises, nothing is stored and waiting duplicates run it themselves.
+        """
+        while True:
+            with self._lock:
+                hit = self._lookup(key)
+                if hit is not None:
+                    if hit[1] != request_fingerprint:
+                        raise IdempotencyConflict(
+                            "Idempotency-Key was already used with a different request body"
+                        )
+                    return hit[2]
+
+                waiter = self._in_flight.get(key)
+                owner = waiter is None
+                if owner:
+                    waiter = threading.Event()
+                    self._in_flight[key] = waiter
+
+            if not owner:
+                waiter.wait()
+                continue
+
+            try:
+                response = fn()
+                with self._lock:
+                    self._put(key, time.time() + self.ttl_seconds, request_fingerprint, response)
+                return response
+            finally:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+                waiter.set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # -------------------------------------------------
+    # Internal helpers (call with self._lock held)
+    # -------------------------------------------------
+    def _lookup(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key: str, expires_at: float, request_fingerprint: str, response: Any, persist: bool = True):
+        self._entries[key] = (expires_at, request_fingerprint, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        if persist and self._log is not None:
+            self._log.write(json.dumps({"k": key, "e": expires_at, "f": request_fingerprint, "r": response}) + "\n")
+            self._log.flush()
+            self._log_lines += 1
+            if self._log_lines > 2 * self.max_entries:
+                self._compact()
+
+    def _load(self):
+        now = time.time()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        # half-written last line from a crash
+                        continue
+                    if row["e"] > now:
+                        self._put(row["k"], row["e"], row["f"], row["r"], persist=False)
+        self._compact()
+
+    def _compact(self):
+        """Rewrite the log with only the live entries, then keep appending to it."""
+        if self._log is not None:
+            self._log.close()
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for key, (expires_at, request_fingerprint, response) in self._entries.items():
+                f.write(json.dumps({"k": key, "e": expires_at, "f": request_fingerprint, "r": response}) + "\n")
+        os.replace(tmp_path, self.path)
+
+        self._log = open(self.path, "a")
+        self._log_lines = len(self._entries)
@@ -0,0 +1,145 @@
+"""
+Metrics
+-------
+Tiny in-process metrics registry exposed at /metrics in Prometheus text format.
+
+- Histogram: log2-bucketed latencies (bucket = duration_ns.bit_length())
+- Counter: monotonically increasing totals
+- timed(stage): decorator recording a function's latency per internal stage
+
+Recording is a couple of perf_counter_ns() calls plus a list increment, so it
+stays well under a microsecond. Increments are not locked: under the GIL an
+update can very rarely be lost in a race, which is fine for monitoring.
+"""
+
+import functools
+import time
+from typing import Callable, Dict, List, Tuple
+
+# Buckets exported to Prometheus: 2^10 ns (~1us) .. 2^36 ns (~69s)
+_EXPORT_MIN_BIT = 10
+_EXPORT_MAX_BIT = 36
+
+_INF_LE = 'le="+Inf"'
+
+_LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    __slots__ = ("counts", "total_ns")
+
+    def __init__(self):
+        self.counts: List[int] = [0] * 65
+        self.total_ns = 0
+
+    def observe_ns(self, ns: int):
+        self.counts[ns.bit_length()] += 1
+        self.total_ns += ns
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+_help: Dict[str, str] = {}
+_histograms: Dict[str, Dict[_LabelKey, Histogram]] = {}
+_counters: Dict[str, Dict[_LabelKey, Counter]] = {}
+
+
+def histogram(name: str, help_text: str = "", **labels: str) -> Histogram:
+    series = _histograms.setdefault(name, {})
+    key = tuple(sorted(labels.items()))
+    hist = series.get(key)
+    if hist is None:
+        hist = series.setdefault(key, Histogram())
+        _help.setdefault(name, help_text)
+    return hist
+
+
+def counter(name: str, help_text: str = "", **labels: str) -> Counter:
+    series = _counters.setdefault(name, {})
+    key = tuple(sorted(labels.items()))
+    count = series.get(key)
+    if count is None:
+        count = series.setdefault(key, Counter())
+        _help.setdefault(name, help_text)
+    return count
+
+
+STAGE_HISTOGRAM = "crosspay_stage_duration_seconds"
+
+
+def timed(stage: str) -> Callable:
+    """
+    Decorator recording the wrapped function's latency under
+    crosspay_stage_duration_seconds{stage="..."}.
+    """
+    hist = histogram(STAGE_HISTOGRAM, "Time spent in internal stages", stage=stage)
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                hist.observe_ns(time.perf_counter_ns() - start)
+        return wrapper
+
+    return decorator
+
+
+# -------------------------------------------------
+# Business counters
+# -------------------------------------------------
+deposits_total = counter("crosspay_deposits_total", "Salary deposits processed")
+deposited_volume = counter("crosspay_deposited_volume_usdc_total", "USDC deposited")
+conversions_total = counter("crosspay_conversions_total", "Conversions from optimised to instant")
+converted_volume = counter("crosspay_converted_volume_usdc_total", "USDC converted from optimised to instant")
+
+
+# -------------------------------------------------
+# Prometheus text exposition
+# -------------------------------------------------
+def _format_labels(key: _LabelKey, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus() -> str:
+    lines: List[str] = []
+
+    for name, series in sorted(_counters.items()):
+        lines.append(f"# HELP {name} {_help.get(name, '')}")
+        lines.append(f"# TYPE {name} counter")
+        for key, count in series.items():
+            lines.append(f"{name}{_format_labels(key)} {count.value}")
+
+    for name, series in sorted(_histograms.items()):
+        lines.append(f"# HELP {name} {_help.get(name, '')}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, hist in list(series.items()):
+            counts = list(hist.counts)
+            cumulative = sum(counts[:_EXPORT_MIN_BIT])
+            for bit in range(_EXPORT_MIN_BIT, _EXPORT_MAX_BIT + 1):
+                cumulative += counts[bit]
+                le = f'le="{(1 << bit) / 1e9:.9g}"'
+                lines.append(f"{name}_bucket{_format_labels(key, le)} {cumulative}")
+            total = sum(counts)
+            lines.append(f"{name}_bucket{_format_labels(key, _INF_LE)} {total}")
+            lines.append(f"{name}_sum{_format_labels(key)} {hist.total_ns / 1e9}")
+            lines.append(f"{name}_count{_format_labels(key)} {total}")
+
+    return "\n".join(lines) + "\n"
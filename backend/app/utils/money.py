@@ -0,0 +1,92 @@
+"""
+Money
+-----
+Fixed-point amounts: every balance is an int number of micro-USDC
+(1 USDC = 1_000_000 micros), the same precision USDC itself uses on-chain.
+
+Rounding rules (applied everywhere, scalar and vectorised):
+- to_micros(): round half to even, from the decimal value the caller sent
+- mul_fraction(): rounds down, so a partial conversion never moves more than
+  is pending; the remainder stays put and is converted at max wait (fraction 1.0)
+- split(): cumulative floor over the weights, the last share takes the rest,
+  so the shares always add up to exactly `amount` and each is within one
+  micro of its exact value
+
+Amounts go back to floats (USDC) only at the edges, in JSON responses.
+"""
+
+from decimal import ROUND_HALF_EVEN, Decimal
+from itertools import accumulate
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+MICROS = 1_000_000
+_FAST_LIMIT = float(2 ** 43)  # ~8.8m USDC
+
+
+def to_micros(amount: float) -> int:
+    # float() first: NumPy scalars repr as "np.float64(...)"
+    amount = float(amount)
+    # Fast path: below 2**43 micros the float product is within 0.002 of the
+    # exact decimal one, so round() agrees with the Decimal path unless the
+    # product sits right next to a .5 tie
+    product = amount * MICROS
+    if -_FAST_LIMIT < product < _FAST_LIMIT:
+        rounded = round(product)
+        if abs(product - rounded) < 0.49:
+            return rounded
+    # repr() gives the shortest decimal that round-trips, e.g. 0.1 -> "0.1"
+    return int((Decimal(repr(amount)) * MICROS).to_integral_value(ROUND_HALF_EVEN))
+
+
+def from_micros(micros: int) -> float:
+    return micros / MICROS
+
+
+def mul_fraction(micros: int, fraction: float) -> int:
+    if fraction >= 1.0:
+        return micros
+    if fraction <= 0.0:
+        return 0
+    return int(micros * fraction)
+
+
+def cumulative(weights: Sequence[float]) -> Tuple[float, ...]:
+    """The running sums split() uses (all but the last), for callers that precompute them."""
+    return tuple(accumulate(weights[:-1]))
+
+
+def split(micros: int, weights: Sequence[float]) -> List[int]:
+    """Split `micros` by normalised `weights`; the result sums to `micros` exactly."""
+    shares = []
+    previous = 0
+    cumulative = 0.0
+    for weight in weights[:-1]:
+        cumulative += weight
+        bound = int(micros * cumulative)
+        if bound > micros:  # weights summing to 1.0000000001
+            bound = micros
+        shares.append(bound - previous)
+        previous = bound
+    shares.append(micros - previous)
+    return shares
+
+
+def mul_fraction_array(micros: np.ndarray, fraction: np.ndarray) -> np.ndarray:
+    """
+    Vectorised mul_fraction() for int64 arrays with fractions in [0, 1].
+    Truncating the float product is exact up to 2**53 micros (~9bn USDC).
+    """
+    return (micros * fraction).astype(np.int64)
+
+
+def split_array(micros: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Vectorised split(): int64 amounts [n] x weights [n, k] -> int64 shares [n, k]."""
+    bounds = (micros[:, None] * np.cumsum(weights[:, :-1], axis=1)).astype(np.int64)
+    np.minimum(bounds, micros[:, None], out=bounds)
+    shares = np.empty(weights.shape, dtype=np.int64)
+    shares[:, 0] = bounds[:, 0]
+    shares[:, 1:-1] = np.diff(bounds, axis=1)
+    shares[:, -1] = micros - bounds[:, -1]
+    return shares
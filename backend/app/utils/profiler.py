@@ -0,0 +1,101 @@
+"""
+SamplingProfiler
+----------------
+On-demand stack sampler over all threads, for when the backend is slow in
+production and we can't attach a real profiler.
+
+- nothing runs until profile() is called (zero overhead by default)
+- one session at a time (a second caller gets ProfilerBusy)
+- output is collapsed stacks ("thread;frame;frame count"), ready for
+  flamegraph.pl / speedscope
+
+Our own frames are labelled by their path inside the backend
+("app/services/routing_service.py:optimisation_tick"), so `grep app/`
+or only_app=True keeps just the stacks that touch our code.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # .../backend/app
+MAX_SECONDS = 60.0
+# shorter intervals turn the sampler into a busy loop holding the GIL
+MIN_INTERVAL = 0.001
+
+
+class ProfilerBusy(RuntimeError):
+    """Raised when a profiling session is already running."""
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    if filename.startswith(APP_ROOT):
+        rel = "app" + filename[len(APP_ROOT):].replace(os.sep, "/")
+        return f"{rel}:{code.co_name}"
+    return f"{os.path.basename(filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+
+    def __init__(self):
+        self._session = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._session.locked()
+
+    def profile(self, seconds: float, interval: float = 0.005, only_app: bool = False) -> Dict[str, int]:
+        """
+        Samples every thread's stack each `interval` seconds (at least
+        MIN_INTERVAL) for `seconds`. Returns {collapsed_stack: samples}.
+        """
+        if not self._session.acquire(blocking=False):
+            raise ProfilerBusy("A profiling session is already running")
+
+        try:
+            seconds = min(max(seconds, 0.0), MAX_SECONDS)
+            if not interval >= MIN_INTERVAL:  # also catches NaN
+                interval = MIN_INTERVAL
+            own_thread = threading.get_ident()
+            stacks: Counter = Counter()
+            labels: Dict[object, str] = {}  # code object -> label, avoids re-formatting
+
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_thread:
+                        continue
+
+                    parts = []
+                    while frame is not None:
+                        code = frame.f_code
+                        label = labels.get(code)
+                        if label is None:
+                            label = labels[code] = _frame_label(code)
+                        parts.append(label)
+                        frame = frame.f_back
+
+                    parts.append(names.get(thread_id, f"thread-{thread_id}"))
+                    parts.reverse()
+                    stacks[";".join(parts)] += 1
+
+                time.sleep(interval)
+
+            if only_app:
+                return {stack: n for stack, n in stacks.items() if ";app/" in stack}
+            return dict(stacks)
+        finally:
+            self._session.release()
+
+
+def to_collapsed(stacks: Dict[str, int]) -> str:
+    """Renders {stack: samples} in the collapsed format flamegraph tools read."""
+    return "".join(f"{stack} {n}\n" for stack, n in sorted(stacks.items()))
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,121 @@
+"""
+SkipList
+--------
+Sorted set of comparable keys with O(log n) expected insert / remove /
+seek, for indexes that change on every mutation (a sorted Python list
+would memmove O(n) per insert).
+
+Keys are usually (sort_value, id) tuples, so equal sort values stay
+distinct and removal finds the exact entry.
+"""
+
+import random
+from typing import Any, Iterator, List, Optional
+
+MAX_LEVEL = 32
+P = 0.25  # chance of promoting a node one level up
+
+
+class _Node:
+    __slots__ = ("key", "next")
+
+    def __init__(self, key: Any, level: int):
+        self.key = key
+        self.next: List[Optional["_Node"]] = [None] * level
+
+
+class SkipList:
+
+    def __init__(self, seed: Optional[int] = None):
+        self._head = _Node(None, MAX_LEVEL)
+        self._level = 1
+        self._size = 0
+        self._random = random.Random(seed).random
+
+    @classmethod
+    def from_sorted(cls, keys, seed: Optional[int] = None) -> "SkipList":
+        """Bulk load from keys in ascending order (no duplicates), in O(n)."""
+        skiplist = cls(seed)
+        tails = [skiplist._head] * MAX_LEVEL
+        for key in keys:
+            level = skiplist._random_level()
+            node = _Node(key, level)
+            for i in range(level):
+                tails[i].next[i] = node
+                tails[i] = node
+            if level > skiplist._level:
+                skiplist._level = level
+            skiplist._size += 1
+        return skiplist
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < MAX_LEVEL and self._random() < P:
+            level += 1
+        return level
+
+    def _predecessors(self, key: Any) -> List[_Node]:
+        """Per level, the last node with node.key < key."""
+        update = [self._head] * MAX_LEVEL
+        node = self._head
+        for i in reversed(range(self._level)):
+            nxt = node.next[i]
+            while nxt is not None and nxt.key < key:
+                node, nxt = nxt, nxt.next[i]
+            update[i] = node
+        return update
+
+    def add(self, key: Any) -> bool:
+        """Insert `key`; False if it is already present."""
+        update = self._predecessors(key)
+        nxt = update[0].next[0]
+        if nxt is not None and nxt.key == key:
+            return False
+
+        level = self._random_level()
+        if level > self._level:
+            self._level = level
+        node = _Node(key, level)
+        for i in range(level):
+            node.next[i] = update[i].next[i]
+            update[i].next[i] = node
+        self._size += 1
+        return True
+
+    def discard(self, key: Any) -> bool:
+        """Remove `key`; False if it wasn't present."""
+        update = self._predecessors(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            return False
+
+        for i in range(len(node.next)):
+            update[i].next[i] = node.next[i]
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+        self._size -= 1
+        return True
+
+    def __contains__(self, key: Any) -> bool:
+        node = self._predecessors(key)[0].next[0]
+        return node is not None and node.key == key
+
+    def iter_from(self, key: Any = None) -> Iterator[Any]:
+        """
+        Keys >= `key` (all keys when None), ascending. The list must not be
+        modified while iterating; collect first when mutating.
+        """
+        node = self._head.next[0] if key is None else self._predecessors(key)[0].next[0]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+    def __iter__(self) -> Iterator[Any]:
+        return self.iter_from()
+
+    def first(self) -> Optional[Any]:
+        node = self._head.next[0]
+        return None if node is None else node.key
@@ -0,0 +1,66 @@
+"""
+Versioned
+---------
+Copy-on-write holder for immutable settings snapshots.
+
+Readers call current() and get one (version, updated_at, value) tuple: a
+single attribute read, so no lock, and every field they look at comes from
+the same snapshot. Writers build a new value from the current one and swap
+it in under a writer-only lock, bumping the version. The last few replaced
+snapshots are kept for audit.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Generic, List, NamedTuple, TypeVar
+
+T = TypeVar("T")
+
+DEFAULT_HISTORY = 20
+
+
+class Snapshot(NamedTuple):
+    version: int
+    updated_at: float
+    value: Any
+
+
+class Versioned(Generic[T]):
+
+    def __init__(self, value: T, history: int = DEFAULT_HISTORY):
+        self._current = Snapshot(1, time.time(), value)
+        self._history: deque = deque(maxlen=history)
+        self._write_lock = threading.Lock()
+
+    def current(self) -> Snapshot:
+        return self._current
+
+    @property
+    def value(self) -> T:
+        return self._current.value
+
+    def update(self, fn: Callable[[T], T]) -> Snapshot:
+        """
+        Swap in fn(current value). Exceptions from `fn` leave the current
+        snapshot in place; returning the same object is a no-op (no new
+        version).
+        """
+        with self._write_lock:
+            current = self._current
+            value = fn(current.value)
+            if value is current.value:
+                return current
+            self._history.append(current)
+            self._current = Snapshot(current.version + 1, time.time(), value)
+            return self._current
+
+    def history(self) -> List[Snapshot]:
+        """Retained snapshots, oldest first, ending with the current one."""
+        with self._write_lock:
+            return [*self._history, self._current]
+
+
+def describe(snapshot: Snapshot, to_dict: Callable[[Any], Dict]) -> Dict:
+    """JSON-friendly snapshot."""
+    return {"version": snapshot.version, "updatedAt": snapshot.updated_at, **to_dict(snapshot.value)}
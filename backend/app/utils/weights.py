@@ -0,0 +1,61 @@
+"""
+Bucket weights
+--------------
+Allocation weights (rent / savings / investing / emergency / ...) as
+validated, pre-normalised vectors, so conversions just read them instead of
+re-normalising on every call.
+
+BucketWeights holds one user's named weights, normalised once at
+construction; it is immutable, so users with the same allocation can share
+one instance.
+"""
+
+import math
+from typing import Dict, Mapping, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = ("rent", "savings", "investing")
+DEFAULT_WEIGHTS = (0.5, 0.3, 0.2)
+
+
+class BucketWeights:
+    """Immutable named weights that sum to 1.0."""
+
+    __slots__ = ("names", "weights")
+
+    def __init__(self, names: Sequence[str], weights: Sequence[float], fallback: Optional[Sequence[float]] = None):
+        """
+        Negative / non-finite weights are rejected. Weights summing to 0 use
+        `fallback` (e.g. the defaults) when given, else raise ValueError.
+        """
+        if len(names) != len(weights) or not names:
+            raise ValueError("Need one weight per bucket")
+        if len(set(names)) != len(names):
+            raise ValueError("Duplicate bucket names")
+        if any(not math.isfinite(w) or w < 0 for w in weights):
+            raise ValueError("Weights must be finite and non-negative")
+
+        total = math.fsum(weights)
+        if total <= 0:
+            if fallback is None:
+                raise ValueError("Weights must not all be zero")
+            weights, total = fallback, math.fsum(fallback)
+
+        self.names: Tuple[str, ...] = tuple(names)
+        self.weights: Tuple[float, ...] = tuple(w / total for w in weights)
+
+    @classmethod
+    def from_dict(cls, weights: Mapping[str, float], tolerance: Optional[float] = None) -> "BucketWeights":
+        """`tolerance`: also require the raw weights to sum to 1.0 within it."""
+        if tolerance is not None and abs(math.fsum(weights.values()) - 1.0) > tolerance:
+            raise ValueError("Allocations must sum to 1.0")
+        return cls(list(weights), list(weights.values()))
+
+    def as_dict(self) -> Dict[str, float]:
+        return dict(zip(self.names, self.weights))
+
+    def __eq__(self, other):
+        return isinstance(other, BucketWeights) and (self.names, self.weights) == (other.names, other.weights)
+
+    def __repr__(self):
+        return f"BucketWeights({self.as_dict()})"
+
@@ -0,0 +1,97 @@
+"""
+Storage engine matrix: every engine in app/state/conformance.ENGINES on
+the same workloads, over 10k stored users. Registered as
+engine.<engine>.<workload> for benchmarks.run; run this module directly
+for an engines x workloads table of ops/sec:
+
+    cd backend
+    python -m benchmarks.bench_engines
+"""
+
+import argparse
+import functools
+import sys
+import tempfile
+
+from app.state.conformance import ENGINES
+from app.state.engines import INDEXED_FIELDS, StorageEngine, to_record
+from app.state.user_state import new_user
+
+from .harness import benchmark, measure
+
+USERS = 10_000
+BATCH = 1_000
+
+
+@functools.lru_cache(maxsize=None)
+def _engine(name: str) -> StorageEngine:
+    open_engine, _ = ENGINES[name]
+    engine = open_engine(tempfile.mkdtemp(prefix=f"crosspay-bench-{name}-"))
+    record = to_record(new_user())
+    engine.put_many([(f"user-{i}", {**record, "pending": i}) for i in range(USERS)])
+    return engine
+
+
+def _deposit(current):
+    return {**current, "instant_bucket": current["instant_bucket"] + 1}
+
+
+def get(name: str, n: int):
+    engine = _engine(name)
+    for i in range(n):
+        engine.get(f"user-{i % USERS}")
+
+
+def mutate(name: str, n: int):
+    engine = _engine(name)
+    for i in range(n):
+        engine.mutate(f"user-{i % USERS}", _deposit)
+
+
+def batch_mutate(name: str, n: int):
+    # ops = mutations, applied BATCH at a time
+    engine = _engine(name)
+    for start in range(0, n, BATCH):
+        engine.batch_mutate([(f"user-{i % USERS}", _deposit) for i in range(start, min(n, start + BATCH))])
+
+
+def scan_indexed_10k(name: str, n: int):
+    # ops = full scans of the indexed fields, what a store does at startup
+    engine = _engine(name)
+    for _ in range(n):
+        for _ in engine.scan(INDEXED_FIELDS):
+            pass
+
+
+def snapshot_10k(name: str, n: int):
+    # ops = snapshots taken and read once end to end
+    engine = _engine(name)
+    for _ in range(n):
+        view = engine.snapshot()
+        for _ in view.scan(("pending",)):
+            pass
+        view.close()
+
+
+WORKLOADS = {fn.__name__: fn for fn in (get, mutate, batch_mutate, scan_indexed_10k, snapshot_10k)}
+
+for _name in ENGINES:
+    for _workload, _fn in WORKLOADS.items():
+        benchmark(f"engine.{_name}.{_workload}")(functools.partial(_fn, _name))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="ops/sec per storage engine per workload")
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'ops/sec':12s}" + "".join(f"{workload:>18s}" for workload in WORKLOADS))
+    for name in ENGINES:
+        cells = [measure(functools.partial(fn, name), args.min_time, args.repeats) for fn in WORKLOADS.values()]
+        print(f"{name:12s}" + "".join(f"{ops:18,.1f}" for ops in cells))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
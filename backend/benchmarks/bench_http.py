@@ -0,0 +1,49 @@
+"""
+End-to-end ASGI benchmarks: full FastAPI routes (middleware, validation,
+serialisation) driven in-process through httpx.ASGITransport, no network.
+"""
+
+import asyncio
+
+import httpx
+
+# Circle credentials and the data dir are set by run.py before any app import
+from app.main import app
+
+from .harness import benchmark
+
+
+def _run(n: int, method: str, path: str, **kwargs):
+    async def go():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for _ in range(n):
+                resp = await client.request(method, path, **kwargs)
+                if resp.status_code != 200:
+                    raise RuntimeError(f"{method} {path} -> {resp.status_code}: {resp.text}")
+    asyncio.run(go())
+
+
+@benchmark("http.get_state")
+def bench_get_state(n: int):
+    _run(n, "GET", "/api/state")
+
+
+@benchmark("http.deposit")
+def bench_deposit(n: int):
+    _run(n, "POST", "/api/salary/deposit", json={"amount": 1000.0, "fx_rate_at_deposit": 1.0})
+
+
+@benchmark("http.optimise")
+def bench_optimise(n: int):
+    _run(n, "POST", "/api/optimise", json={"market_condition": "GOOD", "current_fx_rate": 1.02})
+
+
+@benchmark("http.override")
+def bench_override(n: int):
+    _run(n, "POST", "/api/override")
+
+
+@benchmark("http.metrics")
+def bench_metrics(n: int):
+    _run(n, "GET", "/metrics")
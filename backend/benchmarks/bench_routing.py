@@ -0,0 +1,139 @@
+"""
+Scalar benchmarks for app/services/routing_service.py.
+Each op runs against a single in-memory UserState, the same way main.py does.
+"""
+
+import functools
+
+from app.services.pair_routing import PairRouter
+from app.state.optimisation import OptimisationService
+from app.state.user_state import userStateScore
+from app.services.routing_service import (
+    MarketCondition,
+    UserSettings,
+    UserState,
+    allocate_salary,
+    optimisation_tick,
+    override_convert_now,
+    state_to_dict,
+)
+from app.utils.hash_ring import HashRing
+from app.utils.money import to_micros
+
+from .harness import benchmark
+
+PENDING = to_micros(600.0)
+
+
+def _fresh():
+    settings = UserSettings(instant_percent=0.4, max_wait_seconds=24 * 3600)
+    state = UserState()
+    allocate_salary(amount=1000.0, settings=settings, state=state, fx_rate_at_deposit=1.0)
+    return settings, state
+
+
+@benchmark("routing.allocate_salary")
+def bench_allocate_salary(n: int):
+    settings, state = _fresh()
+    for _ in range(n):
+        allocate_salary(amount=1000.0, settings=settings, state=state, fx_rate_at_deposit=1.01)
+
+
+@benchmark("routing.optimisation_tick")
+def bench_optimisation_tick(n: int):
+    settings, state = _fresh()
+    for _ in range(n):
+        # top up so every tick takes the converting path
+        state.optimised_pending = PENDING
+        optimisation_tick(settings=settings, state=state, market_condition=MarketCondition.GOOD, current_fx_rate=1.02)
+
+
+@benchmark("routing.override_convert_now")
+def bench_override_convert_now(n: int):
+    settings, state = _fresh()
+    for _ in range(n):
+        state.optimised_pending = PENDING
+        override_convert_now(settings=settings, state=state, current_fx_rate=1.01)
+
+
+@functools.lru_cache(maxsize=None)
+def _rows(users: int):
+    return [_fresh() for _ in range(users)]
+
+
+@benchmark("routing.optimisation_tick_100k_rows")
+def bench_optimisation_tick_rows(n: int):
+    # one tick per user row, walking the rows like a multi-user store would
+    rows = _rows(100_000)
+    for i in range(n):
+        settings, state = rows[i % len(rows)]
+        state.optimised_pending = PENDING
+        optimisation_tick(settings=settings, state=state, market_condition=MarketCondition.OK, current_fx_rate=1.02)
+
+
+@benchmark("routing.state_to_dict")
+def bench_state_to_dict(n: int):
+    _, state = _fresh()
+    for _ in range(n):
+        state_to_dict(state)
+
+
+@functools.lru_cache(maxsize=None)
+def _pair_router(users: int) -> PairRouter:
+    router = PairRouter()
+    for i in range(users):
+        router.allocate_salary(f"user-{i}", "USDC/BRL", amount=1000.0, fx_rate_at_deposit=5.0, now=0.0)
+    return router
+
+
+@benchmark("pair_routing.optimisation_tick_10k_users")
+def bench_pair_tick(n: int):
+    router = _pair_router(10_000)
+    for _ in range(n):
+        router.optimisation_tick("USDC/BRL", MarketCondition.OK, current_fx_rate=5.05, now=60.0)
+
+
+@benchmark("pair_routing.bulk_status_10k_users")
+def bench_pair_bulk_status(n: int):
+    router = _pair_router(10_000)
+    for _ in range(n):
+        for _ in router.bulk_status(min_pending=0.0, now=60.0):
+            pass
+
+
+@benchmark("hash_ring.partition_10k_users_8_shards")
+def bench_ring_partition(n: int):
+    ring = HashRing(f"http://127.0.0.1:{8001 + i}" for i in range(8))
+    user_ids = [f"user-{i}" for i in range(10_000)]
+    for _ in range(n):
+        ring.partition(user_ids)
+
+
+@benchmark("pair_routing.handoff_1k_users")
+def bench_pair_handoff(n: int):
+    # export from one shard, import into a new one, drop (from the new one,
+    # so the shared router isn't changed for the other benchmarks)
+    source = _pair_router(10_000)
+    user_ids = [f"user-{i}" for i in range(1_000)]
+    for _ in range(n):
+        target = PairRouter()
+        target.import_users(source.export_users(user_ids))
+        target.drop_users(user_ids)
+
+
+@functools.lru_cache(maxsize=None)
+def _indexed_store(users: int) -> userStateScore:
+    # 1 user in 100 has a 1h max wait, the rest wait a day
+    store = userStateScore()
+    for i in range(users):
+        store.update_settings(f"user-{i}", {"max_wait_time": 1 if i % 100 == 0 else 24})
+        store.apply_salary_split(f"user-{i}", 1000.0)
+    return store
+
+
+@benchmark("state.statuses_due_within_1h_100k_users")
+def bench_statuses_due(n: int):
+    service = OptimisationService(_indexed_store(100_000))
+    for _ in range(n):
+        for _ in service.get_statuses(deadline_within=3600):
+            pass
@@ -0,0 +1,180 @@
+"""
+User store benchmarks: the in-memory userStateScore vs SQLiteUserState
+(write-back cache + WAL file) on the same workloads, driven through the
+app/state services, plus TieredUserState hits vs faults, payroll
+imports and exports.
+"""
+
+import contextlib
+import functools
+import io
+import os
+import tempfile
+
+from app.state.export import export
+from app.state.payroll import PayrollImport, checkpoint_path
+from app.state.salary import SalaryService
+from app.state.sqlite_store import SQLiteEngine, SQLiteUserState
+from app.state.tiered_state import TieredUserState
+from app.state.user_state import userStateScore
+from app.state.withdraw import WithdrawService
+
+from .harness import benchmark
+
+USERS = 10_000
+
+
+def _sqlite_store() -> SQLiteUserState:
+    directory = tempfile.mkdtemp(prefix="crosspay-bench-store-")
+    return SQLiteUserState(os.path.join(directory, "users.sqlite3"))
+
+
+def _deposits(store, n: int):
+    salary = SalaryService(store)
+    for i in range(n):
+        salary.deposit_salary(f"user-{i % USERS}", 1000.0)
+
+
+@benchmark("store.memory.deposit")
+def bench_memory_deposit(n: int):
+    _deposits(userStateScore(), n)
+
+
+@benchmark("store.sqlite.deposit_batched")
+def bench_sqlite_deposit(n: int):
+    # one batch = one transaction at the end
+    store = _sqlite_store()
+    with store.batch():
+        _deposits(store, n)
+    store.close()
+
+
+@benchmark("store.sqlite.deposit_flush_each")
+def bench_sqlite_deposit_flush_each(n: int):
+    # worst case: a transaction per write
+    store = _sqlite_store()
+    salary = SalaryService(store)
+    for i in range(n):
+        salary.deposit_salary(f"user-{i % USERS}", 1000.0)
+        store.flush()
+    store.close()
+
+
+@functools.lru_cache(maxsize=None)
+def _funded(kind: str):
+    # 10k users x 1M USDC: every payout in every run is affordable
+    store = userStateScore() if kind == "memory" else _sqlite_store()
+    with store.batch() if kind == "sqlite" else contextlib.nullcontext():
+        salary = SalaryService(store)
+        for i in range(USERS):
+            salary.deposit_salary(f"user-{i}", 1_000_000.0)
+    return store
+
+
+def _withdrawals(store, n: int):
+    payouts = [(f"user-{i % USERS}", 0.01) for i in range(n)]
+    WithdrawService(store).withdraw_batch(payouts)
+
+
+@benchmark("store.memory.withdraw_batch")
+def bench_memory_withdraw(n: int):
+    _withdrawals(_funded("memory"), n)
+
+
+@benchmark("store.sqlite.withdraw_batch")
+def bench_sqlite_withdraw(n: int):
+    store = _funded("sqlite")
+    with store.batch():
+        _withdrawals(store, n)
+
+
+@benchmark("store.memory.withdraw_batch_10k_payouts")
+def bench_memory_withdraw_10k(n: int):
+    # one op = one POST /withdraw/batch of 10k payouts
+    service = WithdrawService(_funded("memory"))
+    payouts = [(f"user-{i}", 0.01) for i in range(USERS)]
+    for _ in range(n):
+        service.withdraw_batch(payouts)
+
+
+@benchmark("store.sqlite.open_10k_users")
+def bench_sqlite_open(n: int):
+    # startup reads only the indexed columns of every row
+    path = _funded("sqlite").path
+    for _ in range(n):
+        SQLiteUserState(path).close()
+
+
+@benchmark("store.sqlite.cold_load")
+def bench_sqlite_cold_load(n: int):
+    # first access to a user that isn't in memory: one row fetch + decode
+    store = _funded("sqlite")
+    for i in range(n):
+        store._load(f"user-{i % USERS}")
+
+
+HOT_USERS = 1_000
+
+
+@functools.lru_cache(maxsize=None)
+def _tiered() -> TieredUserState:
+    # 10k stored users, room for 1k in memory
+    store = _sqlite_store()
+    with store.batch():
+        _deposits(store, USERS)
+    store.close()
+    return TieredUserState(SQLiteEngine(store.path), max_hot_users=HOT_USERS)
+
+
+@benchmark("store.tiered.hit")
+def bench_tiered_hit(n: int):
+    store = _tiered()
+    for i in range(n):
+        store.find(f"user-{i % (HOT_USERS // 2)}")
+
+
+@benchmark("store.tiered.fault_evict")
+def bench_tiered_fault(n: int):
+    # cycling through 10x the ceiling: every lookup faults in, LRU users get evicted
+    store = _tiered()
+    for i in range(n):
+        store.find(f"user-{i % USERS}")
+
+
+@functools.lru_cache(maxsize=None)
+def _payroll_csv(rows: int) -> str:
+    lines = ["user_id,amount,payment_id"]
+    lines += [f"user-{i % USERS},{1000 + i % 500}.25,p{i}" for i in range(rows)]
+    return "\n".join(lines) + "\n"
+
+
+@benchmark("store.memory.payroll_import_100k_rows")
+def bench_payroll_import(n: int):
+    # ops = whole 100k-row files (10k users) into a new store
+    text = _payroll_csv(100_000)
+    for _ in range(n):
+        PayrollImport("bench", SalaryService(userStateScore())).run(io.StringIO(text), "csv")
+        os.remove(checkpoint_path("bench"))
+
+
+def _export(kind: str, fmt: str, n: int):
+    store = _funded(kind)
+    for _ in range(n):
+        for _ in export(store, fmt):
+            pass
+
+
+@benchmark("store.memory.export_ndjson_10k_users")
+def bench_memory_export_ndjson(n: int):
+    # ops = whole exports of the 10k funded users
+    _export("memory", "ndjson", n)
+
+
+@benchmark("store.memory.export_columnar_10k_users")
+def bench_memory_export_columnar(n: int):
+    _export("memory", "columnar", n)
+
+
+@benchmark("store.sqlite.export_ndjson_10k_users")
+def bench_sqlite_export_ndjson(n: int):
+    _export("sqlite", "ndjson", n)
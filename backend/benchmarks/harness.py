@@ -0,0 +1,96 @@
+"""
+Benchmark harness
+-----------------
+- benchmark(name): registers a function `fn(n)` that performs n operations
+- run_all(): one untimed warm-up call (fixture setup, caches), then
+  calibrates n so each run lasts at least `min_time`, keeps the best of
+  `repeats` runs and reports ops/sec
+- baselines are stored as JSON; compare() flags anything slower than
+  (1 - threshold) * baseline ops/sec
+"""
+
+import json
+import platform
+import time
+from typing import Callable, Dict, List, Optional
+
+_registry: Dict[str, Callable[[int], None]] = {}
+
+
+def benchmark(name: str):
+    def decorator(fn: Callable[[int], None]):
+        _registry[name] = fn
+        return fn
+    return decorator
+
+
+def measure(fn: Callable[[int], None], min_time: float = 0.2, repeats: int = 3) -> float:
+    """Returns the best ops/sec over `repeats` runs of at least `min_time` seconds."""
+    # untimed: a fixture built on first use would otherwise end calibration at n=1
+    fn(1)
+    n = 1
+    while True:
+        start = time.perf_counter()
+        fn(n)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        n = max(n * 2, int(n * min_time / max(elapsed, 1e-9) * 1.2))
+
+    best = n / elapsed
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        fn(n)
+        best = max(best, n / (time.perf_counter() - start))
+    return best
+
+
+def run_all(prefixes: Optional[List[str]] = None, min_time: float = 0.2, repeats: int = 3) -> Dict[str, float]:
+    results = {}
+    for name, fn in _registry.items():
+        if prefixes and not name.startswith(tuple(prefixes)):
+            continue
+        results[name] = measure(fn, min_time=min_time, repeats=repeats)
+        print(f"{name:45s} {results[name]:>14,.0f} ops/s")
+    return results
+
+
+def machine_info() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+    }
+
+
+def load_baseline(path: str) -> Dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"machine": {}, "results": {}}
+
+
+def save_baseline(path: str, results: Dict[str, float]):
+    baseline = load_baseline(path)
+    baseline["machine"] = machine_info()
+    baseline["results"].update({name: round(ops, 1) for name, ops in results.items()})
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(results: Dict[str, float], baseline: Dict, threshold: float) -> List[str]:
+    """Returns a description of every benchmark that regressed beyond `threshold`."""
+    regressions = []
+    for name, ops in results.items():
+        expected = baseline["results"].get(name)
+        if expected is None:
+            continue
+        change = ops / expected - 1.0
+        marker = "REGRESSION" if change < -threshold else "ok"
+        print(f"{name:45s} {change:+7.1%} vs baseline {expected:,.0f} ops/s  {marker}")
+        if change < -threshold:
+            regressions.append(f"{name}: {ops:,.0f} ops/s vs {expected:,.0f} ({change:+.1%})")
+    return regressions
@@ -0,0 +1,204 @@
+"""
+Payroll-day load generator
+--------------------------
+Simulates a compressed payroll day against the backend:
+
+- N users whose salaries land staggered across the first part of the day
+  (some of them changing their settings with the deposit)
+- frequent /api/optimise ticks
+- occasional bursts of /api/override ("convert everything now")
+- dashboards polling /api/state
+
+Arrivals are open-loop (Poisson): requests fire on schedule whether or not
+earlier ones finished, and latency is measured from the scheduled time, so
+a saturated server shows up as growing latency instead of hidden back-off.
+
+    cd backend
+    python -m benchmarks.loadgen --users 500 --duration 30            # in-process (ASGI)
+    python -m benchmarks.loadgen --url http://127.0.0.1:8000 --json   # against uvicorn
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import httpx
+
+# (offset seconds, operation name, method, path, request kwargs)
+Event = Tuple[float, str, str, str, dict]
+
+
+def _poisson_times(rate: float, duration: float, rng: random.Random, start: float = 0.0) -> List[float]:
+    times, t = [], start
+    if rate <= 0:
+        return times
+    while True:
+        t += rng.expovariate(rate)
+        if t >= duration:
+            return times
+        times.append(t)
+
+
+def build_schedule(args, rng: random.Random) -> List[Event]:
+    duration = args.duration
+    users = [f"user-{i}" for i in range(args.users)]
+    events: List[Event] = []
+
+    def user_kwargs(user_id: str, **extra) -> dict:
+        return {"params": {"user_id": user_id}, "headers": {"X-User-Id": user_id}, **extra}
+
+    # Staggered salaries over the first `deposit_window` of the day
+    for user_id in users:
+        t = rng.uniform(0, duration * args.deposit_window)
+        body = {"amount": round(rng.lognormvariate(8.0, 0.5), 2), "fx_rate_at_deposit": round(rng.uniform(0.95, 1.05), 4)}
+        if rng.random() < args.settings_change_prob:
+            body["instant_percent"] = round(rng.uniform(0.1, 0.9), 2)
+            body["max_wait_seconds"] = rng.choice([3600, 6 * 3600, 24 * 3600])
+        events.append((t, "deposit", "POST", "/api/salary/deposit", user_kwargs(user_id, json=body)))
+
+    for t in _poisson_times(args.tick_rate, duration, rng):
+        body = {"market_condition": rng.choice(["GOOD", "OK", "OK", "BAD"]), "current_fx_rate": round(rng.uniform(0.95, 1.05), 4)}
+        events.append((t, "optimise", "POST", "/api/optimise", user_kwargs(rng.choice(users), json=body)))
+
+    for t in _poisson_times(args.poll_rate, duration, rng):
+        events.append((t, "state", "GET", "/api/state", user_kwargs(rng.choice(users))))
+
+    # Override bursts: many users hitting "convert now" within a second
+    for burst_start in _poisson_times(args.burst_rate, duration, rng):
+        for _ in range(args.burst_size):
+            t = burst_start + rng.uniform(0, 1.0)
+            if t < duration:
+                events.append((t, "override", "POST", "/api/override", user_kwargs(rng.choice(users))))
+
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def summarise(latencies: Dict[str, List[float]], errors: Dict[str, int], dropped: int, elapsed: float) -> Dict:
+    report = {"elapsed_seconds": round(elapsed, 3), "dropped": dropped, "operations": {}}
+    all_latencies: List[float] = []
+
+    for op in sorted(set(latencies) | set(errors)):
+        values = sorted(latencies.get(op, []))
+        all_latencies.extend(values)
+        report["operations"][op] = _stats(values, errors.get(op, 0), elapsed)
+
+    report["total"] = _stats(sorted(all_latencies), sum(errors.values()), elapsed)
+    return report
+
+
+def _stats(values: List[float], errors: int, elapsed: float) -> Dict:
+    return {
+        "ok": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(_percentile(values, 50) * 1000, 2),
+        "p90_ms": round(_percentile(values, 90) * 1000, 2),
+        "p99_ms": round(_percentile(values, 99) * 1000, 2),
+        "max_ms": round((values[-1] if values else 0.0) * 1000, 2),
+    }
+
+
+async def run(args) -> Dict:
+    rng = random.Random(args.seed)
+    schedule = build_schedule(args, rng)
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    else:
+        os.environ.setdefault("CIRCLE_API_KEY", "loadgen")
+        os.environ.setdefault("ENTITY_SECRET", "loadgen")
+        os.environ.setdefault("CROSSPAY_DATA_DIR", tempfile.mkdtemp(prefix="crosspay-loadgen-"))
+        from app.main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadgen", timeout=args.timeout)
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    in_flight = set()
+    dropped = 0
+
+    async def fire(op: str, method: str, path: str, kwargs: dict, scheduled_at: float):
+        try:
+            resp = await client.request(method, path, **kwargs)
+            ok = resp.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            latencies[op].append(time.perf_counter() - scheduled_at)
+        else:
+            errors[op] += 1
+
+    async with client:
+        start = time.perf_counter()
+        for offset, op, method, path, kwargs in schedule:
+            scheduled_at = start + offset
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if len(in_flight) >= args.max_in_flight:
+                dropped += 1
+                continue
+            task = asyncio.create_task(fire(op, method, path, kwargs, scheduled_at))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+        if in_flight:
+            await asyncio.wait(in_flight)
+        elapsed = time.perf_counter() - start
+
+    return summarise(latencies, errors, dropped, elapsed)
+
+
+def print_report(report: Dict):
+    print(f"elapsed {report['elapsed_seconds']}s, dropped (client in-flight cap) {report['dropped']}")
+    print(f"{'operation':10s} {'ok':>8s} {'errors':>7s} {'rps':>9s} {'p50 ms':>9s} {'p90 ms':>9s} {'p99 ms':>9s} {'max ms':>9s}")
+    rows = list(report["operations"].items()) + [("TOTAL", report["total"])]
+    for op, s in rows:
+        print(
+            f"{op:10s} {s['ok']:>8d} {s['errors']:>7d} {s['throughput_rps']:>9.1f} "
+            f"{s['p50_ms']:>9.2f} {s['p90_ms']:>9.2f} {s['p99_ms']:>9.2f} {s['max_ms']:>9.2f}"
+        )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Simulate a payroll day against the CrossPay backend")
+    parser.add_argument("--url", help="base URL of a running server; default runs the app in-process")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=20.0, help="length of the simulated day in seconds")
+    parser.add_argument("--deposit-window", type=float, default=0.3, help="fraction of the day over which salaries land")
+    parser.add_argument("--settings-change-prob", type=float, default=0.2)
+    parser.add_argument("--tick-rate", type=float, default=50.0, help="/api/optimise requests per second")
+    parser.add_argument("--poll-rate", type=float, default=100.0, help="/api/state requests per second")
+    parser.add_argument("--burst-rate", type=float, default=0.2, help="override bursts per second")
+    parser.add_argument("--burst-size", type=int, default=50)
+    parser.add_argument("--max-in-flight", type=int, default=10_000)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+Per-user memory and tick cost
+-----------------------------
+Builds one (UserSettings, UserState) row per user, the way a multi-user
+in-memory store would, and reports:
+
+- bytes per user and MB per million users (tracemalloc) after one deposit;
+  tranche ledgers, created on a user's first conversion, are not included
+- the cost of one optimisation_tick per user, walking every row (after a
+  warm-up pass, so ledger creation isn't what gets timed)
+
+for the slotted dataclasses in routing_service and for the same fields in
+plain dict-backed dataclasses, so the __slots__ saving stays visible.
+
+    cd backend
+    python -m benchmarks.memory                   # 200k users, scaled to 1M
+    python -m benchmarks.memory --users 1000000 --json
+"""
+
+import argparse
+import dataclasses
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Dict
+
+from app.services.routing_service import (
+    MarketCondition,
+    UserSettings,
+    UserState,
+    allocate_salary,
+    optimisation_tick,
+)
+
+
+def _without_slots(cls):
+    """Same fields and methods as `cls`, but with a per-instance __dict__."""
+    fields = [(f.name, f.type, dataclasses.field(default=f.default, init=f.init)) for f in dataclasses.fields(cls)]
+    namespace = {
+        name: value
+        for name, value in vars(cls).items()
+        if callable(value) and (not name.startswith("__") or name == "__post_init__")
+    }
+    frozen = cls.__dataclass_params__.frozen
+    return dataclasses.make_dataclass(f"Dict{cls.__name__}", fields, namespace=namespace, frozen=frozen)
+
+
+def _build(users: int, settings_cls, state_cls):
+    rows = []
+    for i in range(users):
+        settings = settings_cls(instant_percent=0.4, max_wait_seconds=24 * 3600)
+        state = state_cls()
+        allocate_salary(amount=1000.0 + i % 500, settings=settings, state=state, fx_rate_at_deposit=1.0)
+        rows.append((settings, state))
+    return rows
+
+
+def measure_variant(users: int, settings_cls, state_cls) -> Dict[str, float]:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    rows = _build(users, settings_cls, state_cls)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    # One tick per user; "now" is fixed so every row takes the same (converting) path
+    now = datetime.utcnow() + timedelta(minutes=5)
+    for settings, state in rows:
+        optimisation_tick(settings, state, MarketCondition.OK, current_fx_rate=1.01, now=now)
+    start = time.perf_counter()
+    for settings, state in rows:
+        optimisation_tick(settings, state, MarketCondition.OK, current_fx_rate=1.01, now=now)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "bytes_per_user": used / users,
+        "mb_per_million_users": used / users * 1_000_000 / 2**20,
+        "tick_us_per_user": elapsed / users * 1e6,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Per-user memory and tick cost of routing_service rows")
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--json", action="store_true", help="print a JSON report")
+    args = parser.parse_args(argv)
+
+    report = {
+        "users": args.users,
+        "slotted": measure_variant(args.users, UserSettings, UserState),
+        "dict": measure_variant(args.users, _without_slots(UserSettings), _without_slots(UserState)),
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+
+    print(f"{args.users:,} users")
+    for name in ("slotted", "dict"):
+        r = report[name]
+        print(
+            f"  {name:8s} {r['bytes_per_user']:7.0f} B/user  {r['mb_per_million_users']:8.1f} MB per 1M users"
+            f"  {r['tick_us_per_user']:6.2f} us/tick"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
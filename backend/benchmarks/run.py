@@ -0,0 +1,68 @@
+"""
+Run the backend benchmarks and gate on regressions.
+
+    cd backend
+    python -m benchmarks.run                  # run + compare with baselines.json
+    python -m benchmarks.run --only routing   # just the scalar functions
+    python -m benchmarks.run --only store     # in-memory vs SQLite user store
+    python -m benchmarks.run --save           # record new baselines
+
+Exits with status 1 when any benchmark is slower than the stored baseline
+by more than --threshold (default 30%).
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+# before any benchmark module imports app: main.py needs Circle credentials
+# at import time (the benchmarks never call Circle), and app.state picks its
+# data dir on import, which must not be the real ./data
+os.environ.setdefault("CIRCLE_API_KEY", "bench")
+os.environ.setdefault("ENTITY_SECRET", "bench")
+os.environ.setdefault("CROSSPAY_RATE_LIMIT_DISABLED", "1")
+os.environ.setdefault("CROSSPAY_DATA_DIR", tempfile.mkdtemp(prefix="crosspay-bench-"))
+
+from .harness import compare, load_baseline, machine_info, run_all, save_baseline  # noqa: E402
+
+BENCH_MODULES = ("bench_routing", "bench_store", "bench_engines", "bench_http")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="CrossPay backend benchmarks")
+    parser.add_argument("--only", action="append", help="benchmark name prefix (repeatable), e.g. routing or http")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.30, help="allowed ops/sec drop, 0.30 = 30%%")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per measured run")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--save", action="store_true", help="write results as the new baseline")
+    args = parser.parse_args(argv)
+
+    for module in BENCH_MODULES:
+        __import__(f"{__package__}.{module}")
+
+    results = run_all(args.only, min_time=args.min_time, repeats=args.repeats)
+
+    if args.save:
+        save_baseline(args.baseline, results)
+        print(f"\nSaved baseline to {args.baseline}")
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if baseline["machine"] and baseline["machine"] != machine_info():
+        print(f"\nwarning: baseline was recorded on {baseline['machine']}, this is {machine_info()}")
+
+    print()
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print("\nRegressions beyond threshold:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())